@@ -1,8 +1,8 @@
-import requests
-import pandas as pd
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import PlainTextResponse
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from starlette.datastructures import Headers, MutableHeaders
 import os
 import json
 from typing import Dict, Any
@@ -11,14 +11,79 @@ from pathlib import Path
 from datetime import datetime
 import sqlite3
 from typing import List
-from bs4 import BeautifulSoup
-from urllib.parse import urlparse
+from urllib.parse import urldefrag, urljoin, urlparse
+from html.parser import HTMLParser
 import subprocess
+import asyncio
+import concurrent.futures
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import sys
 import re
 import base64
-import numpy as np
-import duckdb
+import email
+import email.utils
+import mailbox
+from io import BytesIO
+import gzip
+import hashlib
+import mimetypes
+import shutil
+import tempfile
+import time
+import random
+import heapq
+from email.utils import formatdate, parsedate_to_datetime
+import threading
+from collections import Counter, OrderedDict, deque
+from functools import lru_cache
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+import importlib
+import inspect
+import math
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Gauge, Histogram, generate_latest
+from prometheus_client import Counter as MetricCounter
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+
+class _LazyModule:
+    """
+    Stands in for a heavy module and imports it on first attribute access, so start-up only
+    pays for the libraries a request actually uses.
+    """
+
+    def __init__(self, name: str):
+        self.__dict__["_name"] = name
+        self.__dict__["_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_module"]
+        if module is None:
+            module = importlib.import_module(self.__dict__["_name"])
+            self.__dict__["_module"] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_module"] is not None else "not loaded"
+        return f"<lazy module {self.__dict__['_name']!r} ({state})>"
+
+
+def _lazy_import(name: str) -> _LazyModule:
+    return _LazyModule(name)
+
+
+requests = _lazy_import("requests")
+pd = _lazy_import("pandas")
+np = _lazy_import("numpy")
+duckdb = _lazy_import("duckdb")
+bs4 = _lazy_import("bs4")
+
+# Loaded in the background once the server is up (see warm_up_imports)
+WARMUP_IMPORTS = os.getenv("WARMUP_IMPORTS", "1") == "1"
+WARMUP_MODULES = (requests, np, pd, duckdb, bs4)
 
 
 app = FastAPI()
@@ -39,7 +104,681 @@ class RunTaskRequest(BaseModel):
     task: str
 
 
-app = FastAPI()
+def warm_up_imports():
+    """Imports the lazily loaded libraries so the first requests that need them do not wait."""
+    started = time.perf_counter()
+    for module in WARMUP_MODULES:
+        try:
+            module._load()
+        except ImportError as e:
+            print(f"Warm-up could not import {module!r}: {e}")
+    print(f"Warm-up imports finished in {time.perf_counter() - started:.2f}s")
+
+
+@asynccontextmanager
+async def _lifespan(app):
+    if WARMUP_IMPORTS:
+        # Runs after start-up completes, while the server is already accepting requests
+        threading.Thread(target=warm_up_imports, name="warm-up", daemon=True).start()
+    yield
+
+
+app = FastAPI(lifespan=_lifespan)
+
+
+# Prometheus metrics, served on /metrics
+STAGE_SECONDS = Histogram(
+    "app_stage_duration_seconds", "Time spent per request stage", ["stage"]
+)
+TOOL_SECONDS = Histogram(
+    "app_tool_duration_seconds", "Execution time per tool", ["tool", "outcome"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+)
+TOOL_IN_FLIGHT = Gauge(
+    "app_tool_in_flight", "Tool executions currently running", ["tool"],
+    multiprocess_mode="livesum",
+)
+LLM_TOKENS = MetricCounter("app_llm_tokens_total", "Tokens reported by the AI proxy", ["kind"])
+CACHE_EVENTS = MetricCounter("app_cache_events_total", "Cache lookups by outcome", ["cache", "result"])
+OUTBOUND_SECONDS = Histogram(
+    "app_outbound_request_seconds", "Outbound HTTP latency to response headers", ["host", "status"]
+)
+
+_stage_histograms = {}
+# Set by profile_call to collect the stage timings of one request
+_stage_timings = contextvars.ContextVar("stage_timings", default=None)
+
+
+@contextmanager
+def observe_stage(stage: str):
+    """Times the enclosed block into app_stage_duration_seconds{stage=...}."""
+    histogram = _stage_histograms.get(stage)
+    if histogram is None:
+        histogram = _stage_histograms[stage] = STAGE_SECONDS.labels(stage)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed)
+        timings = _stage_timings.get()
+        if timings is not None:
+            timings[stage] += elapsed
+
+
+def record_cache_event(cache: str, result: str):
+    CACHE_EVENTS.labels(cache, result).inc()
+
+
+# Set by /run/stream to receive progress events from the task it is running
+_progress_callback = contextvars.ContextVar("progress_callback", default=None)
+
+
+def report_progress(stage: str, **fields):
+    """Sends a progress event to the streaming client, if any. A no-op for ordinary requests."""
+    callback = _progress_callback.get()
+    if callback is not None:
+        callback(stage, fields)
+
+
+def observe_outbound(response, *args, **kwargs):
+    """requests response hook recording latency by host and status class."""
+    OUTBOUND_SECONDS.labels(
+        urlparse(response.url).netloc, f"{response.status_code // 100}xx"
+    ).observe(response.elapsed.total_seconds())
+    return response
+
+
+class StatsCollector:
+    """Exposes the in-process stats counters (outbound policy, tool selection, single-flight)."""
+
+    def collect(self):
+        outbound = CounterMetricFamily(
+            "app_outbound_events", "AI proxy call events", labels=["event"]
+        )
+        for event, count in list(outbound_stats.items()):
+            outbound.add_metric([event], count)
+        yield outbound
+
+        breaker = GaugeMetricFamily(
+            "app_circuit_breaker_state", "AI proxy breaker state: 0 closed, 1 half-open, 2 open"
+        )
+        breaker.add_metric([], {"closed": 0, "half_open": 1, "open": 2}[aiproxy_breaker.state])
+        yield breaker
+        yield CounterMetricFamily(
+            "app_circuit_breaker_trips", "Times the AI proxy breaker opened", value=aiproxy_breaker.trips
+        )
+        yield CounterMetricFamily(
+            "app_circuit_breaker_rejected", "Calls rejected by the open breaker",
+            value=aiproxy_breaker.rejected,
+        )
+        yield GaugeMetricFamily(
+            "app_retry_budget_tokens", "Retries currently allowed by the budget",
+            value=aiproxy_retry_budget.tokens,
+        )
+
+        selection = CounterMetricFamily(
+            "app_tool_selection", "Tool pre-selection counters", labels=["counter"]
+        )
+        for counter, value in list(tool_selection_stats.items()):
+            selection.add_metric([counter], value)
+        yield selection
+
+        coalesced = CounterMetricFamily(
+            "app_single_flight_coalesced", "Requests that joined an in-flight call", labels=["flight"]
+        )
+        for flight in (task_single_flight, execution_single_flight):
+            coalesced.add_metric([flight.name], flight.coalesced)
+        yield coalesced
+
+        admission = admission_controller.summary()
+        yield GaugeMetricFamily(
+            "app_admission_limit", "Current adaptive in-flight limit", value=admission["limit"]
+        )
+        yield GaugeMetricFamily(
+            "app_admission_in_flight", "Admitted requests in progress", value=admission["in_flight"]
+        )
+        yield GaugeMetricFamily(
+            "app_admission_queue_depth", "Requests waiting for a slot", value=admission["queue_depth"]
+        )
+        rejected = CounterMetricFamily(
+            "app_admission_rejected", "Requests shed by admission control", labels=["reason"]
+        )
+        for reason in ("queue_full", "queue_timeout"):
+            rejected.add_metric([reason], admission["rejected"].get(reason, 0))
+        yield rejected
+
+        tool_waiting = GaugeMetricFamily(
+            "app_tool_queue_depth", "Calls waiting for a per-tool slot", labels=["tool"]
+        )
+        tool_rejected = CounterMetricFamily(
+            "app_tool_rejected", "Calls shed by per-tool limits", labels=["tool"]
+        )
+        for name, state in tool_limiter.summary().items():
+            tool_waiting.add_metric([name], state["waiting"])
+            tool_rejected.add_metric([name], state["rejected"])
+        yield tool_waiting
+        yield tool_rejected
+
+
+# Point at benchmarks/mock_aiproxy.py (e.g. http://127.0.0.1:8001/openai/v1) for offline load tests
+AIPROXY_BASE_URL = os.getenv(
+    "AIPROXY_BASE_URL", "https://aiproxy.sanand.workers.dev/openai/v1"
+).rstrip("/")
+
+# Total time an incoming request may spend; clients can lower it with an X-Request-Timeout header
+REQUEST_DEADLINE = float(os.getenv("REQUEST_DEADLINE", "120"))
+OUTBOUND_CONNECT_TIMEOUT = float(os.getenv("OUTBOUND_CONNECT_TIMEOUT", "5"))
+# Cap on a single attempt, further limited by the time left before the request deadline
+OUTBOUND_READ_TIMEOUT = float(os.getenv("OUTBOUND_READ_TIMEOUT", "60"))
+OUTBOUND_MAX_RETRIES = int(os.getenv("OUTBOUND_MAX_RETRIES", "3"))
+OUTBOUND_BACKOFF_BASE = float(os.getenv("OUTBOUND_BACKOFF_BASE", "0.25"))
+OUTBOUND_BACKOFF_MAX = float(os.getenv("OUTBOUND_BACKOFF_MAX", "8"))
+# Retries allowed per call on average; a burst of failures cannot multiply load beyond this
+OUTBOUND_RETRY_BUDGET = float(os.getenv("OUTBOUND_RETRY_BUDGET", "0.2"))
+# Send a second copy of a call that is still pending after the observed p95 latency
+OUTBOUND_HEDGE_ENABLED = os.getenv("OUTBOUND_HEDGE_ENABLED", "0") == "1"
+OUTBOUND_HEDGE_MIN_DELAY = float(os.getenv("OUTBOUND_HEDGE_MIN_DELAY", "0.5"))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", "30"))
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class OutboundUnavailable(IOError):
+    """Raised without contacting the proxy when the breaker is open or the deadline has passed."""
+
+
+class DeadlineMiddleware:
+    """Stamps each HTTP request with a deadline that outbound calls made on its behalf respect."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        budget = REQUEST_DEADLINE
+        requested = Headers(scope=scope).get("x-request-timeout")
+        if requested:
+            try:
+                budget = min(budget, float(requested))
+            except ValueError:
+                pass
+        token = _request_deadline.set(time.monotonic() + budget)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_deadline.reset(token)
+
+
+def remaining_time():
+    """Seconds left before the current request's deadline, or None outside a request."""
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class CircuitBreaker:
+    """
+    Opens after BREAKER_FAILURE_THRESHOLD consecutive failures and rejects calls until
+    BREAKER_RESET_TIMEOUT has passed, then lets a single trial call decide whether to close.
+    """
+
+    def __init__(self, threshold: int, reset_timeout: float):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self.trips = 0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.rejected += 1
+            return False
+
+    def record(self, success: bool):
+        with self._lock:
+            self._trial_in_flight = False
+            if success:
+                self.state = "closed"
+                self.failures = 0
+                return
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.trips += 1
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+
+class RetryBudget:
+    """Token bucket: every call deposits `ratio` tokens and every retry spends one."""
+
+    def __init__(self, ratio: float, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class LatencyWindow:
+    """Recent successful attempt latencies, used to pick the hedging delay."""
+
+    def __init__(self, size: int = 200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, fraction: float):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 20:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+aiproxy_breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+aiproxy_retry_budget = RetryBudget(OUTBOUND_RETRY_BUDGET)
+aiproxy_latency = LatencyWindow()
+outbound_stats = Counter()
+
+_aiproxy_session = None
+_aiproxy_session_lock = threading.Lock()
+_hedge_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+
+
+def _get_aiproxy_session():
+    """Pooled session shared by all proxy calls, created on first use."""
+    global _aiproxy_session
+    with _aiproxy_session_lock:
+        if _aiproxy_session is None:
+            session = requests.Session()
+            session.hooks["response"].append(observe_outbound)
+            session.mount(
+                "https://", requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            )
+            _aiproxy_session = session
+    return _aiproxy_session
+
+
+def _retry_delay(attempt: int, response=None) -> float:
+    """
+    Full-jitter exponential backoff, honouring a numeric Retry-After from the proxy up to
+    OUTBOUND_BACKOFF_MAX. aiproxy_post gives up instead when the delay passes the deadline.
+    """
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(float(response.headers["Retry-After"]), OUTBOUND_BACKOFF_MAX)
+    return random.uniform(0, min(OUTBOUND_BACKOFF_MAX, OUTBOUND_BACKOFF_BASE * 2 ** attempt))
+
+
+def _attempt_timeout():
+    remaining = remaining_time()
+    if remaining is not None and remaining <= 0:
+        raise OutboundUnavailable("Request deadline exceeded before calling the AI proxy")
+    read_timeout = OUTBOUND_READ_TIMEOUT if remaining is None else min(OUTBOUND_READ_TIMEOUT, remaining)
+    return (min(OUTBOUND_CONNECT_TIMEOUT, read_timeout), read_timeout)
+
+
+def _send_once(url: str, body: bytes, headers: Dict[str, str], timeout) -> "requests.Response":
+    started = time.perf_counter()
+    response = _get_aiproxy_session().post(
+        url, data=body, headers=headers, timeout=timeout, verify=False
+    )
+    if response.status_code not in RETRYABLE_STATUS_CODES:
+        aiproxy_latency.add(time.perf_counter() - started)
+    return response
+
+
+def _send_hedged(url: str, body: bytes, headers: Dict[str, str], timeout) -> "requests.Response":
+    """Sends the call and, if it is still pending after the p95 delay, a second copy; first one wins."""
+    hedge_delay = aiproxy_latency.percentile(0.95)
+    if not OUTBOUND_HEDGE_ENABLED or hedge_delay is None:
+        return _send_once(url, body, headers, timeout)
+
+    hedge_delay = max(OUTBOUND_HEDGE_MIN_DELAY, hedge_delay)
+    attempts = [_hedge_executor.submit(_send_once, url, body, headers, timeout)]
+    done, _ = concurrent.futures.wait(attempts, timeout=hedge_delay)
+    if not done:
+        outbound_stats["hedges"] += 1
+        attempts.append(_hedge_executor.submit(_send_once, url, body, headers, timeout))
+
+    error = None
+    for future in concurrent.futures.as_completed(attempts):
+        try:
+            response = future.result()
+        except requests.exceptions.RequestException as e:
+            error = e
+            continue
+        if future is not attempts[0]:
+            outbound_stats["hedge_wins"] += 1
+        return response
+    raise error
+
+
+def aiproxy_post(path: str, payload: Dict[str, Any] = None, data: bytes = None) -> "requests.Response":
+    """
+    POSTs to the AI proxy under the shared outbound policy: the current request's deadline bounds
+    every attempt, 429/5xx and connection errors are retried with jittered backoff while the retry
+    budget allows, slow calls can be hedged, and an open circuit breaker fails fast. Returns the
+    last response, so callers keep using raise_for_status().
+    """
+    url = AIPROXY_BASE_URL + path
+    body = data if data is not None else json.dumps(payload).encode("utf-8")
+    headers = {"Content-Type": "application/json", "Authorization": f"Bearer {AIPROXY_Token}"}
+
+    outbound_stats["calls"] += 1
+    aiproxy_retry_budget.deposit()
+    attempt = 0
+    while True:
+        if not aiproxy_breaker.allow():
+            raise OutboundUnavailable("AI proxy circuit breaker is open; failing fast")
+
+        response, error = None, None
+        recorded = False
+        try:
+            try:
+                response = _send_hedged(url, body, headers, _attempt_timeout())
+            except OutboundUnavailable:
+                aiproxy_breaker.record(True)  # not the proxy's fault; release a half-open trial
+                recorded = True
+                raise
+            except (
+                requests.exceptions.ConnectionError,
+                requests.exceptions.Timeout,
+                requests.exceptions.ChunkedEncodingError,
+            ) as e:
+                error = e
+            retryable = error is not None or response.status_code in RETRYABLE_STATUS_CODES
+            aiproxy_breaker.record(not retryable)
+            recorded = True
+        finally:
+            if not recorded:
+                # Any other failure (bad URL, redirect loop, undecodable body) still counts, and
+                # must not leave a half-open trial in flight forever
+                aiproxy_breaker.record(False)
+        if not retryable:
+            return response
+
+        outbound_stats["retryable_failures"] += 1
+        delay = _retry_delay(attempt, response)
+        remaining = remaining_time()
+        if (
+            attempt >= OUTBOUND_MAX_RETRIES
+            or (remaining is not None and remaining <= delay)
+            or not aiproxy_retry_budget.withdraw()
+        ):
+            outbound_stats["gave_up"] += 1
+            if error is not None:
+                raise error
+            return response
+
+        attempt += 1
+        outbound_stats["retries"] += 1
+        print(f"Retrying AI proxy call to {path} in {delay:.2f}s (attempt {attempt})")
+        time.sleep(delay)
+
+
+def outbound_summary() -> Dict[str, Any]:
+    return {
+        **outbound_stats,
+        "breaker_state": aiproxy_breaker.state,
+        "breaker_consecutive_failures": aiproxy_breaker.failures,
+        "breaker_trips": aiproxy_breaker.trips,
+        "breaker_rejected": aiproxy_breaker.rejected,
+        "retry_budget_tokens": round(aiproxy_retry_budget.tokens, 2),
+        "latency_p50": aiproxy_latency.percentile(0.5),
+        "latency_p95": aiproxy_latency.percentile(0.95),
+        "hedging_enabled": OUTBOUND_HEDGE_ENABLED,
+    }
+
+
+# Admission control for /run and /run/stream: the in-flight limit adapts between these bounds
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv("ADMISSION_MAX_IN_FLIGHT", "64"))
+ADMISSION_MIN_IN_FLIGHT = int(os.getenv("ADMISSION_MIN_IN_FLIGHT", "4"))
+# Requests waiting for a slot; beyond this new requests are turned away at once with a 429
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "128"))
+# Longest wait for a slot, further limited by the request deadline, before a 503
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "10"))
+# AI proxy calls slower than this (or failing) shrink the limit; 0 keeps it fixed at the maximum
+ADMISSION_LATENCY_TARGET = float(os.getenv("ADMISSION_LATENCY_TARGET", "5"))
+ADMISSION_DECREASE_FACTOR = float(os.getenv("ADMISSION_DECREASE_FACTOR", "0.7"))
+# Concurrent executions allowed per tool, e.g. "setup_and_run_datagen=1,scrape_website=8"
+TOOL_CONCURRENCY_LIMITS = {
+    name.strip(): int(limit)
+    for name, _, limit in (
+        item.partition("=")
+        for item in os.getenv(
+            "TOOL_CONCURRENCY_LIMITS", "setup_and_run_datagen=1,scrape_website=8"
+        ).split(",")
+    )
+    if name.strip() and limit.strip()
+}
+
+
+class Overloaded(HTTPException):
+    """Request shed by admission control; carries a Retry-After header."""
+
+    def __init__(self, status_code: int, detail: str, retry_after: int):
+        super().__init__(status_code=status_code, detail=detail, headers={"Retry-After": str(retry_after)})
+
+
+def _grant_waiter(future):
+    if not future.done():
+        future.set_result(True)
+
+
+class AdmissionController:
+    """
+    Admits up to `limit` concurrent requests and queues at most `queue_size` more in FIFO order.
+    The limit follows AIMD on AI proxy latency: +1/limit per fast call, times `decrease_factor`
+    (at most once per `latency_target` seconds) on a slow or failed one. Waiters can belong to
+    different event loops, so a freed slot is handed over with call_soon_threadsafe.
+    """
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int,
+        queue_size: int,
+        queue_timeout: float,
+        latency_target: float,
+        decrease_factor: float,
+    ):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        self.limit = float(self.max_limit)
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected = Counter()
+        self.decreases = 0
+        self.service_time = 1.0  # moving average of admitted request durations
+        self._waiters = deque()
+        self._last_decrease = 0.0
+        self._lock = threading.Lock()
+
+    def retry_after(self) -> int:
+        """Rough seconds until the queue drains, for Retry-After headers."""
+        return max(1, math.ceil(self.service_time * (len(self._waiters) + 1) / max(1, int(self.limit))))
+
+    def _grant(self):
+        # Caller holds the lock
+        while self._waiters and self.in_flight < int(self.limit):
+            loop, future = self._waiters.popleft()
+            self.in_flight += 1
+            self.admitted += 1
+            try:
+                loop.call_soon_threadsafe(_grant_waiter, future)
+            except RuntimeError:  # the waiter's loop has closed
+                self.in_flight -= 1
+
+    def _withdraw(self, waiter) -> bool:
+        """Takes a waiter out of the queue; False means it was already granted a slot."""
+        with self._lock:
+            try:
+                self._waiters.remove(waiter)
+                return True
+            except ValueError:
+                return False
+
+    async def acquire(self):
+        with self._lock:
+            if self.in_flight < int(self.limit) and not self._waiters:
+                self.in_flight += 1
+                self.admitted += 1
+                return
+            if len(self._waiters) >= self.queue_size:
+                self.rejected["queue_full"] += 1
+                raise Overloaded(429, "Server is busy, retry later", self.retry_after())
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        timeout = self.queue_timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            timeout = max(0.0, min(timeout, remaining))
+        try:
+            await asyncio.wait((waiter[1],), timeout=timeout)
+        except asyncio.CancelledError:
+            # Client went away; give back a slot granted in the meantime
+            if not self._withdraw(waiter):
+                self.release()
+            raise
+        if self._withdraw(waiter):
+            self.rejected["queue_timeout"] += 1
+            raise Overloaded(503, "Timed out waiting for capacity", self.retry_after())
+
+    def release(self, duration: float = None):
+        with self._lock:
+            self.in_flight -= 1
+            if duration is not None:
+                self.service_time = 0.8 * self.service_time + 0.2 * duration
+            self._grant()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.release(time.monotonic() - started)
+
+    def record_latency(self, seconds: float, ok: bool):
+        """Feeds one AI proxy call into the adaptive limit."""
+        if self.latency_target <= 0:
+            return
+        with self._lock:
+            if ok and seconds <= self.latency_target:
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+                self._grant()
+                return
+            now = time.monotonic()
+            # Calls that were in flight together are slow together; cut the limit once for them
+            if now - self._last_decrease >= self.latency_target:
+                self._last_decrease = now
+                self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+                self.decreases += 1
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "limit_decreases": self.decreases,
+            "service_time": round(self.service_time, 4),
+        }
+
+
+class ToolLimiter:
+    """Per-tool concurrency caps for the blocking tool calls; callers wait up to the queue timeout."""
+
+    def __init__(self, limits: Dict[str, int], timeout: float):
+        self.limits = {name: limit for name, limit in limits.items() if limit > 0}
+        self.timeout = timeout
+        self.waiting = Counter()
+        self.rejected = Counter()
+        self._semaphores = {name: threading.BoundedSemaphore(limit) for name, limit in self.limits.items()}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, name: str):
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            yield
+            return
+        timeout = self.timeout
+        remaining = remaining_time()
+        if remaining is not None:
+            timeout = max(0.0, min(timeout, remaining))
+        with self._lock:
+            self.waiting[name] += 1
+        try:
+            acquired = semaphore.acquire(timeout=timeout)
+        finally:
+            with self._lock:
+                self.waiting[name] -= 1
+        if not acquired:
+            with self._lock:
+                self.rejected[name] += 1
+            raise Overloaded(
+                503, f"Too many concurrent {name} calls", admission_controller.retry_after()
+            )
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            name: {"limit": limit, "waiting": self.waiting[name], "rejected": self.rejected[name]}
+            for name, limit in self.limits.items()
+        }
+
+
+admission_controller = AdmissionController(
+    ADMISSION_MAX_IN_FLIGHT,
+    ADMISSION_MIN_IN_FLIGHT,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_QUEUE_TIMEOUT,
+    ADMISSION_LATENCY_TARGET,
+    ADMISSION_DECREASE_FACTOR,
+)
+tool_limiter = ToolLimiter(TOOL_CONCURRENCY_LIMITS, ADMISSION_QUEUE_TIMEOUT)
 
 
 def setup_and_run_datagen(user_email: str):
@@ -66,11 +805,13 @@ def setup_and_run_datagen(user_email: str):
         # Download datagen.py with better error handling
         try:
             print(f"Downloading script from: {datagen_url}")
+            report_progress("download", state="start", url=datagen_url)
             response = requests.get(datagen_url, timeout=30)
             response.raise_for_status()
             with open(script_path, 'wb') as f:
                 f.write(response.content)
             print("Script downloaded successfully")
+            report_progress("download", state="done", bytes=len(response.content))
         except requests.exceptions.RequestException as e:
             error_msg = f"Failed to download datagen.py: {str(e)}"
             print(error_msg)
@@ -79,6 +820,7 @@ def setup_and_run_datagen(user_email: str):
         # Set up virtual environment and install dependencies
         try:
             print("Setting up virtual environment...")
+            report_progress("venv", state="start")
             venv_cmd = ["python", "-m", "venv", os.path.join(temp_dir, "venv")]
             subprocess.run(venv_cmd, check=True, capture_output=True, text=True)
 
@@ -90,11 +832,14 @@ def setup_and_run_datagen(user_email: str):
 
             # Install requirements including Pillow
             print("Installing requirements...")
+            report_progress("install", state="start", packages=["faker", "Pillow"])
             pip_cmd = [venv_python, "-m", "pip", "install", "faker", "Pillow"]  # Added Pillow here
             subprocess.run(pip_cmd, check=True, capture_output=True, text=True)
+            report_progress("install", state="done")
 
             # Run datagen.py with timeout
             print(f"Running script with email: {user_email}")
+            report_progress("datagen", state="start")
             process = subprocess.run(
                 [venv_python, script_path, user_email],
                 check=True,
@@ -104,6 +849,7 @@ def setup_and_run_datagen(user_email: str):
             )
 
             print("Script execution completed")
+            report_progress("datagen", state="done")
             return {
                 "status": "success",
                 "message": f"Data generation completed successfully for {user_email}",
@@ -267,41 +1013,165 @@ def generate_markdown_index(input_location: str, output_location: str):
     return {"status": "success", "message": f"Markdown index saved to {output_path}."}
 
 
+EMAIL_ADDRESS_PATTERN = re.compile(r"^[\w.!#$%&'*+/=?^`{|}~-]+@[\w-]+(?:\.[\w-]+)+$")
+FORWARDED_MESSAGE_PATTERN = re.compile(
+    r"^(?:-+ ?Forwarded message ?-+|Begin forwarded message:)", re.IGNORECASE | re.MULTILINE
+)
+# Below this many messages a batch is parsed in-process; process start-up would cost more
+EMAIL_PARALLEL_THRESHOLD = int(os.getenv("EMAIL_PARALLEL_THRESHOLD", "500"))
+EMAIL_LLM_MAX_WORKERS = int(os.getenv("EMAIL_LLM_MAX_WORKERS", "4"))
+
+
+def parse_sender_locally(text: str):
+    """
+    Reads the sender from the message headers with the stdlib email parser.
+    Returns (address, header) or (None, reason) when the headers are missing or ambiguous:
+    no From, several From addresses without a single Sender, or a forwarded message
+    whose original sender is in the body.
+    """
+    message = email.message_from_string(text)
+    if FORWARDED_MESSAGE_PATTERN.search(text):
+        return None, "forwarded message"
+
+    for header in ("From", "Sender"):
+        values = message.get_all(header) or []
+        addresses = [
+            address.strip()
+            for _, address in email.utils.getaddresses(values)
+            if EMAIL_ADDRESS_PATTERN.match(address.strip())
+        ]
+        if len(set(address.lower() for address in addresses)) == 1:
+            return addresses[0], header
+    if not message.get_all("From"):
+        return None, "missing From header"
+    return None, "ambiguous From header"
+
+
+def _extract_sender_with_llm(text: str) -> str:
+    # Define the LLM extraction task
+    messages = [
+        {
+            "role": "system",
+            "content": "You are an AI assistant that extracts the sender's email from an email message.",
+        },
+        {
+            "role": "user",
+            "content": f"Extract the sender's email address from the following email message. The sender is the person who originally sent the email, not the recipient. Identify the sender by analyzing the email structure, headers, and context. Return only the sender's email address as plain text, nothing else:\n\n{text}",
+        },
+    ]
+
+    # Make API call
+    response = aiproxy_post(
+        "/chat/completions",
+        {"model": "gpt-4o-mini", "messages": messages, "temperature": 0.2},
+    )
+
+    response.raise_for_status()
+
+    # Extract response content
+    result = response.json()
+    return result["choices"][0]["message"]["content"].strip()
+
+
+def _iter_mailbox_messages(input_location: str):
+    """Yields (source, text) for a Maildir, an mbox file or a directory of .txt/.eml messages."""
+    if os.path.isdir(input_location):
+        if all(os.path.isdir(os.path.join(input_location, sub)) for sub in ("cur", "new", "tmp")):
+            maildir = mailbox.Maildir(input_location, factory=None, create=False)
+            for key, message in maildir.iteritems():
+                yield key, message.as_string()
+            return
+        for path in sorted(Path(input_location).iterdir()):
+            if path.is_file() and path.suffix.lower() in (".txt", ".eml"):
+                yield str(path), path.read_text(encoding="utf-8", errors="replace")
+        return
+
+    mbox = mailbox.mbox(input_location, create=False)
+    try:
+        for key, message in mbox.iteritems():
+            yield f"{input_location}#{key}", message.as_string()
+    finally:
+        mbox.close()
+
+
+def _is_mailbox(input_location: str) -> bool:
+    """
+    Directories and .mbox files are mailboxes. Any other file is a single message, unless it is
+    an mbox holding more than one; a saved message can start with a "From " envelope line too.
+    """
+    if os.path.isdir(input_location) or input_location.lower().endswith(".mbox"):
+        return True
+    with open(input_location, "rb") as f:
+        if f.read(5) != b"From ":
+            return False
+    mbox = mailbox.mbox(input_location, create=False)
+    try:
+        return len(mbox) > 1
+    finally:
+        mbox.close()
+
+
+def _extract_senders_batch(input_location: str, output_location: str):
+    """Parses every message of a mailbox in parallel and writes source,sender,method CSV rows."""
+    import csv
+
+    sources, texts = [], []
+    for source, text in _iter_mailbox_messages(input_location):
+        sources.append(source)
+        texts.append(text)
+
+    if len(texts) >= EMAIL_PARALLEL_THRESHOLD:
+        with ProcessPoolExecutor() as executor:
+            parsed = list(executor.map(parse_sender_locally, texts, chunksize=64))
+    else:
+        parsed = [parse_sender_locally(text) for text in texts]
+
+    # Only messages the headers could not settle go to the LLM, a few at a time
+    pending = [index for index, (address, _) in enumerate(parsed) if address is None]
+
+    def llm_one(index):
+        try:
+            return _extract_sender_with_llm(texts[index]), "llm"
+        except Exception as e:
+            return "", f"error: {e}"
+
+    with ThreadPoolExecutor(max_workers=EMAIL_LLM_MAX_WORKERS) as executor:
+        for index, outcome in zip(pending, executor.map(llm_one, pending)):
+            parsed[index] = outcome
+
+    with open(output_location, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["source", "sender_email", "method"])
+        for source, (address, method) in zip(sources, parsed):
+            writer.writerow([source, address, method])
+
+    return {
+        "status": "success",
+        "message": f"Senders of {len(sources)} messages saved to {output_location}",
+        "message_count": len(sources),
+        "parsed_locally": len(sources) - len(pending),
+        "llm_fallbacks": len(pending),
+    }
+
+
 def extract_sender_email(input_location: str, output_location: str):
-    """Reads an email file, extracts the sender's email address, and saves it to an output file."""
+    """
+    Reads an email file, extracts the sender's email address, and saves it to an output file.
+    The headers are parsed locally first; the LLM is only asked when they are missing or
+    ambiguous. A Maildir, mbox file or directory of messages produces a CSV of senders.
+    """
     try:
+        if _is_mailbox(input_location):
+            return _extract_senders_batch(input_location, output_location)
+
         # Read content from the input file
         with open(input_location, "r", encoding="utf-8") as f:
             text = f.read()
 
-        # Define the LLM extraction task
-        messages = [
-            {
-                "role": "system",
-                "content": "You are an AI assistant that extracts the sender's email from an email message.",
-            },
-            {
-                "role": "user",
-                "content": f"Extract the sender's email address from the following email message. The sender is the person who originally sent the email, not the recipient. Identify the sender by analyzing the email structure, headers, and context. Return only the sender's email address as plain text, nothing else:\n\n{text}",
-            },
-        ]
-
-        # Make API call
-        response = requests.post(
-            "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {AIPROXY_Token}",
-            },
-            json={"model": "gpt-4o-mini", "messages": messages, "temperature": 0.2},
-            verify=False,
-        )
-
-        response.raise_for_status()
-
-        # Extract response content
-        result = response.json()
-        sender_email = result["choices"][0]["message"]["content"].strip()
+        sender_email, method = parse_sender_locally(text)
+        if sender_email is None:
+            print(f"Falling back to the LLM for {input_location}: {method}")
+            sender_email, method = _extract_sender_with_llm(text), "llm"
 
         # Save the extracted sender's email to the output file
         with open(output_location, "w", encoding="utf-8") as f:
@@ -310,13 +1180,283 @@ def extract_sender_email(input_location: str, output_location: str):
         return {
             "status": "success",
             "message": f"Sender's email extracted and saved to {output_location}",
+            "method": method,
         }
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error extracting sender's email: {str(e)}")
 
 
-def calculate_gold_sales(input_location: str, output_location: str):
+DATA_DIR = "data"
+DATA_WORKSPACE_ENABLED = os.getenv("DATA_WORKSPACE_ENABLED", "0") == "1"
+DATA_WORKSPACE_MEMORY_LIMIT = os.getenv("DATA_WORKSPACE_MEMORY_LIMIT", "1GB")
+# "table" materializes CSV/JSON files once per change, "view" re-reads them on every query
+DATA_WORKSPACE_CSV_MODE = os.getenv("DATA_WORKSPACE_CSV_MODE", "table")
+
+
+class DataWorkspace:
+    """
+    Shared in-process DuckDB database over the files in data/.
+
+    CSV and JSON files become tables (or views), Parquet files become views and SQLite/DuckDB
+    files are attached as databases. Each file is re-registered when its size or mtime changes,
+    so callers always query current data without re-parsing unchanged inputs.
+    """
+
+    def __init__(self, root: str = DATA_DIR, memory_limit: str = DATA_WORKSPACE_MEMORY_LIMIT):
+        self.root = os.path.abspath(root)
+        self.memory_limit = memory_limit
+        self._conn = None
+        self._sources = {}  # absolute path -> (signature, relation name)
+        self._lock = threading.RLock()
+
+    def _connection(self):
+        if self._conn is None:
+            self._conn = duckdb.connect(":memory:")
+            self._conn.execute(f"SET memory_limit = '{self.memory_limit}'")
+        return self._conn
+
+    def contains(self, path: str) -> bool:
+        return os.path.abspath(path).startswith(self.root + os.sep)
+
+    def relation_name(self, path: str) -> str:
+        relative = os.path.splitext(os.path.relpath(os.path.abspath(path), self.root))[0]
+        name = re.sub(r"\W+", "_", relative).strip("_").lower() or "data"
+        return f"t_{name}" if name[0].isdigit() else name
+
+    def _unique_name(self, abs_path: str) -> str:
+        name = self.relation_name(abs_path)
+        taken = {relation for _, relation in self._sources.values()}
+        if name in taken:
+            name = f"{name}_{os.path.splitext(abs_path)[1].lstrip('.').lower()}"
+        suffix = 2
+        base = name
+        while name in taken:
+            name = f"{base}_{suffix}"
+            suffix += 1
+        return name
+
+    def register(self, path: str) -> str:
+        """Registers or refreshes a data file and returns the table, view or database name for it."""
+        abs_path = os.path.abspath(path)
+        if not self.contains(abs_path):
+            raise ValueError(f"{path} is outside the data workspace {self.root}")
+        stat = os.stat(abs_path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        with self._lock:
+            cached = self._sources.get(abs_path)
+            if cached and cached[0] == signature:
+                return cached[1]
+
+            name = cached[1] if cached else self._unique_name(abs_path)
+            print(f"{'Refreshing' if cached else 'Registering'} workspace relation {name} for {path}")
+            self._load(abs_path, name, attached=bool(cached))
+            self._sources[abs_path] = (signature, name)
+            return name
+
+    def _load(self, abs_path: str, name: str, attached: bool):
+        conn = self._connection()
+        extension = os.path.splitext(abs_path)[1].lower()
+        literal = abs_path.replace("'", "''")
+        kind = "VIEW" if DATA_WORKSPACE_CSV_MODE == "view" else "TABLE"
+
+        if extension in (".csv", ".tsv"):
+            conn.execute(f'CREATE OR REPLACE {kind} "{name}" AS SELECT * FROM read_csv_auto(\'{literal}\')')
+        elif extension in (".json", ".ndjson", ".jsonl"):
+            conn.execute(f'CREATE OR REPLACE {kind} "{name}" AS SELECT * FROM read_json_auto(\'{literal}\')')
+        elif extension == ".parquet":
+            conn.execute(f'CREATE OR REPLACE VIEW "{name}" AS SELECT * FROM read_parquet(\'{literal}\')')
+        elif extension in (".db", ".sqlite", ".sqlite3", ".duckdb"):
+            if attached:
+                conn.execute(f'DETACH DATABASE IF EXISTS "{name}"')
+                conn.execute(f'DROP SCHEMA IF EXISTS "{name}" CASCADE')
+            options = "READ_ONLY" if extension == ".duckdb" else "TYPE SQLITE, READ_ONLY"
+            try:
+                conn.execute(f"ATTACH '{literal}' AS \"{name}\" ({options})")
+            except duckdb.Error as e:
+                if extension == ".duckdb":
+                    raise
+                # Without the sqlite extension, copy the tables into a schema of the same name
+                print(f"SQLite extension unavailable ({e}), copying tables into the workspace")
+                self._copy_sqlite(abs_path, name)
+        else:
+            raise ValueError(f"Unsupported workspace file type: {extension}")
+
+    def _copy_sqlite(self, abs_path: str, name: str):
+        conn = self._connection()
+        conn.execute(f'CREATE SCHEMA "{name}"')
+        source = sqlite3.connect(abs_path)
+        try:
+            tables = source.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+            ).fetchall()
+            for (table,) in tables:
+                schema, batches = _iter_arrow_batches(source, f'SELECT * FROM "{table}"', False)
+                arrow_table = _arrow_batches_to_table(schema, batches)
+                conn.register("_workspace_import", arrow_table)
+                conn.execute(f'CREATE TABLE "{name}"."{table}" AS SELECT * FROM _workspace_import')
+                conn.unregister("_workspace_import")
+        finally:
+            source.close()
+
+    def cursor(self, path: str = None):
+        """
+        Returns a DuckDB cursor on the workspace. When a database file is given, it is
+        registered and made the default so its tables can be queried by their own names.
+        """
+        name = self.register(path) if path else None
+        with self._lock:
+            cur = self._connection().cursor()
+        if name and os.path.splitext(path)[1].lower() in (".db", ".sqlite", ".sqlite3", ".duckdb"):
+            cur.execute(f'USE "{name}"')
+        return cur
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [
+                {"path": path, "relation": name, "mtime_ns": signature[0], "size": signature[1]}
+                for path, (signature, name) in self._sources.items()
+            ]
+
+
+_data_workspace = None
+_data_workspace_lock = threading.Lock()
+
+
+def get_data_workspace() -> DataWorkspace:
+    global _data_workspace
+    with _data_workspace_lock:
+        if _data_workspace is None:
+            _data_workspace = DataWorkspace()
+        return _data_workspace
+
+
+def use_data_workspace(path: str) -> bool:
+    """Whether a tool should read this input through the shared workspace."""
+    return DATA_WORKSPACE_ENABLED and bool(path) and get_data_workspace().contains(path)
+
+
+# Times a predicate shape must be seen on a database before the advisor recommends an index
+INDEX_ADVISOR_MIN_OCCURRENCES = int(os.getenv("INDEX_ADVISOR_MIN_OCCURRENCES", "2"))
+# Index creation also has to be switched on here, not only requested by the caller
+INDEX_ADVISOR_ALLOW_CREATE = os.getenv("INDEX_ADVISOR_ALLOW_CREATE", "0") == "1"
+
+_predicate_counts = Counter()
+_predicate_lock = threading.Lock()
+
+
+def explain_sql_query(conn, query: str, is_duckdb: bool) -> List[str]:
+    """Returns the plan of a query: EXPLAIN QUERY PLAN for SQLite, EXPLAIN ANALYZE for DuckDB."""
+    if is_duckdb:
+        rows = conn.execute(f"EXPLAIN ANALYZE {query}").fetchall()
+        return [line for row in rows for line in str(row[-1]).splitlines()]
+
+    rows = conn.execute(f"EXPLAIN QUERY PLAN {query}").fetchall()
+    # Rows are (id, parent, notused, detail); indent children under their parent
+    depth = {0: -1}
+    plan = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        plan.append("  " * depth[node_id] + detail)
+    return plan
+
+
+def _index_covers(conn, table: str, columns: List[str]) -> bool:
+    """Checks whether an existing index on the table already starts with the given columns."""
+    for index in conn.execute(f'PRAGMA index_list("{table}")').fetchall():
+        index_columns = [row[2] for row in conn.execute(f'PRAGMA index_info("{index[1]}")')]
+        if [c.lower() for c in index_columns[: len(columns)]] == [c.lower() for c in columns]:
+            return True
+    return False
+
+
+def advise_indexes(conn, query: str, db_path: str, create: bool = False) -> List[Dict[str, Any]]:
+    """
+    Records the filter columns of a single-table SQLite query and suggests a covering index
+    (filter columns first, then the other referenced columns) once the same predicate has been
+    seen INDEX_ADVISOR_MIN_OCCURRENCES times. The index is only created when `create` is set
+    and INDEX_ADVISOR_ALLOW_CREATE is enabled.
+    """
+    # Blank out string literals so values like 'Gold' are never mistaken for columns
+    stripped = re.sub(r"'(?:[^']|'')*'", "''", query)
+    table_match = re.search(r"\bFROM\s+[\"`\[]?(\w+)", stripped, re.IGNORECASE)
+    if not table_match or re.search(r"\bJOIN\b|,\s*\w+\s+WHERE", stripped, re.IGNORECASE):
+        return []
+    where_match = re.search(
+        r"\bWHERE\b(.*?)(?:\bGROUP\s+BY\b|\bORDER\s+BY\b|\bHAVING\b|\bLIMIT\b|$)",
+        stripped,
+        re.IGNORECASE | re.DOTALL,
+    )
+    if not where_match:
+        return []
+
+    table = table_match.group(1)
+    table_columns = {row[1].lower(): row[1] for row in conn.execute(f'PRAGMA table_info("{table}")')}
+    if not table_columns:
+        return []
+
+    def referenced(text, skip=()):
+        found = []
+        for token in re.findall(r"\w+", text):
+            column = table_columns.get(token.lower())
+            if column and column not in found and column not in skip:
+                found.append(column)
+        return found
+
+    where_clause = where_match.group(1)
+    # Equality predicates lead the index so lookups can seek on them, range predicates follow
+    equality_columns = referenced(
+        " ".join(re.findall(r"(\w+)\s*(?:=|\bIN\b|\bIS\b)", where_clause, re.IGNORECASE))
+    )
+    key_columns = equality_columns + referenced(where_clause, equality_columns)
+    if not key_columns:
+        return []
+    covering = not re.search(r"\bSELECT\s+(?:DISTINCT\s+)?\*", stripped, re.IGNORECASE)
+    index_columns = key_columns + (referenced(stripped, key_columns) if covering else [])
+
+    predicate_key = (os.path.abspath(db_path), table, tuple(key_columns))
+    with _predicate_lock:
+        _predicate_counts[predicate_key] += 1
+        occurrences = _predicate_counts[predicate_key]
+
+    index_name = f"idx_{table}_{'_'.join(index_columns)}".lower()
+    quoted_columns = ", ".join(f'"{column}"' for column in index_columns)
+    statement = f'CREATE INDEX IF NOT EXISTS "{index_name}" ON "{table}" ({quoted_columns})'
+    advice = {
+        "table": table,
+        "columns": index_columns,
+        "covering": covering,
+        "occurrences": occurrences,
+        "statement": statement,
+    }
+
+    if _index_covers(conn, table, index_columns):
+        advice["status"] = "exists"
+    elif occurrences < INDEX_ADVISOR_MIN_OCCURRENCES:
+        advice["status"] = "observed"
+    elif create and INDEX_ADVISOR_ALLOW_CREATE:
+        print(f"Creating index: {statement}")
+        conn.execute(statement)
+        conn.commit()
+        advice["status"] = "created"
+    else:
+        advice["status"] = "suggested"
+    return [advice]
+
+
+def _sql_profile(conn, query: str, is_duckdb: bool, elapsed: float, index_advice) -> Dict[str, Any]:
+    """Builds the profile section returned by the SQL tools when profile mode is on."""
+    return {
+        "execution_time_ms": round(elapsed * 1000, 3),
+        "plan": explain_sql_query(conn, query, is_duckdb),
+        "index_advice": index_advice,
+    }
+
+
+def calculate_gold_sales(
+    input_location: str, output_location: str, profile: bool = False, create_indexes: bool = False
+):
     """Calculate total sales for Gold ticket type and write to output file."""
     if not os.path.exists(input_location):
         raise HTTPException(
@@ -324,9 +1464,13 @@ def calculate_gold_sales(input_location: str, output_location: str):
         )
 
     try:
-        # Connect to SQLite database
-        conn = sqlite3.connect(input_location)
-        cursor = conn.cursor()
+        via_workspace = use_data_workspace(input_location)
+        if via_workspace:
+            # Query the workspace copy instead of opening the database file again
+            conn = get_data_workspace().cursor(input_location)
+        else:
+            # Connect to SQLite database
+            conn = sqlite3.connect(input_location)
 
         # Execute query to calculate total sales for Gold tickets
         query = """
@@ -334,8 +1478,18 @@ def calculate_gold_sales(input_location: str, output_location: str):
             FROM tickets 
             WHERE type = 'Gold'
         """
-        cursor.execute(query)
-        total_sales = cursor.fetchone()[0]
+        start = time.perf_counter()
+        total_sales = conn.execute(query).fetchone()[0]
+        elapsed = time.perf_counter() - start
+
+        # Only profiled or index-creating calls pay for (and count towards) the advisor
+        index_advice = (
+            advise_indexes(conn, query, input_location, create=create_indexes)
+            if (profile or create_indexes) and not via_workspace else []
+        )
+        profile_data = (
+            _sql_profile(conn, query, via_workspace, elapsed, index_advice) if profile else None
+        )
 
         # Close database connection
         conn.close()
@@ -344,10 +1498,13 @@ def calculate_gold_sales(input_location: str, output_location: str):
         with open(output_location, 'w', encoding='utf-8') as file:
             file.write(str(total_sales))
 
-        return {
+        result = {
             "status": "success",
             "message": f"Gold ticket sales total saved to {output_location}.",
         }
+        if profile_data:
+            result["profile"] = profile_data
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error calculating gold ticket sales: {e}")
 
@@ -355,17 +1512,24 @@ def calculate_gold_sales(input_location: str, output_location: str):
 def get_openai_embeddings(texts, model="text-embedding-3-small"):
     """Fetches embeddings for a list of texts using OpenAI's embedding API in batch mode."""
 
-    data = {"input": texts, "model": model}
-    embedding_url = "https://aiproxy.sanand.workers.dev/openai/v1/embeddings"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {AIPROXY_Token}",
-    }
+    # Texts embedded before, by this or another worker, come from the shared cache
+    keys = [cache_key(model, text) for text in texts]
+    cached = shared_cache.get_many_json("embedding", keys)
+    missing = [i for i, key in enumerate(keys) if key not in cached]
+    record_cache_event("embedding", "hit" if not missing else "miss")
+    if not missing:
+        return [cached[key] for key in keys]
 
-    response = requests.post(url=embedding_url, headers=headers, json=data, verify=False)
+    data = {"input": [texts[i] for i in missing], "model": model}
+    response = aiproxy_post("/embeddings", data)
     # print(response.json())
     if response.status_code == 200:
-        return [item["embedding"] for item in response.json()["data"]]
+        items = sorted(response.json()["data"], key=lambda item: item["index"])
+        fetched = [item["embedding"] for item in items]
+        new_entries = {keys[i]: embedding for i, embedding in zip(missing, fetched)}
+        shared_cache.set_many_json("embedding", new_entries)
+        cached.update(new_entries)
+        return [cached[key] for key in keys]
     else:
         raise Exception(f"Error {response.status_code}: {response.text}")
 
@@ -408,30 +1572,154 @@ def find_similar_comments(input_path, output_path):
     }
 
 
-def scrape_website(url: str, output_location: str):
+# auto picks lxml when installed and falls back to the stdlib parser; bs4 keeps the BeautifulSoup tree
+HTML_PARSER_BACKEND = os.getenv("HTML_PARSER_BACKEND", "auto")
+# Pages are truncated after this many bytes so oversized documents cannot stall the parser
+SCRAPE_MAX_BYTES = int(os.getenv("SCRAPE_MAX_BYTES", str(5 * 1024 * 1024)))
+PAGE_FIELDS = ("title", "text", "links", "headers")
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _PageExtractor:
     """
-    Scrapes the content from a given URL and saves it to a file.
+    Collects the requested page fields in a single pass over parser events. It is used
+    directly as an lxml parser target and through _StdlibPageParser for html.parser.
     """
-    if not url:
-        raise HTTPException(status_code=400, detail="URL cannot be empty")
 
+    SKIP_TEXT_TAGS = {"script", "style", "template"}
+    HEADER_TAGS = {"h1", "h2", "h3"}
+
+    def __init__(self, fields):
+        self.fields = set(fields)
+        self.title = None
+        self.has_title = False
+        self.texts = []
+        self.links = []
+        self.headers = []
+        self._pending = []
+        self._skip_depth = 0
+        self._in_title = False
+        self._title_done = False
+        self._open_links = []
+        self._open_headers = []
+
+    def _flush(self):
+        if self._pending:
+            text = "".join(self._pending)
+            self._pending = []
+            if "text" in self.fields and not self._skip_depth and text.strip():
+                self.texts.append(text.strip())
+
+    def start(self, tag, attrib):
+        self._flush()
+        tag = tag.lower()
+        if tag in self.SKIP_TEXT_TAGS:
+            self._skip_depth += 1
+        elif tag == "title" and not self._title_done:
+            self._in_title = True
+            self.has_title = True
+            self.title = ""
+        elif tag == "a" and "links" in self.fields and attrib.get("href") is not None:
+            self._open_links.append({"text": [], "href": attrib.get("href")})
+        elif tag in self.HEADER_TAGS and "headers" in self.fields:
+            self._open_headers.append((tag, []))
+
+    def end(self, tag):
+        self._flush()
+        tag = tag.lower()
+        if tag in self.SKIP_TEXT_TAGS:
+            self._skip_depth = max(0, self._skip_depth - 1)
+        elif tag == "title" and self._in_title:
+            self._in_title = False
+            self._title_done = True
+            if self.fields == {"title"}:
+                raise _StopParsing()
+        elif tag == "a" and self._open_links:
+            link = self._open_links.pop()
+            self.links.append({"text": "".join(link["text"]), "href": link["href"]})
+        elif tag in self.HEADER_TAGS and self._open_headers:
+            for index in range(len(self._open_headers) - 1, -1, -1):
+                if self._open_headers[index][0] == tag:
+                    self.headers.append("".join(self._open_headers.pop(index)[1]))
+                    break
+
+    def data(self, data):
+        if self._skip_depth:
+            return
+        self._pending.append(data)
+        if self._in_title:
+            self.title += data
+        for link in self._open_links:
+            link["text"].append(data)
+        for _, parts in self._open_headers:
+            parts.append(data)
+
+    def close(self):
+        self._flush()
+        # Unclosed elements at the end of a (possibly truncated) page still count
+        while self._open_links:
+            link = self._open_links.pop(0)
+            self.links.append({"text": "".join(link["text"]), "href": link["href"]})
+        while self._open_headers:
+            self.headers.append("".join(self._open_headers.pop(0)[1]))
+        content = {}
+        if "title" in self.fields:
+            content["title"] = (self.title or None) if self.has_title else "No title found"
+        if "text" in self.fields:
+            content["text"] = "\n".join(self.texts)
+        if "links" in self.fields:
+            content["links"] = self.links
+        if "headers" in self.fields:
+            content["headers"] = self.headers
+        return content
+
+
+class _StdlibPageParser(HTMLParser):
+    """Feeds html.parser events into a _PageExtractor."""
+
+    def __init__(self, extractor: _PageExtractor):
+        super().__init__(convert_charrefs=True)
+        self.extractor = extractor
+
+    def handle_starttag(self, tag, attrs):
+        self.extractor.start(tag, {name: value or "" for name, value in attrs})
+
+    def handle_startendtag(self, tag, attrs):
+        self.handle_starttag(tag, attrs)
+        self.extractor.end(tag)
+
+    def handle_endtag(self, tag):
+        self.extractor.end(tag)
+
+    def handle_data(self, data):
+        self.extractor.data(data)
+
+
+@lru_cache(maxsize=1)
+def _lxml_available() -> bool:
     try:
-        # Validate URL
-        parsed_url = urlparse(url)
-        if not all([parsed_url.scheme, parsed_url.netloc]):
-            raise HTTPException(status_code=400, detail="Invalid URL format")
+        import lxml.etree  # noqa: F401
 
-        # Make the request
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=10)
-        response.raise_for_status()
+        return True
+    except ImportError:
+        return False
 
-        # Parse with BeautifulSoup
-        soup = BeautifulSoup(response.text, 'html.parser')
 
-        # Extract relevant content
+def extract_page_content(html: str, fields=None, backend: str = None) -> Dict[str, Any]:
+    """
+    Extracts title, text, links and headers from an HTML page, or only the requested fields.
+    The lxml and html.parser backends stream the page once without building a tree.
+    """
+    fields = [field for field in (fields or PAGE_FIELDS) if field in PAGE_FIELDS]
+    backend = backend or HTML_PARSER_BACKEND
+    if backend == "auto":
+        backend = "lxml" if _lxml_available() else "html.parser"
+
+    if backend == "bs4":
+        soup = bs4.BeautifulSoup(html, 'html.parser')
         content = {
             'title': soup.title.string if soup.title else 'No title found',
             'text': soup.get_text(separator='\n', strip=True),
@@ -440,19 +1728,947 @@ def scrape_website(url: str, output_location: str):
             ],
             'headers': [h.text for h in soup.find_all(['h1', 'h2', 'h3'])],
         }
+        return {field: content[field] for field in fields}
 
-        # Save to file
-        with open(output_location, 'w', encoding='utf-8') as file:
-            json.dump(content, file, indent=4, ensure_ascii=False)
+    extractor = _PageExtractor(fields)
+    try:
+        if backend == "lxml":
+            from lxml import etree
+
+            parser = etree.HTMLParser(target=extractor)
+            parser.feed(html)
+            return parser.close()
+        parser = _StdlibPageParser(extractor)
+        parser.feed(html)
+        parser.close()
+    except _StopParsing:
+        pass
+    return extractor.close()
+
+
+def _read_limited(response: "requests.Response", max_bytes: int):
+    """Reads a streamed response body up to max_bytes; returns (body, truncated)."""
+    chunks = []
+    size = 0
+    truncated = False
+    for chunk in response.iter_content(chunk_size=64 * 1024):
+        chunks.append(chunk)
+        size += len(chunk)
+        if size > max_bytes:
+            truncated = True
+            break
+    response.close()
+    return b"".join(chunks)[:max_bytes], truncated
+
+
+# Cross-process cache for routing results, embeddings, query results and card numbers, so
+# several uvicorn/gunicorn workers reuse each other's work
+SHARED_CACHE_ENABLED = os.getenv("SHARED_CACHE_ENABLED", "1") == "1"
+SHARED_CACHE_DIR = os.getenv("SHARED_CACHE_DIR", ".cache/shared")
+SHARED_CACHE_MAX_BYTES = int(os.getenv("SHARED_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# Larger values (e.g. big query results) are not cached
+SHARED_CACHE_MAX_VALUE_BYTES = int(os.getenv("SHARED_CACHE_MAX_VALUE_BYTES", str(16 * 1024 * 1024)))
+ROUTING_CACHE_TTL = float(os.getenv("ROUTING_CACHE_TTL", "3600"))
+WORKERS = int(os.getenv("WORKERS", "1"))
+
+
+class SharedCache:
+    """
+    Key-value store in a SQLite database in WAL mode, safe to share between threads and worker
+    processes. Values are bytes, or JSON-serializable objects through get_json/set_json; each
+    namespace keeps its own keys. Expired rows are skipped and least recently used rows are
+    evicted past max_bytes.
+    """
+
+    def __init__(self, directory: str = SHARED_CACHE_DIR, max_bytes: int = SHARED_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._initialized = False
+        self._writes = 0
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "cache.db"), timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    expires_at REAL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            # Earlier versions cached card numbers here; overwrite them rather than keep them on disk
+            conn.execute("PRAGMA secure_delete=ON")
+            conn.execute("DELETE FROM entries WHERE namespace = 'credit_card'")
+            conn.commit()
+            self._initialized = True
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def get(self, namespace: str, key: str):
+        if not SHARED_CACHE_ENABLED:
+            return None
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT value, expires_at FROM entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] is not None and row[1] <= time.time():
+                conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+                conn.commit()
+                return None
+            conn.execute(
+                "UPDATE entries SET last_access = ? WHERE namespace = ? AND key = ?",
+                (time.time(), namespace, key),
+            )
+            conn.commit()
+            return bytes(row[0])
+        finally:
+            conn.close()
+
+    def set(self, namespace: str, key: str, value: bytes, ttl: float = None) -> bool:
+        if not SHARED_CACHE_ENABLED or len(value) > SHARED_CACHE_MAX_VALUE_BYTES:
+            return False
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), now + ttl if ttl else None, now),
+            )
+            conn.commit()
+            self._writes += 1
+            if self._writes % 100 == 1:
+                self._evict(conn)
+        finally:
+            conn.close()
+        return True
+
+    def get_json(self, namespace: str, key: str):
+        value = self.get(namespace, key)
+        return None if value is None else json.loads(value)
+
+    def set_json(self, namespace: str, key: str, value, ttl: float = None) -> bool:
+        return self.set(namespace, key, json.dumps(value, default=str).encode("utf-8"), ttl)
+
+    def get_many_json(self, namespace: str, keys: List[str]) -> Dict[str, Any]:
+        """Looks up several keys in one query; missing and expired keys are left out."""
+        if not SHARED_CACHE_ENABLED or not keys:
+            return {}
+        found = {}
+        conn = self._connect()
+        try:
+            now = time.time()
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = conn.execute(
+                    f"SELECT key, value FROM entries WHERE namespace = ? AND key IN "
+                    f"({', '.join('?' * len(chunk))}) AND (expires_at IS NULL OR expires_at > ?)",
+                    (namespace, *chunk, now),
+                ).fetchall()
+                found.update((key, json.loads(value)) for key, value in rows)
+        finally:
+            conn.close()
+        return found
+
+    def set_many_json(self, namespace: str, items: Dict[str, Any], ttl: float = None):
+        if not SHARED_CACHE_ENABLED or not items:
+            return
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            encoded = json.dumps(value).encode("utf-8")
+            rows.append((namespace, key, encoded, len(encoded), now + ttl if ttl else None, now))
+        conn = self._connect()
+        try:
+            conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)", rows)
+            conn.commit()
+            self._writes += len(rows)
+            self._evict(conn)
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        conn.execute(
+            "DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)
+        )
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            rows = conn.execute(
+                "SELECT namespace, key, size FROM entries ORDER BY last_access"
+            ).fetchall()
+            for namespace, key, size in rows:
+                if total <= self.max_bytes * 0.9:
+                    break
+                conn.execute(
+                    "DELETE FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+                )
+                total -= size
+        conn.commit()
 
+    def stats(self) -> Dict[str, Any]:
+        if not SHARED_CACHE_ENABLED:
+            return {"enabled": False}
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+            ).fetchall()
+        finally:
+            conn.close()
         return {
-            "status": "success",
-            "message": f"Website content scraped and saved to {output_location}",
-            "url": url,
+            "enabled": True,
+            "directory": self.directory,
+            "namespaces": {ns: {"entries": count, "bytes": size} for ns, count, size in rows},
         }
 
-    except requests.RequestException as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching website: {str(e)}")
+
+shared_cache = SharedCache()
+
+
+def cache_key(*parts) -> str:
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def file_fingerprint(path: str):
+    """(size, mtime_ns) of a file, or None when it does not exist."""
+    try:
+        stat_result = os.stat(path)
+    except OSError:
+        return None
+    return stat_result.st_size, stat_result.st_mtime_ns
+
+
+@contextmanager
+def output_lock(path: str):
+    """
+    Exclusive cross-process lock for writing `path`. Lock files live under SHARED_CACHE_DIR so
+    output directories stay clean; threads and workers writing the same output take turns.
+    """
+    lock_dir = os.path.join(SHARED_CACHE_DIR, "locks")
+    os.makedirs(lock_dir, exist_ok=True)
+    name = hashlib.sha1(os.path.abspath(path).encode("utf-8")).hexdigest()
+    with open(os.path.join(lock_dir, f"{name}.lock"), "a+b") as lock_file:
+        if os.name == "nt":
+            import msvcrt
+
+            lock_file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ~10 s; keep waiting
+                    continue
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+
+
+# Make-style skipping of deterministic tools whose inputs and outputs are unchanged
+BUILD_CACHE_ENABLED = os.getenv("BUILD_CACHE_ENABLED", "1") == "1"
+# Also hash inputs, so a file rewritten with the same content does not force a rerun
+BUILD_CACHE_HASH_INPUTS = os.getenv("BUILD_CACHE_HASH_INPUTS", "0") == "1"
+# Files modified this close to when they were recorded are always checked by hash, since a
+# second change within the same mtime tick would leave size and mtime unchanged
+BUILD_CACHE_RACY_WINDOW = 2.0
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _file_state(path: str, with_hash: bool):
+    fingerprint = file_fingerprint(path)
+    if fingerprint is None:
+        return None
+    size, mtime_ns = fingerprint
+    racy = time.time() - mtime_ns / 1e9 < BUILD_CACHE_RACY_WINDOW
+    return {
+        "size": size,
+        "mtime_ns": mtime_ns,
+        "sha256": file_sha256(path) if with_hash or racy else None,
+        "racy": racy,
+    }
+
+
+def _file_unchanged(path: str, state) -> bool:
+    fingerprint = file_fingerprint(path)
+    if state is None or fingerprint is None:
+        return state is None and fingerprint is None
+    if fingerprint == (state["size"], state["mtime_ns"]) and not state["racy"]:
+        return True
+    if state["sha256"] is None or fingerprint[0] != state["size"]:
+        return False
+    return file_sha256(path) == state["sha256"]
+
+
+def _markdown_index_files(arguments: Dict[str, Any]):
+    # generate_markdown_index always scans data/ and writes data/index.json
+    return sorted(str(path) for path in Path("data/").rglob("*.md")), ["data/index.json"]
+
+
+def _input_output_files(arguments: Dict[str, Any], inputs=lambda path: [path], output=None):
+    """
+    (input paths, output paths) from input_location and output_location, or None when either is
+    missing, so the tool runs uncached and reports the bad arguments itself.
+    """
+    input_location = arguments.get("input_location")
+    output_location = output(arguments) if output else arguments.get("output_location")
+    if not isinstance(input_location, str) or not isinstance(output_location, str):
+        return None
+    return inputs(input_location), [output_location]
+
+
+def _gold_sales_files(arguments: Dict[str, Any]):
+    if arguments.get("profile") or arguments.get("create_indexes"):
+        return None  # profiles are per run and index creation changes the database
+    return _input_output_files(
+        arguments,
+        # Committed rows may still sit in the write-ahead log
+        lambda database: [database, database + "-wal"],
+    )
+
+
+def _count_days_output(arguments: Dict[str, Any]):
+    # count_days names its file after the day, next to the requested output
+    output_location, day_name = arguments.get("output_location"), arguments.get("day_name")
+    if not isinstance(output_location, str) or not isinstance(day_name, str):
+        return None
+    return os.path.join(os.path.dirname(output_location), f"dates-{day_name.lower()}.txt")
+
+
+# Deterministic tools: arguments -> (input paths, output paths), or None when not cacheable
+BUILD_RULES = {
+    "sort_contacts": _input_output_files,
+    "count_days": lambda arguments: _input_output_files(arguments, output=_count_days_output),
+    "filter_csv_to_json": _input_output_files,
+    "generate_markdown_index": _markdown_index_files,
+    "calculate_gold_sales": _gold_sales_files,
+}
+
+
+def run_with_build_cache(function_name: str, arguments: Dict[str, Any]):
+    """
+    Runs FUNCTIONS[function_name], or returns its recorded result when the previous run had the
+    same arguments, its input files are unchanged (size and mtime, or content hash) and its
+    outputs still hold what it wrote. Records are kept in the shared cache, so workers share them.
+    """
+    fn = FUNCTIONS[function_name]
+    rule = BUILD_RULES.get(function_name)
+    files = rule(arguments) if BUILD_CACHE_ENABLED and rule is not None else None
+    if files is None:
+        return fn(**arguments)
+
+    inputs, outputs = files
+    key = cache_key("build", function_name, os.getcwd(), arguments)
+    record = shared_cache.get_json("build", key)
+    if (
+        record is not None
+        and sorted(record["inputs"]) == sorted(inputs)
+        and all(_file_unchanged(path, record["inputs"][path]) for path in inputs)
+        and all(
+            state is not None and _file_unchanged(path, state)
+            for path, state in record["outputs"].items()
+        )
+    ):
+        record_cache_event("build", "hit")
+        return {**record["result"], "cache_status": "hit"}
+
+    record_cache_event("build", "miss")
+    input_states = {path: _file_state(path, BUILD_CACHE_HASH_INPUTS) for path in inputs}
+    result = fn(**arguments)
+    if isinstance(result, dict) and result.get("status") == "success":
+        # Inputs changed while the tool ran: the output may mix both versions, so do not record
+        if all(_file_unchanged(path, state) for path, state in input_states.items()):
+            shared_cache.set_json("build", key, {
+                "inputs": input_states,
+                "outputs": {path: _file_state(path, True) for path in outputs},
+                "result": result,
+            })
+        result = {**result, "cache_status": "miss"}
+    return result
+
+
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE_ENABLED", "1") == "1"
+HTTP_CACHE_DIR = os.getenv("HTTP_CACHE_DIR", ".cache/http")
+HTTP_CACHE_MAX_BYTES = int(os.getenv("HTTP_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+
+def _parse_cache_control(value: str) -> Dict[str, Any]:
+    directives = {}
+    for part in (value or "").split(","):
+        name, _, argument = part.strip().partition("=")
+        if name:
+            directives[name.lower()] = argument.strip('"') if argument else True
+    return directives
+
+
+class HTTPCache:
+    """
+    On-disk HTTP cache shared by the fetching tools. Bodies are stored as files named after the
+    URL hash and metadata in a SQLite index, so several threads or workers can use it at once.
+    Responses are stored according to Cache-Control/Expires, stale entries are revalidated with
+    their ETag/Last-Modified, and least recently used entries are evicted past max_bytes.
+    """
+
+    def __init__(self, directory: str = HTTP_CACHE_DIR, max_bytes: int = HTTP_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._initialized = False
+
+    def _connect(self):
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        conn = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=30)
+        if not self._initialized:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS entries (
+                    url TEXT PRIMARY KEY,
+                    body TEXT NOT NULL,
+                    headers TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    expires_at REAL NOT NULL,
+                    no_cache INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._initialized = True
+        return conn
+
+    def body_path(self, entry: Dict[str, Any]) -> str:
+        return os.path.join(self.directory, entry["body"])
+
+    def lookup(self, url: str):
+        conn = self._connect()
+        try:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute("SELECT * FROM entries WHERE url = ?", (url,)).fetchone()
+            if row is None:
+                return None
+            entry = dict(row)
+            if not os.path.exists(self.body_path(entry)):
+                conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE url = ?", (time.time(), url))
+            conn.commit()
+            entry["headers"] = json.loads(entry["headers"])
+            return entry
+        finally:
+            conn.close()
+
+    def is_fresh(self, entry: Dict[str, Any]) -> bool:
+        return not entry["no_cache"] and entry["expires_at"] > time.time()
+
+    @staticmethod
+    def freshness(headers) -> tuple:
+        """Returns (storable, expires_at, no_cache) for a set of response headers."""
+        directives = _parse_cache_control(headers.get("Cache-Control", ""))
+        if "no-store" in directives or headers.get("Vary", "").strip() == "*":
+            return False, 0.0, False
+        now = time.time()
+        age = float(headers.get("Age", 0) or 0)
+        expires_at = now
+        if "max-age" in directives:
+            try:
+                expires_at = now + int(directives["max-age"]) - age
+            except (TypeError, ValueError):
+                pass
+        elif headers.get("Expires"):
+            try:
+                expires_at = parsedate_to_datetime(headers["Expires"]).timestamp()
+            except (TypeError, ValueError):
+                pass
+        no_cache = "no-cache" in directives
+        has_validator = bool(headers.get("ETag") or headers.get("Last-Modified"))
+        return (expires_at > now or has_validator), expires_at, no_cache
+
+    def store(self, url: str, headers, body: bytes) -> bool:
+        """Stores a 200 response if its headers allow it; returns whether it was cached."""
+
+        def write_body(path):
+            with open(path, 'wb') as file:
+                file.write(body)
+
+        return self._store(url, headers, len(body), write_body)
+
+    def store_file(self, url: str, headers, source_path: str) -> bool:
+        """Like store, but copies the body from a downloaded file instead of memory."""
+        return self._store(
+            url, headers, os.path.getsize(source_path), lambda path: shutil.copyfile(source_path, path)
+        )
+
+    def copy_body(self, entry: Dict[str, Any], destination: str):
+        """Copies a cached body to destination through a temporary file and an atomic rename."""
+        temp_path = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+        shutil.copyfile(self.body_path(entry), temp_path)
+        os.replace(temp_path, destination)
+
+    def _store(self, url: str, headers, size: int, write_body) -> bool:
+        storable, expires_at, no_cache = self.freshness(headers)
+        if not storable or size > self.max_bytes:
+            return False
+
+        name = hashlib.sha256(url.encode()).hexdigest()
+        temp_path = os.path.join(self.directory, f"{name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        conn = self._connect()
+        try:
+            write_body(temp_path)
+            os.replace(temp_path, os.path.join(self.directory, name))
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    url,
+                    name,
+                    json.dumps(dict(headers)),
+                    headers.get("ETag"),
+                    headers.get("Last-Modified"),
+                    expires_at,
+                    int(no_cache),
+                    size,
+                    time.time(),
+                ),
+            )
+            conn.commit()
+            self._evict(conn)
+        finally:
+            conn.close()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return True
+
+    def refresh(self, url: str, headers):
+        """Updates freshness and validators after a 304 Not Modified."""
+        _, expires_at, no_cache = self.freshness(headers)
+        conn = self._connect()
+        try:
+            conn.execute(
+                """
+                UPDATE entries SET expires_at = ?, no_cache = ?,
+                    etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified)
+                WHERE url = ?
+                """,
+                (expires_at, int(no_cache), headers.get("ETag"), headers.get("Last-Modified"), url),
+            )
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _evict(self, conn):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for url, body, size in conn.execute(
+            "SELECT url, body, size FROM entries ORDER BY last_access"
+        ).fetchall():
+            if total <= self.max_bytes:
+                break
+            conn.execute("DELETE FROM entries WHERE url = ?", (url,))
+            try:
+                os.remove(os.path.join(self.directory, body))
+            except FileNotFoundError:
+                pass
+            total -= size
+        conn.commit()
+
+
+http_cache = HTTPCache()
+
+
+def _cached_response(entry: Dict[str, Any], url: str) -> "requests.Response":
+    """Rebuilds a requests.Response from a cache entry."""
+    response = requests.models.Response()
+    response.status_code = 200
+    response.url = url
+    response.headers = requests.structures.CaseInsensitiveDict(entry["headers"])
+    response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+    with open(http_cache.body_path(entry), 'rb') as file:
+        response._content = file.read()
+    return response
+
+
+def _limit_body(response: "requests.Response", max_bytes: int = None) -> "requests.Response":
+    """Caps an already loaded body at max_bytes, flagging the response as truncated."""
+    response.truncated = bool(max_bytes) and len(response.content) > max_bytes
+    if response.truncated:
+        response._content = response.content[:max_bytes]
+    return response
+
+
+def cached_http_get(
+    url: str, headers: Dict[str, str] = None, timeout: float = 10, max_bytes: int = None
+):
+    """
+    GETs a URL through the shared HTTP cache and returns (response, cache_status), where
+    cache_status is "hit" (served fresh from disk), "revalidated" (304 from the origin),
+    "miss" (fetched and stored) or "bypass" (fetched, not cacheable). With max_bytes the body
+    is streamed and cut off at that size; truncated bodies are flagged and never cached.
+    """
+    headers = dict(headers or {})
+
+    def fetch():
+        if not max_bytes:
+            response = requests.get(
+                url, headers=headers, timeout=timeout, hooks={"response": observe_outbound}
+            )
+            response.truncated = False
+            return response
+        response = requests.get(
+            url, headers=headers, timeout=timeout, stream=True,
+            hooks={"response": observe_outbound},
+        )
+        body, response.truncated = _read_limited(response, max_bytes)
+        response._content = body
+        response._content_consumed = True
+        return response
+
+    if not HTTP_CACHE_ENABLED:
+        return fetch(), "bypass"
+
+    entry = http_cache.lookup(url)
+    if entry and http_cache.is_fresh(entry):
+        return _limit_body(_cached_response(entry, url), max_bytes), "hit"
+
+    if entry:
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+    response = fetch()
+    if response.status_code == 304 and entry:
+        http_cache.refresh(url, response.headers)
+        return _limit_body(_cached_response(entry, url), max_bytes), "revalidated"
+
+    if (
+        response.status_code == 200
+        and not response.truncated
+        and http_cache.store(url, response.headers, response.content)
+    ):
+        return response, "miss"
+    return response, "bypass"
+
+
+SCRAPER_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# Crawl mode limits
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "500"))
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "32"))
+CRAWL_PER_HOST_CONCURRENCY = int(os.getenv("CRAWL_PER_HOST_CONCURRENCY", "4"))
+CRAWL_PER_HOST_RATE = float(os.getenv("CRAWL_PER_HOST_RATE", "5"))  # requests per second
+CRAWL_TIMEOUT = float(os.getenv("CRAWL_TIMEOUT", "10"))
+
+
+def _run_async(coro):
+    """Runs a coroutine to completion from sync code, even when called from an event loop thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(contextvars.copy_context().run, asyncio.run, coro).result()
+
+
+class _HostThrottle:
+    """Caps concurrent requests to one host and spaces them to the host's rate limit."""
+
+    def __init__(self, concurrency: int, rate: float):
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next_slot = 0.0
+        self._lock = asyncio.Lock()
+
+    def slow_down(self, delay: float):
+        self.interval = max(self.interval, delay)
+
+    async def __aenter__(self):
+        await self.semaphore.acquire()
+        async with self._lock:
+            now = asyncio.get_running_loop().time()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def __aexit__(self, *exc_info):
+        self.semaphore.release()
+
+
+async def _crawl(
+    seeds: List[str],
+    output_location: str,
+    max_depth: int,
+    max_pages: int,
+    fields: List[str] = None,
+    max_bytes: int = SCRAPE_MAX_BYTES,
+) -> Dict[str, Any]:
+    """
+    Breadth-first crawl over pooled keep-alive connections. Each page is written to the
+    NDJSON output as soon as it is processed; links are followed on the seeds' hosts only.
+    """
+    import httpx
+    from urllib.robotparser import RobotFileParser
+
+    seed_hosts = {urlparse(seed).netloc for seed in seeds}
+    throttles = {}
+    robots = {}
+    robots_locks = {}
+    seen = set()
+    queue = asyncio.Queue()
+    stats = Counter()
+    failures = []
+    output_fields = [field for field in (fields or PAGE_FIELDS) if field in PAGE_FIELDS]
+    # Links are needed to follow the crawl even when they are not written out
+    parse_fields = output_fields + ["links"] if max_depth and "links" not in output_fields else output_fields
+
+    for seed in seeds:
+        seed = urldefrag(seed)[0]
+        if seed not in seen and len(seen) < max_pages:
+            seen.add(seed)
+            queue.put_nowait((seed, 0))
+
+    def throttle_for(host):
+        if host not in throttles:
+            throttles[host] = _HostThrottle(CRAWL_PER_HOST_CONCURRENCY, CRAWL_PER_HOST_RATE)
+        return throttles[host]
+
+    async def robots_for(client, parsed):
+        host = parsed.netloc
+        lock = robots_locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            if host in robots:
+                return robots[host]
+            parser = RobotFileParser()
+            try:
+                async with throttle_for(host):
+                    response = await client.get(f"{parsed.scheme}://{host}/robots.txt")
+                if response.status_code >= 500:
+                    parser.disallow_all = True  # RFC 9309: unreachable robots.txt means disallow
+                elif response.status_code >= 400:
+                    parser.allow_all = True
+                else:
+                    parser.parse(response.text.splitlines())
+                    delay = parser.crawl_delay(SCRAPER_USER_AGENT)
+                    if delay:
+                        throttle_for(host).slow_down(float(delay))
+            except httpx.HTTPError:
+                parser.allow_all = True
+            robots[host] = parser
+            return parser
+
+    async def process(client, output, url, depth):
+        parsed = urlparse(url)
+        record = {"url": url, "depth": depth}
+        if not (await robots_for(client, parsed)).can_fetch(SCRAPER_USER_AGENT, url):
+            record.update(status="skipped", reason="disallowed by robots.txt")
+            stats["skipped"] += 1
+        else:
+            start = time.perf_counter()
+            try:
+                truncated = False
+                async with throttle_for(parsed.netloc):
+                    async with client.stream("GET", url) as response:
+                        response.raise_for_status()
+                        chunks = []
+                        size = 0
+                        async for chunk in response.aiter_bytes():
+                            chunks.append(chunk)
+                            size += len(chunk)
+                            if max_bytes and size > max_bytes:
+                                truncated = True
+                                break
+                fetch_ms = (time.perf_counter() - start) * 1000
+                OUTBOUND_SECONDS.labels(
+                    parsed.netloc, f"{response.status_code // 100}xx"
+                ).observe(fetch_ms / 1000)
+                body = b"".join(chunks)[:max_bytes] if truncated else b"".join(chunks)
+                html = body.decode(response.encoding or "utf-8", errors="replace")
+
+                parse_start = time.perf_counter()
+                content = await asyncio.to_thread(extract_page_content, html, parse_fields)
+                parse_ms = (time.perf_counter() - parse_start) * 1000
+                if "links" in output_fields:
+                    links = content.get("links", [])
+                else:
+                    links = content.pop("links", [])
+
+                record.update(
+                    status="success",
+                    status_code=response.status_code,
+                    truncated=truncated,
+                    timing={"fetch_ms": round(fetch_ms, 2), "parse_ms": round(parse_ms, 2)},
+                    content=content,
+                )
+                stats["succeeded"] += 1
+
+                if depth < max_depth:
+                    for link in links:
+                        target = urldefrag(urljoin(str(response.url), link["href"]))[0]
+                        target_parsed = urlparse(target)
+                        if (
+                            target_parsed.scheme in ("http", "https")
+                            and target_parsed.netloc in seed_hosts
+                            and target not in seen
+                            and len(seen) < max_pages
+                        ):
+                            seen.add(target)
+                            queue.put_nowait((target, depth + 1))
+            except Exception as e:
+                elapsed_ms = (time.perf_counter() - start) * 1000
+                record.update(status="error", error=str(e), timing={"fetch_ms": round(elapsed_ms, 2)})
+                stats["failed"] += 1
+                failures.append({"url": url, "error": str(e)})
+
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        output.write(line)
+        output.flush()
+        stats["processed"] += 1
+        stats["bytes_written"] += len(line.encode("utf-8"))
+        report_progress(
+            "crawl",
+            pages_done=stats["processed"],
+            pages_queued=len(seen),
+            succeeded=stats["succeeded"],
+            failed=stats["failed"],
+            skipped=stats["skipped"],
+            bytes_written=stats["bytes_written"],
+        )
+
+    async def worker(client, output):
+        while True:
+            url, depth = await queue.get()
+            try:
+                await process(client, output, url, depth)
+            finally:
+                queue.task_done()
+
+    started = time.perf_counter()
+    limits = httpx.Limits(max_connections=CRAWL_CONCURRENCY, max_keepalive_connections=CRAWL_CONCURRENCY)
+    async with httpx.AsyncClient(
+        headers={'User-Agent': SCRAPER_USER_AGENT},
+        timeout=CRAWL_TIMEOUT,
+        limits=limits,
+        follow_redirects=True,
+    ) as client:
+        with open(output_location, 'w', encoding='utf-8') as output:
+            workers = [asyncio.create_task(worker(client, output)) for _ in range(CRAWL_CONCURRENCY)]
+            await queue.join()
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+    report_progress("crawl", state="done", pages_done=stats["processed"], bytes_written=stats["bytes_written"])
+
+    return {
+        "pages": len(seen),
+        "succeeded": stats["succeeded"],
+        "failed": stats["failed"],
+        "skipped": stats["skipped"],
+        "elapsed_seconds": round(time.perf_counter() - started, 3),
+        "failures": failures[:50],
+    }
+
+
+def scrape_website(
+    url: str,
+    output_location: str,
+    urls: List[str] = None,
+    max_depth: int = 0,
+    max_pages: int = CRAWL_MAX_PAGES,
+    fields: List[str] = None,
+    max_bytes: int = SCRAPE_MAX_BYTES,
+):
+    """
+    Scrapes the content from a given URL and saves it to a file.
+    With a URL list or a max_depth above 0 it crawls instead and writes one JSON line per page.
+    Only the requested fields are extracted, and pages are cut off after max_bytes.
+    """
+    if not url and not urls:
+        raise HTTPException(status_code=400, detail="URL cannot be empty")
+
+    if urls or max_depth > 0:
+        seeds = [u for u in ([url] if url else []) + list(urls or []) if u]
+        invalid = [u for u in seeds if not all(urlparse(u)[:2])]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid URL format: {', '.join(invalid)}")
+        try:
+            summary = _run_async(
+                _crawl(seeds, output_location, max_depth, max_pages, fields, max_bytes)
+            )
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Error crawling websites: {str(e)}")
+        return {
+            "status": "success",
+            "message": f"Crawled {summary['pages']} pages and saved them to {output_location}",
+            "url": url,
+            **summary,
+        }
+
+    try:
+        # Validate URL
+        parsed_url = urlparse(url)
+        if not all([parsed_url.scheme, parsed_url.netloc]):
+            raise HTTPException(status_code=400, detail="Invalid URL format")
+
+        # Make the request
+        headers = {'User-Agent': SCRAPER_USER_AGENT}
+        response, cache_status = cached_http_get(
+            url, headers=headers, timeout=10, max_bytes=max_bytes
+        )
+        record_cache_event("http", cache_status)
+        response.raise_for_status()
+
+        # Extract relevant content
+        content = extract_page_content(response.text, fields)
+
+        # Save to file
+        with open(output_location, 'w', encoding='utf-8') as file:
+            with observe_stage("file_io"):
+                json.dump(content, file, indent=4, ensure_ascii=False)
+
+        return {
+            "status": "success",
+            "message": f"Website content scraped and saved to {output_location}",
+            "url": url,
+            "cache_status": cache_status,
+            "truncated": response.truncated,
+        }
+
+    except requests.RequestException as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching website: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing website content: {str(e)}")
 
@@ -467,13 +2683,9 @@ def convert_markdown_to_html(input_location: str, output_location: str):
             markdown_content = file.read()
 
         # Use GPT to convert markdown to HTML
-        response = requests.post(
-            "http://aiproxy.sanand.workers.dev/openai/v1/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {AIPROXY_Token}",
-            },
-            json={
+        response = aiproxy_post(
+            "/chat/completions",
+            {
                 "model": "gpt-4o-mini",
                 "messages": [
                     {
@@ -483,7 +2695,6 @@ def convert_markdown_to_html(input_location: str, output_location: str):
                     {"role": "user", "content": markdown_content},
                 ],
             },
-            verify=False,
         )
 
         response.raise_for_status()
@@ -532,6 +2743,64 @@ def format_markdown_with_prettier(file_path: str) -> Dict[str, Any]:
         return {"status": "error", "message": error_message}
 
 
+# Rows between progress events while writing large JSON outputs
+PROGRESS_EVERY_ROWS = int(os.getenv("PROGRESS_EVERY_ROWS", "5000"))
+# Bytes between progress events while reading large inputs
+PROGRESS_EVERY_BYTES = int(os.getenv("PROGRESS_EVERY_BYTES", str(4 * 1024 * 1024)))
+
+
+class _ProgressReader:
+    """File wrapper that reports how much of the file has been read."""
+
+    def __init__(self, file, stage: str, total_bytes: int):
+        self.file = file
+        self.stage = stage
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self._next_report = PROGRESS_EVERY_BYTES
+
+    def _counted(self, data):
+        self.bytes_read += len(data)
+        if self.bytes_read >= self._next_report:
+            self._next_report = self.bytes_read + PROGRESS_EVERY_BYTES
+            report_progress(self.stage, bytes_read=self.bytes_read, total_bytes=self.total_bytes)
+        return data
+
+    def read(self, size: int = -1):
+        return self._counted(self.file.read(size))
+
+    def read1(self, size: int = -1):
+        # pandas decodes binary handles through a TextIOWrapper, which reads with read1
+        return self._counted(self.file.read1(size))
+
+    def __iter__(self):
+        return iter(self.file)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+def write_json_records(file, records: List[Dict[str, Any]], **dump_kwargs):
+    """
+    Writes records exactly as json.dump(records, file, indent=4) would, one record at a time,
+    reporting rows and bytes written every PROGRESS_EVERY_ROWS rows.
+    """
+    total = len(records)
+    if not total:
+        file.write("[]")
+        return
+    reporting = _progress_callback.get() is not None
+    file.write("[")
+    for row, record in enumerate(records, 1):
+        text = json.dumps(record, indent=4, **dump_kwargs).replace("\n", "\n    ")
+        file.write(("\n    " if row == 1 else ",\n    ") + text)
+        if reporting and row % PROGRESS_EVERY_ROWS == 0:
+            report_progress("write", rows_written=row, total_rows=total, bytes_written=file.tell())
+    file.write("\n]")
+    if reporting:
+        report_progress("write", state="done", rows_written=total, bytes_written=file.tell())
+
+
 def filter_csv_to_json(input_location: str, output_location: str):
     """
     Reads a CSV file, converts it to JSON format using column headers as keys,
@@ -541,15 +2810,32 @@ def filter_csv_to_json(input_location: str, output_location: str):
         raise HTTPException(status_code=404, detail=f"Input file {input_location} does not exist.")
 
     try:
-        # Read CSV file using pandas
-        df = pd.read_csv(input_location)
+        if use_data_workspace(input_location):
+            # Read the cached workspace table instead of re-parsing the CSV
+            workspace = get_data_workspace()
+            cursor = workspace.cursor()
+            cursor.execute(f'SELECT * FROM "{workspace.register(input_location)}"')
+            columns = [col[0] for col in cursor.description]
+            json_data = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.close()
+        elif _progress_callback.get() is not None:
+            # Streaming clients get byte counts while pandas reads the file
+            with open(input_location, 'rb') as raw:
+                reader = _ProgressReader(raw, "read", os.path.getsize(input_location))
+                df = pd.read_csv(reader)
+            json_data = df.to_dict(orient='records')
+        else:
+            # Read CSV file using pandas
+            df = pd.read_csv(input_location)
 
-        # Convert DataFrame to JSON format
-        json_data = df.to_dict(orient='records')
+            # Convert DataFrame to JSON format
+            json_data = df.to_dict(orient='records')
+        report_progress("read", state="done", rows=len(json_data))
 
         # Write to output file
         with open(output_location, 'w', encoding='utf-8') as file:
-            json.dump(json_data, file, indent=4)
+            with observe_stage("file_io"):
+                write_json_records(file, json_data, default=str)
 
         return {
             "status": "success",
@@ -560,82 +2846,234 @@ def filter_csv_to_json(input_location: str, output_location: str):
         raise HTTPException(status_code=500, detail=f"Error processing CSV file: {e}")
 
 
-def extract_credit_card(input_path: str, output_path: str):
-    try:
-        # Validate input file path
-        if not input_path or not output_path:
-            raise HTTPException(status_code=400, detail="Invalid input or output path provided.")
+# Longest image side sent to the vision model; larger images are downscaled first
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+CREDIT_CARD_CACHE_SIZE = int(os.getenv("CREDIT_CARD_CACHE_SIZE", "1024"))
+CREDIT_CARD_MAX_WORKERS = int(os.getenv("CREDIT_CARD_MAX_WORKERS", "4"))
+
+# Formats the vision endpoint accepts as-is
+VISION_IMAGE_TYPES = {"image/png", "image/jpeg", "image/gif", "image/webp"}
+
+_credit_card_cache = OrderedDict()
+_credit_card_cache_lock = threading.Lock()
+
+
+def _detect_image_type(data: bytes):
+    """Identifies the image format from its magic bytes rather than the file name."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"BM"):
+        return "image/bmp"
+    if data[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    return None
 
-        # Read image file and encode in base64
-        try:
-            with open(input_path, 'rb') as f:
-                binary_data = f.read()
-        except FileNotFoundError:
-            raise HTTPException(status_code=404, detail=f"File not found: {input_path}")
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
 
-        if not binary_data:
+def _prepare_image(data: bytes):
+    """
+    Crops uniform borders, downscales to IMAGE_MAX_SIDE and re-encodes as JPEG when that is
+    smaller. Returns (bytes, mime type, details). Without Pillow, supported formats are sent
+    unchanged.
+    """
+    mime_type = _detect_image_type(data)
+    details = {"original_bytes": len(data), "original_type": mime_type}
+    try:
+        from PIL import Image, ImageChops, ImageOps
+    except ImportError:
+        if mime_type not in VISION_IMAGE_TYPES:
             raise HTTPException(
-                status_code=400, detail="Error: Image file is empty or unreadable."
+                status_code=400, detail=f"Unsupported image format: {mime_type or 'unknown'}"
             )
+        return data, mime_type, details
 
-        print(f"Image file size: {len(binary_data)} bytes")
+    try:
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Error: Image file is unreadable: {str(e)}")
+    image = image.convert("RGB")
+    details["original_size"] = list(image.size)
+
+    # Crop away a uniform background around the card, keeping a small margin
+    background = Image.new("RGB", image.size, image.getpixel((0, 0)))
+    difference = ImageChops.difference(image, background).convert("L")
+    bbox = difference.point(lambda p: 255 if p > 24 else 0).getbbox()
+    if bbox:
+        margin = max(4, min(image.size) // 50)
+        bbox = (
+            max(0, bbox[0] - margin),
+            max(0, bbox[1] - margin),
+            min(image.width, bbox[2] + margin),
+            min(image.height, bbox[3] + margin),
+        )
+        if (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) < 0.9 * image.width * image.height:
+            image = image.crop(bbox)
+
+    image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE), Image.LANCZOS)
+    details["sent_size"] = list(image.size)
+
+    buffer = BytesIO()
+    image.save(buffer, format="JPEG", quality=IMAGE_JPEG_QUALITY, optimize=True)
+    encoded = buffer.getvalue()
+    unchanged = details["sent_size"] == details["original_size"]
+    if mime_type in VISION_IMAGE_TYPES and unchanged and len(data) <= len(encoded):
+        encoded = data
+    else:
+        mime_type = "image/jpeg"
+    details["sent_bytes"] = len(encoded)
+    return encoded, mime_type, details
 
-        # Convert to Base64
-        image_b64 = base64.b64encode(binary_data).decode()
-        data_uri = f"data:image/png;base64,{image_b64}"
 
-        # API setup
-        url = "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions"
-        headers = {"Content-Type": "application/json", "Authorization": f"Bearer {AIPROXY_Token}"}
-        data = {
-            "model": "gpt-4o-mini",
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Extract the 8+ digit number (formatted with spaces every 4 digits) from this image, return only the digits without spaces.",
-                        },
-                        {"type": "image_url", "image_url": {"url": data_uri}},
-                    ],
-                }
-            ],
-            "response_format": {
-                "type": "json_schema",
-                "json_schema": {
-                    "name": "math_response",
-                    "strict": True,
-                    "schema": {
-                        "type": "object",
-                        "properties": {"IDnumber": {"type": "string"}},
-                        "required": ["IDnumber"],
-                        "additionalProperties": False,
+def _extract_card_number(binary_data: bytes):
+    """
+    Returns (number, cache_status, image details) for one image. Results are cached in this
+    process by the SHA-256 of the raw image so the same card is only sent to the model once.
+    """
+    cache_key = hashlib.sha256(binary_data).hexdigest()
+    with _credit_card_cache_lock:
+        if cache_key in _credit_card_cache:
+            _credit_card_cache.move_to_end(cache_key)
+            return _credit_card_cache[cache_key], "hit", {"original_bytes": len(binary_data)}
+
+    image_data, mime_type, details = _prepare_image(binary_data)
+    print(
+        f"Image file size: {details['original_bytes']} bytes, "
+        f"sending {details['sent_bytes']} bytes as {mime_type}"
+    )
+
+    # Convert to Base64
+    image_b64 = base64.b64encode(image_data).decode()
+    data_uri = f"data:{mime_type};base64,{image_b64}"
+
+    data = {
+        "model": "gpt-4o-mini",
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Extract the 8+ digit number (formatted with spaces every 4 digits) from this image, return only the digits without spaces.",
                     },
+                    {"type": "image_url", "image_url": {"url": data_uri}},
+                ],
+            }
+        ],
+        "response_format": {
+            "type": "json_schema",
+            "json_schema": {
+                "name": "math_response",
+                "strict": True,
+                "schema": {
+                    "type": "object",
+                    "properties": {"IDnumber": {"type": "string"}},
+                    "required": ["IDnumber"],
+                    "additionalProperties": False,
                 },
             },
-        }
+        },
+    }
 
-        # Make API request with SSL verification disabled
-        try:
-            response = requests.post(url=url, headers=headers, json=data, verify=False)
-            response.raise_for_status()
-            response_json = response.json()
-        except requests.exceptions.RequestException as e:
-            raise HTTPException(status_code=500, detail=f"Error calling AI API: {str(e)}")
+    try:
+        response = aiproxy_post("/chat/completions", data)
+        response.raise_for_status()
+        response_json = response.json()
+    except (requests.exceptions.RequestException, OutboundUnavailable) as e:
+        raise HTTPException(status_code=500, detail=f"Error calling AI API: {str(e)}")
 
-        # Extract the ID number
-        try:
-            content = json.loads(response_json['choices'][0]['message']['content'])
-            extracted_number = content.get('IDnumber', '')
-            if not extracted_number:
-                raise HTTPException(
-                    status_code=400, detail="No valid number extracted from image."
-                )
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
-            raise HTTPException(status_code=500, detail=f"Error processing AI response: {str(e)}")
+    # Extract the ID number
+    try:
+        content = json.loads(response_json['choices'][0]['message']['content'])
+        extracted_number = content.get('IDnumber', '')
+        if not extracted_number:
+            raise HTTPException(
+                status_code=400, detail="No valid number extracted from image."
+            )
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        raise HTTPException(status_code=500, detail=f"Error processing AI response: {str(e)}")
+
+    # Card numbers stay in this process's memory; they are never written to the shared cache
+    with _credit_card_cache_lock:
+        _credit_card_cache[cache_key] = extracted_number
+        while len(_credit_card_cache) > CREDIT_CARD_CACHE_SIZE:
+            _credit_card_cache.popitem(last=False)
+    return extracted_number, "miss", details
+
+
+def _read_image_file(input_path: str) -> bytes:
+    try:
+        with open(input_path, 'rb') as f:
+            binary_data = f.read()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"File not found: {input_path}")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
+
+    if not binary_data:
+        raise HTTPException(
+            status_code=400, detail="Error: Image file is empty or unreadable."
+        )
+    return binary_data
+
+
+def extract_credit_card(input_path: str, output_path: str, input_paths: List[str] = None):
+    """
+    Extracts the card number from an image and writes it to output_path. With input_paths,
+    the images are processed concurrently and output_path gets one "path,number" CSV row each.
+    """
+    try:
+        # Validate input file path
+        if not (input_path or input_paths) or not output_path:
+            raise HTTPException(status_code=400, detail="Invalid input or output path provided.")
+
+        if input_paths:
+            paths = [p for p in ([input_path] if input_path else []) + list(input_paths) if p]
+
+            def extract_one(path):
+                try:
+                    number, cache_status, _ = _extract_card_number(_read_image_file(path))
+                    record_cache_event("credit_card", cache_status)
+                    return {
+                        "input_path": path,
+                        "status": "success",
+                        "extracted_number": number,
+                        "cache_status": cache_status,
+                    }
+                except HTTPException as e:
+                    return {"input_path": path, "status": "error", "error": e.detail}
+
+            workers = max(1, min(CREDIT_CARD_MAX_WORKERS, len(paths)))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = list(executor.map(extract_one, paths))
+
+            try:
+                import csv
+
+                with open(output_path, "w", encoding="utf-8", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(["input_path", "extracted_number"])
+                    for result in results:
+                        writer.writerow([result["input_path"], result.get("extracted_number", "")])
+            except Exception as e:
+                raise HTTPException(status_code=500, detail=f"Error writing to file: {str(e)}")
+
+            failed = sum(1 for result in results if result["status"] != "success")
+            return {
+                "status": "success" if not failed else "partial",
+                "results": results,
+                "output_path": output_path,
+            }
+
+        # Read image file
+        binary_data = _read_image_file(input_path)
+        extracted_number, cache_status, details = _extract_card_number(binary_data)
+        record_cache_event("credit_card", cache_status)
 
         # Save extracted number to file
         try:
@@ -648,6 +3086,8 @@ def extract_credit_card(input_path: str, output_path: str):
             "status": "success",
             "extracted_number": extracted_number,
             "output_path": output_path,
+            "cache_status": cache_status,
+            "image": details,
         }
 
     except HTTPException as e:
@@ -655,7 +3095,238 @@ def extract_credit_card(input_path: str, output_path: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
-def run_sql_query(input_location: str, output_location: str, query: str):
+
+SQL_FETCH_BATCH_SIZE = 10000
+
+# Output writers are chosen by the extension of output_location
+SQL_OUTPUT_FORMATS = {
+    ".csv": "csv",
+    ".json": "json",
+    ".txt": "txt",
+    ".parquet": "parquet",
+    ".arrow": "arrow",
+    ".feather": "arrow",
+    ".ipc": "arrow",
+}
+
+
+def _iter_row_batches(conn, query: str, is_duckdb: bool, batch_size: int = SQL_FETCH_BATCH_SIZE):
+    """
+    Executes the query and returns (columns, batches) where batches yields lists of row tuples.
+    DuckDB results are pulled through its Arrow record-batch reader, SQLite through fetchmany.
+    """
+    if is_duckdb:
+        reader = conn.execute(query).fetch_record_batch(batch_size)
+        columns = list(reader.schema.names)
+
+        def duckdb_batches():
+            for batch in reader:
+                yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+        return columns, duckdb_batches()
+
+    cursor = conn.execute(query)
+    columns = [col[0] for col in cursor.description or []]
+
+    def sqlite_batches():
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield rows
+
+    return columns, sqlite_batches()
+
+
+def _iter_arrow_batches(conn, query: str, is_duckdb: bool, batch_size: int = SQL_FETCH_BATCH_SIZE):
+    """
+    Executes the query and returns (schema, batches) where batches yields pyarrow RecordBatches.
+    SQLite values carry no column type, so each SQLite batch gets the types of its own rows and a
+    later batch can widen the first one's schema (a column NULL so far, or INTEGER values followed
+    by REAL ones); consumers combine them with _promote_arrow_schema.
+    """
+    import pyarrow as pa
+
+    if is_duckdb:
+        reader = conn.execute(query).fetch_record_batch(batch_size)
+        return reader.schema, iter(reader)
+
+    columns, row_batches = _iter_row_batches(conn, query, is_duckdb, batch_size)
+
+    def to_batch(rows):
+        try:
+            return pa.RecordBatch.from_arrays([pa.array(list(values)) for values in zip(*rows)], names=columns)
+        except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+            raise ValueError(f"Column holds values of mixed types, cannot write columnar output: {e}")
+
+    first_rows = next(row_batches, None)
+    if first_rows is None:
+        return pa.schema([(name, pa.null()) for name in columns]), iter(())
+    first_batch = to_batch(first_rows)
+
+    def sqlite_batches():
+        yield first_batch
+        for rows in row_batches:
+            yield to_batch(rows)
+
+    return first_batch.schema, sqlite_batches()
+
+
+def _promote_arrow_schema(schema, other):
+    """The schema values of both fit in (NULL widens to any type, integers to floats)."""
+    import pyarrow as pa
+
+    if other.equals(schema):
+        return schema
+    try:
+        return pa.unify_schemas([schema, other], promote_options="permissive")
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        raise ValueError(f"Column types changed between result batches, cannot write columnar output: {e}")
+
+
+def _arrow_batches_to_table(schema, batches):
+    """Collects _iter_arrow_batches output into one Table, under the widest schema seen."""
+    import pyarrow as pa
+
+    batches = list(batches)
+    for batch in batches:
+        schema = _promote_arrow_schema(schema, batch.schema)
+    return pa.Table.from_batches([batch.cast(schema) for batch in batches], schema=schema)
+
+
+def _write_delimited_batches(output_location: str, columns, batches, delimiter: str = ","):
+    """Writes row batches to a CSV/TSV file as they arrive and returns the row count."""
+    import csv
+
+    row_count = 0
+    with open(output_location, 'w', encoding='utf-8', newline='') as file:
+        writer = csv.writer(file, delimiter=delimiter)
+        writer.writerow(columns)
+        for rows in batches:
+            writer.writerows(rows)
+            row_count += len(rows)
+    return row_count
+
+
+def _write_json_batches(output_location: str, columns, batches):
+    """
+    Writes row batches as a JSON array of records without holding the full result in memory,
+    laid out as DataFrame.to_json(orient="records", indent=4) wrote them.
+    """
+    row_count = 0
+    with open(output_location, 'w', encoding='utf-8') as file:
+        file.write("[\n")
+        for rows in batches:
+            for row in rows:
+                text = json.dumps(dict(zip(columns, row)), indent=4, separators=(",", ":"), default=str)
+                file.write((",\n    " if row_count else "    ") + text.replace("\n", "\n    ").replace("/", "\\/"))
+                row_count += 1
+        file.write("\n]")
+    return row_count
+
+
+def _open_arrow_writer(output_location: str, output_format: str, schema):
+    import pyarrow as pa
+
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(output_location, schema)
+    return pa.ipc.new_file(output_location, schema)
+
+
+def _read_arrow_file(path: str, output_format: str):
+    """Yields the record batches of a Parquet or Arrow IPC file written by _open_arrow_writer."""
+    import pyarrow as pa
+
+    if output_format == "parquet":
+        import pyarrow.parquet as pq
+
+        yield from pq.ParquetFile(path).iter_batches()
+        return
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for index in range(reader.num_record_batches):
+            yield reader.get_batch(index)
+
+
+def _write_arrow_batches(output_location: str, output_format: str, schema, batches):
+    """
+    Writes pyarrow RecordBatches to a Parquet or Arrow IPC file and returns the row count. When a
+    batch widens the schema, the rows written so far are rewritten under the wider one.
+    """
+    row_count = 0
+    writer = _open_arrow_writer(output_location, output_format, schema)
+    try:
+        for batch in batches:
+            promoted = _promote_arrow_schema(schema, batch.schema)
+            if not promoted.equals(schema):
+                writer.close()
+                previous = f"{output_location}.narrow"
+                os.replace(output_location, previous)
+                schema = promoted
+                writer = _open_arrow_writer(output_location, output_format, schema)
+                for written in _read_arrow_file(previous, output_format):
+                    writer.write_batch(written.cast(schema))
+                os.remove(previous)
+            writer.write_batch(batch.cast(schema))
+            row_count += batch.num_rows
+    finally:
+        writer.close()
+    return row_count
+
+
+def _write_query_result(conn, query: str, is_duckdb: bool, output_location: str, output_format: str) -> int:
+    """Streams the query's result batches straight into the output file; returns the row count."""
+    if output_format in ("parquet", "arrow"):
+        schema, batches = _iter_arrow_batches(conn, query, is_duckdb)
+        return _write_arrow_batches(output_location, output_format, schema, batches)
+    columns, batches = _iter_row_batches(conn, query, is_duckdb)
+    if output_format == "json":
+        return _write_json_batches(output_location, columns, batches)
+    if output_format == "txt":
+        return _write_delimited_batches(output_location, columns, batches, "\t")
+    return _write_delimited_batches(output_location, columns, batches)  # Default is CSV
+
+
+def _sql_output_location(output_location: str) -> str:
+    if not output_location:
+        return "./data/output.csv"
+    if output_location.startswith("/"):
+        return f".{output_location}"
+    return output_location
+
+
+READ_ONLY_QUERY_PATTERN = re.compile(r"^\s*(?:select|with)\b[^;]*;?\s*$", re.IGNORECASE)
+# Results can change while the database does not: clock and random functions, and reads of
+# other files through DuckDB table functions or quoted file names
+UNCACHEABLE_QUERY_PATTERN = re.compile(
+    r"\b(?:now|random|randomblob|uuid|gen_random_uuid|setseed|today|getenv|glob"
+    r"|current_(?:date|time|timestamp|localtime|localtimestamp)|read_\w+|\w+_scan)\b"
+    r"|'now'|\b(?:date|time|datetime|julianday|unixepoch|strftime)\s*\(\s*\)"
+    r"|\b(?:from|join)\s+'",
+    re.IGNORECASE,
+)
+# Seconds a cached read-only query result is reused; 0 turns the result cache off
+SQL_RESULT_CACHE_TTL = float(os.getenv("SQL_RESULT_CACHE_TTL", "300"))
+
+
+def _query_input_fingerprints(input_location: str):
+    """Fingerprints of every file the query can read: the database, its WAL and, when it runs
+    through the data workspace, every file registered there."""
+    paths = {os.path.abspath(input_location), os.path.abspath(f"{input_location}-wal")}
+    if use_data_workspace(input_location):
+        paths.update(source["path"] for source in get_data_workspace().status())
+    return sorted((path, file_fingerprint(path)) for path in paths)
+
+
+def run_sql_query(
+    input_location: str,
+    output_location: str,
+    query: str,
+    profile: bool = False,
+    create_indexes: bool = False,
+):
     print(f"Running SQL query: {query}, {input_location}, {output_location}")
     if not input_location or not query:
         raise HTTPException(status_code=400, detail="Invalid input parameters: input_location and query are required.")
@@ -663,52 +3334,289 @@ def run_sql_query(input_location: str, output_location: str, query: str):
     # Determine database type (SQLite or DuckDB)
     is_duckdb = input_location.endswith(".duckdb")
     
-    if not output_location:
-        output_location = "./data/output.csv"
-    elif output_location.startswith("/"):
-        output_location = f".{output_location}"
-    
-    output_format = "csv" if output_location.endswith(".csv") else "json" if output_location.endswith(".json") else "txt"
+    output_location = _sql_output_location(output_location)
+    output_format = SQL_OUTPUT_FORMATS.get(os.path.splitext(output_location)[1].lower(), "txt")
+
+    # Read-only queries against an unchanged database reuse a result written by any worker
+    result_key = None
+    if (
+        SQL_RESULT_CACHE_TTL > 0
+        and not (profile or create_indexes)
+        and READ_ONLY_QUERY_PATTERN.match(query)
+        and not UNCACHEABLE_QUERY_PATTERN.search(query)
+    ):
+        if file_fingerprint(input_location):
+            result_key = cache_key(
+                _query_input_fingerprints(input_location), query.strip(), output_format
+            )
+            cached = shared_cache.get_json("sql_meta", result_key)
+            body = shared_cache.get("sql_result", result_key) if cached else None
+            if body is not None:
+                with open(output_location, "wb") as file:
+                    file.write(body)
+                record_cache_event("sql_result", "hit")
+                return {
+                    "status": "success",
+                    "message": f"Query results saved to {output_location}",
+                    "format": output_format,
+                    "row_count": cached["row_count"],
+                    "cache_status": "hit",
+                }
 
     try:
-        # Connect to the database
-        conn = duckdb.connect(input_location) if is_duckdb else sqlite3.connect(input_location)
-        
-        # Execute the query and fetch results into a DataFrame
-        df = pd.read_sql_query(query, conn)
-
-        # Save results
-        if output_format == "json":
-            df.to_json(output_location, orient="records", indent=4)
-        elif output_format == "txt":
-            df.to_csv(output_location, sep="\t", index=False)
-        else:  # Default is CSV
-            df.to_csv(output_location, index=False)
+        if use_data_workspace(input_location):
+            # Run against the shared workspace, which speaks DuckDB SQL for both file types
+            conn = get_data_workspace().cursor(input_location)
+            is_duckdb = True
+        else:
+            # Connect to the database
+            conn = duckdb.connect(input_location) if is_duckdb else sqlite3.connect(input_location)
 
-        conn.close()
+        try:
+            start = time.perf_counter()
+            # Stream result batches straight into the writer instead of building a DataFrame
+            row_count = _write_query_result(conn, query, is_duckdb, output_location, output_format)
+            elapsed = time.perf_counter() - start
+
+            # The index advisor only understands SQLite plans and schemas, and only runs when asked
+            index_advice = (
+                advise_indexes(conn, query, input_location, create=create_indexes)
+                if (profile or create_indexes) and not is_duckdb else []
+            )
+            profile_data = (
+                _sql_profile(conn, query, is_duckdb, elapsed, index_advice) if profile else None
+            )
+        finally:
+            conn.close()
         
-        return {"status": "success", "message": f"Query results saved to {output_location}"}
+        result = {
+            "status": "success",
+            "message": f"Query results saved to {output_location}",
+            "format": output_format,
+            "row_count": row_count,
+        }
+        if profile_data:
+            result["profile"] = profile_data
+        if result_key and os.path.getsize(output_location) <= SHARED_CACHE_MAX_VALUE_BYTES:
+            with open(output_location, "rb") as file:
+                if shared_cache.set("sql_result", result_key, file.read(), ttl=SQL_RESULT_CACHE_TTL):
+                    shared_cache.set_json(
+                        "sql_meta", result_key, {"row_count": row_count}, ttl=SQL_RESULT_CACHE_TTL
+                    )
+            record_cache_event("sql_result", "miss")
+            result["cache_status"] = "miss"
+        return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error executing query: {e}")
 
-def fetch_and_save_api(input_location: str, output_location: str):
-    """
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10"))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv("DOWNLOAD_READ_TIMEOUT", "60"))
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Interrupted transfers are resumed with a Range request up to this many times per call
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_MAX_WORKERS = int(os.getenv("DOWNLOAD_MAX_WORKERS", "8"))
+
+
+def _download_session(pool_size: int = DOWNLOAD_MAX_WORKERS) -> "requests.Session":
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.hooks["response"].append(observe_outbound)
+    return session
+
+
+def _download_once(session, url: str, output_location: str, decompress: bool) -> Dict[str, Any]:
+    """
+    One attempt at streaming url into output_location.part. A .part file left by an earlier
+    attempt is resumed with Range/If-Range; the finished file is renamed into place.
+    """
+    part_path = f"{output_location}.part"
+    meta_path = f"{part_path}.json"
+    headers = {}
+    cache_entry = None
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    part_meta = {}
+    if offset and os.path.exists(meta_path):
+        with open(meta_path, 'r', encoding='utf-8') as file:
+            part_meta = json.load(file)
+
+    if offset and part_meta.get("decompress") == decompress:
+        headers["Range"] = f"bytes={offset}-"
+        validator = part_meta.get("etag") or part_meta.get("last_modified")
+        if validator:
+            headers["If-Range"] = validator
+        if decompress:
+            # Decoded bytes on disk line up with the identity encoding's byte ranges
+            headers["Accept-Encoding"] = "identity"
+    else:
+        offset = 0
+        if HTTP_CACHE_ENABLED and decompress:
+            cache_entry = http_cache.lookup(url)
+        if cache_entry and http_cache.is_fresh(cache_entry):
+            http_cache.copy_body(cache_entry, output_location)
+            return {"bytes": os.path.getsize(output_location), "resumed_from": 0, "cache_status": "hit"}
+        if cache_entry:
+            if cache_entry["etag"]:
+                headers["If-None-Match"] = cache_entry["etag"]
+            if cache_entry["last_modified"]:
+                headers["If-Modified-Since"] = cache_entry["last_modified"]
+
+    with session.get(
+        url,
+        headers=headers,
+        stream=True,
+        timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT),
+    ) as response:
+        if response.status_code == 304 and cache_entry:
+            http_cache.refresh(url, response.headers)
+            http_cache.copy_body(cache_entry, output_location)
+            return {"bytes": os.path.getsize(output_location), "resumed_from": 0, "cache_status": "revalidated"}
+
+        if response.status_code == 416 and offset:
+            # The .part file already holds the whole resource if its size matches the total
+            total = response.headers.get("Content-Range", "").rpartition("/")[2]
+            if total.isdigit() and int(total) == offset:
+                os.replace(part_path, output_location)
+                os.remove(meta_path)
+                return {"bytes": offset, "resumed_from": offset, "cache_status": "bypass"}
+            os.remove(part_path)
+            raise requests.exceptions.ConnectionError("Stale partial download discarded")
+
+        response.raise_for_status()
+        if response.status_code == 206:
+            match = re.match(r"bytes (\d+)-", response.headers.get("Content-Range", ""))
+            if not match or int(match.group(1)) != offset:
+                os.remove(part_path)
+                raise requests.exceptions.ConnectionError("Server resumed at an unexpected offset")
+            mode = 'ab'
+        else:
+            offset = 0
+            mode = 'wb'
+
+        with open(meta_path, 'w', encoding='utf-8') as file:
+            json.dump(
+                {
+                    "etag": response.headers.get("ETag"),
+                    "last_modified": response.headers.get("Last-Modified"),
+                    "decompress": decompress,
+                },
+                file,
+            )
+
+        if decompress:
+            chunks = response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE)
+        else:
+            chunks = response.raw.stream(DOWNLOAD_CHUNK_SIZE, decode_content=False)
+        with open(part_path, mode) as file:
+            for chunk in chunks:
+                file.write(chunk)
+
+        os.replace(part_path, output_location)
+        os.remove(meta_path)
+
+        cache_status = "bypass"
+        if (
+            HTTP_CACHE_ENABLED
+            and decompress
+            and response.status_code == 200
+            and http_cache.store_file(url, response.headers, output_location)
+        ):
+            cache_status = "miss"
+        return {"bytes": os.path.getsize(output_location), "resumed_from": offset, "cache_status": cache_status}
+
+
+def _download(session, url: str, output_location: str, decompress: bool = True) -> Dict[str, Any]:
+    """Downloads url to output_location, resuming after dropped connections or read timeouts."""
+    for attempt in range(DOWNLOAD_RETRIES + 1):
+        try:
+            result = _download_once(session, url, output_location, decompress)
+            record_cache_event("http", result["cache_status"])
+            return {"url": url, "output_location": output_location, **result}
+        except (
+            requests.exceptions.ConnectionError,
+            requests.exceptions.ChunkedEncodingError,
+            requests.exceptions.ReadTimeout,
+        ) as e:
+            if attempt == DOWNLOAD_RETRIES:
+                raise
+            print(f"Download of {url} interrupted ({e}), resuming (attempt {attempt + 2})")
+            time.sleep(min(2 ** attempt, 10) * 0.5)
+
+
+def _batch_output_paths(urls: List[str], output_dir: str) -> List[str]:
+    """Derives a unique file name in output_dir for every URL."""
+    paths = []
+    used = set()
+    for url in urls:
+        name = os.path.basename(urlparse(url).path) or hashlib.sha1(url.encode()).hexdigest()[:16]
+        stem, extension = os.path.splitext(name)
+        candidate = name
+        counter = 1
+        while candidate in used:
+            candidate = f"{stem}-{counter}{extension}"
+            counter += 1
+        used.add(candidate)
+        paths.append(os.path.join(output_dir, candidate))
+    return paths
+
+
+def fetch_and_save_api(
+    input_location: str,
+    output_location: str,
+    urls: List[str] = None,
+    decompress: bool = True,
+    max_workers: int = DOWNLOAD_MAX_WORKERS,
+):
+    """
     Fetches data from an API URL and saves it to a file.
+
+    The body is streamed to a temporary .part file and renamed into place, so large or
+    binary payloads are never held in memory or decoded as text, and an interrupted
+    download resumes with a Range request.
     
     Args:
         input_location (str): The API URL to fetch data from
-        output_location (str): The path where the API response should be saved
+        output_location (str): The path where the API response should be saved, or the
+            directory to save into in batch mode
+        urls (list): Optional extra URLs; downloads them concurrently into output_location
+        decompress (bool): Undo Content-Encoding (gzip, deflate, ...) while saving
+        max_workers (int): Upper bound on concurrent downloads in batch mode
     """
+    if urls:
+        all_urls = [u for u in ([input_location] if input_location else []) + list(urls) if u]
+        os.makedirs(output_location, exist_ok=True)
+        paths = _batch_output_paths(all_urls, output_location)
+        workers = max(1, min(max_workers, len(all_urls)))
+
+        with _download_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+
+            def download_one(url, path):
+                try:
+                    return {"status": "success", **_download(session, url, path, decompress)}
+                except Exception as e:
+                    return {"status": "error", "url": url, "output_location": path, "error": str(e)}
+
+            results = list(executor.map(download_one, all_urls, paths))
+
+        failed = sum(1 for result in results if result["status"] != "success")
+        return {
+            "status": "success" if not failed else "partial",
+            "message": f"Downloaded {len(results) - failed} of {len(results)} URLs to {output_location}",
+            "results": results,
+        }
+
     try:
-        response = requests.get(input_location)
-        response.raise_for_status()  # Raises an HTTPError for bad responses
-        
-        with open(output_location, 'w', encoding='utf-8') as file:
-            file.write(response.text)
+        with _download_session(1) as session:
+            result = _download(session, input_location, output_location, decompress)
             
         return {
             "status": "success",
-            "message": f"API data successfully fetched and saved to {output_location}"
+            "message": f"API data successfully fetched and saved to {output_location}",
+            "cache_status": result["cache_status"],
+            "bytes": result["bytes"],
+            "resumed_from": result["resumed_from"],
         }
     except requests.exceptions.RequestException as e:
         raise HTTPException(status_code=500, detail=f"Error fetching API data: {str(e)}")
@@ -849,8 +3757,10 @@ EXTRACT_SENDER_EMAIL = {
         "name": "extract_sender_email",
         "description": """
             Extracts the sender's email address from an email file and saves it to an output file.
+            Given a Maildir, an mbox file or a directory of .txt/.eml messages, it writes a CSV
+            with the sender of every message instead.
             Input:
-                - input_location (string): The path to the email file.
+                - input_location (string): The path to the email file, mailbox or directory.
                 - output_location (string): The path where the extracted email address should be saved.
             Output:
                 - A JSON object with a "status" field (string) indicating "Success" or "Error",
@@ -881,6 +3791,8 @@ CALCULATE_GOLD_SALES = {
             Input:
                 - input_location (string): Path to the SQLite database file.
                 - output_location (string): Path to the output file where the total should be written.
+                - profile (boolean, optional): Include the query plan, execution time and index advice.
+                - create_indexes (boolean, optional): Create the covering indexes suggested by the advisor.
             Output:
                 - A JSON object with a "status" field (string) indicating "Success" or "Error",
                   and an "output_file_destination" field (string) containing the path to the result file.
@@ -893,6 +3805,14 @@ CALCULATE_GOLD_SALES = {
                     "description": "Path to the SQLite database file",
                 },
                 "output_location": {"type": "string", "description": "Path to the output file"},
+                "profile": {
+                    "type": "boolean",
+                    "description": "Return the query plan, execution time and index advice",
+                },
+                "create_indexes": {
+                    "type": "boolean",
+                    "description": "Create the indexes suggested by the index advisor",
+                },
             },
             "required": ["input_location", "output_location"],
             "additionalProperties": False,
@@ -936,9 +3856,16 @@ SCRAPE_WEBSITE = {
         "description": """
             Scrapes content from a specified website URL and saves the extracted data to a JSON file.
             The scraper extracts title, text content, links, and headers.
+            Given a list of URLs or a crawl depth, it crawls concurrently instead and writes
+            one JSON line per page (NDJSON) with per-page timings and errors.
             Input:
-                - url (string): The URL of the website to scrape
+                - url (string): The URL of the website to scrape, or the crawl seed
                 - output_location (string): The path where the scraped data should be saved
+                - urls (array of strings, optional): Additional URLs to crawl
+                - max_depth (integer, optional): How many link levels to follow from the seeds
+                - max_pages (integer, optional): Upper bound on the number of pages crawled
+                - fields (array of strings, optional): Subset of "title", "text", "links", "headers" to extract
+                - max_bytes (integer, optional): Pages larger than this are truncated before parsing
             Output:
                 - A JSON object with status, message, and the scraped URL
         """,
@@ -950,6 +3877,28 @@ SCRAPE_WEBSITE = {
                     "type": "string",
                     "description": "Output file path for scraped data",
                 },
+                "urls": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Additional URLs to crawl",
+                },
+                "max_depth": {
+                    "type": "integer",
+                    "description": "Link depth to follow from the seed URLs",
+                },
+                "max_pages": {
+                    "type": "integer",
+                    "description": "Maximum number of pages to crawl",
+                },
+                "fields": {
+                    "type": "array",
+                    "items": {"type": "string", "enum": ["title", "text", "links", "headers"]},
+                    "description": "Fields to extract from each page (default: all)",
+                },
+                "max_bytes": {
+                    "type": "integer",
+                    "description": "Maximum page size in bytes; larger pages are truncated",
+                },
             },
             "required": ["url", "output_location"],
             "additionalProperties": False,
@@ -1068,7 +4017,7 @@ EXTRACT_CREDIT_CARD = {
     "type": "function",
     "function": {
         "name": "extract_credit_card",
-        "description": "Extract the credit card number from an image file.",
+        "description": "Extract the credit card number from an image file, or from several images at once.",
         "parameters": {
             "type": "object",
             "properties": {
@@ -1076,6 +4025,11 @@ EXTRACT_CREDIT_CARD = {
                     "type": "string",
                     "description": "The path of the image file containing the credit card number.",
                 },
+                "input_paths": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Additional image paths; results are written as CSV rows to output_path.",
+                },
                 "output_path": {
                     "type": "string",
                     "description": "The path of the file to write the extracted credit card number.",
@@ -1095,7 +4049,12 @@ RUN_SQL_QUERY = {
             Input:
                 - input_location (string): Path to the SQLite (.db) or DuckDB (.duckdb) database file.
                 - output_location (string): Path where the query results should be saved.
+                  The extension selects the format: .csv, .json, .txt (tab separated),
+                  .parquet, or .arrow/.feather (Arrow IPC).
                 - query (string): SQL query to execute.
+                - profile (boolean, optional): Include the query plan (EXPLAIN QUERY PLAN for SQLite,
+                  EXPLAIN ANALYZE for DuckDB), execution time and index advice.
+                - create_indexes (boolean, optional): Create the covering indexes suggested by the advisor.
             Output:
                 - A JSON object with a "status" field (string) indicating "Success" or "Error",
                   and a "message" field (string) containing the path to the results file.
@@ -1106,6 +4065,14 @@ RUN_SQL_QUERY = {
                 "input_location": {"type": "string", "description": "Path to the database file"},
                 "output_location": {"type": "string", "description": "Path to save the query results"},
                 "query": {"type": "string", "description": "SQL query to execute"},
+                "profile": {
+                    "type": "boolean",
+                    "description": "Return the query plan, execution time and index advice",
+                },
+                "create_indexes": {
+                    "type": "boolean",
+                    "description": "Create the indexes suggested by the index advisor",
+                },
             },
             "required": ["input_location", "output_location", "query"],
             "additionalProperties": False,
@@ -1119,9 +4086,14 @@ FETCH_API_DATA = {
         "name": "fetch_and_save_api",
         "description": """
             Fetches data from a specified API URL and saves the response to a file.
+            The response is streamed to disk, so large and binary payloads are supported,
+            and interrupted downloads are resumed.
             Input:
                 - input_location (string): The API URL to fetch data from
-                - output_location (string): The path where the API response should be saved
+                - output_location (string): The path where the API response should be saved,
+                  or the directory to save into when several URLs are given
+                - urls (array of strings, optional): Additional URLs to download concurrently
+                - decompress (boolean, optional): Undo gzip/deflate Content-Encoding (default true)
             Output:
                 - A JSON object with a "status" field (string) indicating "Success" or "Error",
                   and a "message" field (string) containing the result details.
@@ -1131,6 +4103,15 @@ FETCH_API_DATA = {
             "properties": {
                 "input_location": {"type": "string", "description": "API URL to fetch data from"},
                 "output_location": {"type": "string", "description": "Output file path"},
+                "urls": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Additional URLs to download into the output directory",
+                },
+                "decompress": {
+                    "type": "boolean",
+                    "description": "Decode compressed transfer encodings while saving",
+                },
             },
             "required": ["input_location", "output_location"],
             "additionalProperties": False,
@@ -1160,14 +4141,7 @@ tools = [
 ]
 
 
-def query_gpt(user_input: str, tools: list[Dict[str, Any]]) -> Dict[str, Any]:
-    if not AIPROXY_Token:
-        raise HTTPException(
-            status_code=500, detail="AIPROXY_TOKEN environment variable is missing"
-        )
-    # print("AIPROXY_Token:", AIPROXY_Token)
-
-    system_instruction = """
+SYSTEM_INSTRUCTION = """
     You are an advanced AI assistant capable of understanding instructions in any multilingual language.
     Your role is to:
     1. Identify the core task from a given instruction, regardless of language.
@@ -1181,28 +4155,175 @@ def query_gpt(user_input: str, tools: list[Dict[str, Any]]) -> Dict[str, Any]:
     You must support tasks written in multiple languages and different formats while ensuring correctness.
     """
 
+# Number of best-scoring tools sent to the model per task; 0 always sends the full set
+TOOL_SELECTION_TOP_K = int(os.getenv("TOOL_SELECTION_TOP_K", "4"))
+
+TOOL_SELECTION_STOPWORDS = {
+    "the", "and", "for", "with", "from", "into", "that", "this", "then", "file", "files",
+    "path", "data", "write", "writes", "output", "input", "location", "string", "json",
+    "object", "field", "containing", "return", "returns", "result", "status", "success",
+    "error", "please", "each", "all", "are", "its", "should", "save", "given",
+}
+
+# Serialized request fragments are built once and reused on every completion
+_SYSTEM_MESSAGE_JSON = json.dumps({"role": "system", "content": SYSTEM_INSTRUCTION})
+_tool_json_cache = {}
+_tool_json_lock = threading.Lock()
+
+tool_selection_stats = Counter()
+
+
+def _serialized_tools(tool_list: List[Dict[str, Any]]) -> str:
+    """Joins the cached JSON of each tool schema, serializing a schema the first time it is seen."""
+    pieces = []
+    for tool in tool_list:
+        cached = _tool_json_cache.get(id(tool))
+        if cached is None or cached[0] is not tool:
+            cached = (tool, json.dumps(tool))
+            with _tool_json_lock:
+                _tool_json_cache[id(tool)] = cached
+        pieces.append(cached[1])
+    return ", ".join(pieces)
+
+
+def _chat_request_body(
+    user_input: str, tool_list: List[Dict[str, Any]], extra_instruction: str = None
+) -> bytes:
+    if extra_instruction:
+        system_message = json.dumps(
+            {"role": "system", "content": SYSTEM_INSTRUCTION + extra_instruction}
+        )
+    else:
+        system_message = _SYSTEM_MESSAGE_JSON
+    user_message = json.dumps({"role": "user", "content": user_input})
+    return (
+        '{"model": "gpt-4o-mini", "messages": [' + system_message + ", " + user_message + "], "
+        '"tools": [' + _serialized_tools(tool_list) + '], "tool_choice": "auto"}'
+    ).encode("utf-8")
+
+
+def _selection_tokens(text: str) -> List[str]:
+    tokens = []
+    for token in re.findall(r"[a-z0-9]+", text.lower()):
+        if len(token) < 3 or token in TOOL_SELECTION_STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+def _build_tool_index(tool_list: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    Builds per-tool keyword weights from each schema's name, description and parameters. Name
+    words count triple, and every word is scaled by how few tools mention it.
+    """
+    weights = {}
+    for tool in tool_list:
+        function = tool["function"]
+        parameters = function.get("parameters", {}).get("properties", {})
+        described = " ".join(
+            [function.get("description", "")]
+            + [f"{name} {spec.get('description', '')}" for name, spec in parameters.items()]
+        )
+        tool_weights = {token: 1.0 for token in _selection_tokens(described)}
+        for token in _selection_tokens(function["name"].replace("_", " ")):
+            tool_weights[token] = 3.0
+        weights[function["name"]] = tool_weights
+
+    document_frequency = Counter(token for tool_weights in weights.values() for token in tool_weights)
+    for tool_weights in weights.values():
+        for token in tool_weights:
+            tool_weights[token] *= math.log(1 + len(weights) / document_frequency[token])
+    return weights
+
+
+def select_tools(task_text: str, tool_list: List[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Returns the TOOL_SELECTION_TOP_K tools whose keywords best match the task, or the full list
+    when selection is disabled or nothing matches (e.g. a task in another language).
+    """
+    tool_list = tools if tool_list is None else tool_list
+    if TOOL_SELECTION_TOP_K <= 0 or TOOL_SELECTION_TOP_K >= len(tool_list):
+        return tool_list
+
+    task_tokens = set(_selection_tokens(task_text))
+    scores = []
+    for position, tool in enumerate(tool_list):
+        tool_weights = tool_index.get(tool["function"]["name"], {})
+        score = sum(tool_weights.get(token, 0.0) for token in task_tokens)
+        if score > 0:
+            scores.append((-score, position, tool))
+    if not scores:
+        tool_selection_stats["unmatched"] += 1
+        return tool_list
+    return [tool for _, _, tool in sorted(scores)[:TOOL_SELECTION_TOP_K]]
+
+
+def record_tool_selection(sent: List[Dict[str, Any]], query: Dict[str, Any]):
+    """Tracks schema bytes and prompt tokens with and without pruning to measure the savings."""
+    kind = "pruned" if len(sent) < len(tools) else "full"
+    tool_selection_stats[f"{kind}_requests"] += 1
+    tool_selection_stats[f"{kind}_schema_bytes"] += len(_serialized_tools(sent))
+    tool_selection_stats["full_schema_bytes_baseline"] += len(_serialized_tools(tools))
+    tool_selection_stats[f"{kind}_prompt_tokens"] += query.get("usage", {}).get("prompt_tokens", 0)
+
+
+def tool_selection_summary() -> Dict[str, Any]:
+    stats = dict(tool_selection_stats)
+    requests_total = stats.get("pruned_requests", 0) + stats.get("full_requests", 0)
+    sent_bytes = stats.get("pruned_schema_bytes", 0) + stats.get("full_schema_bytes", 0)
+    saved_bytes = stats.get("full_schema_bytes_baseline", 0) - sent_bytes
+    summary = {
+        **stats,
+        "top_k": TOOL_SELECTION_TOP_K,
+        "schema_bytes_saved": saved_bytes,
+        # Roughly four bytes of JSON per token for the schemas
+        "estimated_prompt_tokens_saved": saved_bytes // 4,
+    }
+    for kind in ("pruned", "full"):
+        if stats.get(f"{kind}_requests"):
+            summary[f"{kind}_avg_prompt_tokens"] = round(
+                stats.get(f"{kind}_prompt_tokens", 0) / stats[f"{kind}_requests"], 1
+            )
+    summary["requests"] = requests_total
+    return summary
+
+
+def query_gpt(
+    user_input: str, tools: list[Dict[str, Any]], extra_instruction: str = None
+) -> Dict[str, Any]:
+    if not AIPROXY_Token:
+        raise HTTPException(
+            status_code=500, detail="AIPROXY_TOKEN environment variable is missing"
+        )
+    # print("AIPROXY_Token:", AIPROXY_Token)
+
+    started = time.perf_counter()
     try:
-        response = requests.post(
-            "https://aiproxy.sanand.workers.dev/openai/v1/chat/completions",
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {AIPROXY_Token}",
-            },
-            json={
-                "model": "gpt-4o-mini",
-                "messages": [
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": user_input},
-                ],
-                "tools": tools,
-                "tool_choice": "auto",
-            },
-            verify=False,  # Use with caution in production!
+        response = aiproxy_post(
+            "/chat/completions", data=_chat_request_body(user_input, tools, extra_instruction)
+        )
+        # Client errors say nothing about load; only 429 and 5xx count as overload
+        admission_controller.record_latency(
+            time.perf_counter() - started,
+            response.status_code != 429 and response.status_code < 500,
         )
         response.raise_for_status()
-        return response.json()
+        result = response.json()
+        usage = result.get("usage") or {}
+        for kind in ("prompt_tokens", "completion_tokens"):
+            if usage.get(kind):
+                LLM_TOKENS.labels(kind.split("_")[0]).inc(usage[kind])
+        return result
+    except OutboundUnavailable as e:
+        print(f"GPT API unavailable: {e}")
+        admission_controller.record_latency(time.perf_counter() - started, False)
+        raise HTTPException(status_code=503, detail=f"GPT API unavailable: {e}")
     except requests.exceptions.RequestException as e:
         print(f"Error calling GPT API: {e}")
+        if getattr(e, "response", None) is None:  # HTTP errors were recorded above
+            admission_controller.record_latency(time.perf_counter() - started, False)
         raise HTTPException(status_code=500, detail=f"GPT API error: {e}")
     except json.JSONDecodeError as e:
         print(f"Invalid JSON response from GPT API: {e}")
@@ -1230,11 +4351,319 @@ FUNCTIONS = {
     "fetch_and_save_api": fetch_and_save_api
 }
 
+tool_index = _build_tool_index(tools)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key onto one execution. Callers arriving while
+    the call is in flight wait for it and receive the same result or exception; the key is
+    released as soon as the call finishes, so later calls run again.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def _join(self, key):
+        """Returns (future, is_leader) for key, registering a new future if none is in flight."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = concurrent.futures.Future()
+            self._calls[key] = future
+            return future, True
+
+    def _run(self, key, future, fn, *args, **kwargs):
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def do(self, key, fn, *args, **kwargs):
+        """Blocking variant for worker threads."""
+        future, leader = self._join(key)
+        if leader:
+            self._run(key, future, fn, *args, **kwargs)
+        return future.result()
+
+    async def do_async(self, key, fn, *args):
+        """
+        Event-loop variant: the blocking fn runs once in the default executor. It is not tied
+        to the first caller, so one client disconnecting does not cancel it for the others.
+        """
+        future, leader = self._join(key)
+        if leader:
+            loop = asyncio.get_running_loop()
+            loop.run_in_executor(
+                None, contextvars.copy_context().run, self._run, key, future, fn, *args
+            )
+        return await asyncio.shield(asyncio.wrap_future(future))
+
+
+# /run requests with the same task text share one routing-and-execution
+task_single_flight = SingleFlight("task")
+# Tool calls with the same function and arguments share one execution, whatever the wording
+execution_single_flight = SingleFlight("execution")
+
+
+def normalize_task(task_text: str) -> str:
+    """Collapses whitespace so trivially different copies of a task coalesce."""
+    return " ".join(task_text.split())
+
+
+def execute_tool_call(function_name: str, arguments: Dict[str, Any]):
+    """Runs a FUNCTIONS entry; identical concurrent calls share one execution and output write."""
+    if function_name not in FUNCTIONS:
+        raise HTTPException(status_code=400, detail=f"Function not found: {function_name}")
+    try:
+        inspect.signature(FUNCTIONS[function_name]).bind(**arguments)
+    except TypeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid arguments for {function_name}: {e}")
+
+    key = (function_name, json.dumps(arguments, sort_keys=True, default=str))
+    try:
+        return execution_single_flight.do(key, _timed_tool_call, function_name, arguments)
+    except Overloaded:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error calling function: {e}")
+
+
+def _timed_tool_call(function_name: str, arguments: Dict[str, Any], fn=None):
+    with tool_limiter.slot(function_name):
+        return _run_tool(function_name, arguments, fn)
+
+
+# Tools whose written file differs from their output arguments
+OUTPUT_RESOLVERS = {
+    "run_sql_query": lambda arguments: [_sql_output_location(arguments.get("output_location"))],
+    "count_days": lambda arguments: [_count_days_output(arguments)],
+    "generate_markdown_index": lambda arguments: ["data/index.json"],
+}
+
+
+def tool_output_paths(function_name: str, arguments: Dict[str, Any]) -> List[str]:
+    """Absolute paths of the files a tool call writes, for the cross-process output locks."""
+    resolver = OUTPUT_RESOLVERS.get(function_name)
+    if resolver is not None:
+        paths = resolver(arguments)
+    else:
+        paths = [value for name, value in arguments.items() if "output" in name and isinstance(value, str)]
+    # In-memory pipeline values are private to their run and need no lock
+    return sorted({
+        os.path.abspath(path) for path in paths if path and not path.startswith(MEMORY_SCHEME)
+    })
+
+
+def _run_tool(function_name: str, arguments: Dict[str, Any], fn=None):
+    """Runs the tool, or fn in its place (a pipeline's in-memory form), with locks and metrics."""
+    in_flight = TOOL_IN_FLIGHT.labels(function_name)
+    in_flight.inc()
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        # Tasks in other workers writing the same output wait instead of interleaving writes
+        with ExitStack() as locks:
+            for path in tool_output_paths(function_name, arguments):
+                locks.enter_context(output_lock(path))
+            report_progress("execution", state="start", tool=function_name)
+            with observe_stage("execution"):
+                result = fn() if fn is not None else run_with_build_cache(function_name, arguments)
+        outcome = "success"
+        return result
+    finally:
+        elapsed = time.perf_counter() - started
+        TOOL_SECONDS.labels(function_name, outcome).observe(elapsed)
+        in_flight.dec()
+        report_progress(
+            "execution", state="done", tool=function_name, outcome=outcome, seconds=round(elapsed, 4)
+        )
+
+
+def route_and_execute(task_text: str):
+    """Asks the LLM which tool handles the task and runs it. Blocking; called off the event loop."""
+    route_key = cache_key("route", normalize_task(task_text))
+    cached_route = shared_cache.get_json("routing", route_key) if ROUTING_CACHE_TTL > 0 else None
+    if cached_route is not None:
+        record_cache_event("routing", "hit")
+        tool_calls = [{"function": cached_route}]
+    else:
+        record_cache_event("routing", "miss")
+        tool_calls = _route_with_llm(task_text)
+        if tool_calls:
+            # Any worker seeing the same task text reuses this routing decision
+            first = tool_calls[0]["function"]
+            shared_cache.set_json(
+                "routing", route_key,
+                {"name": first["name"], "arguments": first.get("arguments", "{}")},
+                ttl=ROUTING_CACHE_TTL,
+            )
+    if not tool_calls:
+        report_progress("routing", state="done", tool=None)
+        return {"message": "No tool calls found."}
+
+    tool_call = tool_calls[0]
+    function_name = tool_call["function"]["name"]
+    arguments_json = tool_call["function"].get("arguments", "{}")
+    report_progress("routing", state="done", tool=function_name, cached=cached_route is not None)
+
+    try:
+        with observe_stage("argument_parsing"):
+            arguments = json.loads(arguments_json)
+    except json.JSONDecodeError as e:
+        raise HTTPException(status_code=400, detail=f"Invalid JSON arguments: {e}")
+
+    return execute_tool_call(function_name, arguments)
+
+
+def _route_with_llm(task_text: str) -> List[Dict[str, Any]]:
+    """Returns the model's tool calls for the task, retrying with every tool if the shortlist missed."""
+    candidates = select_tools(task_text)
+    with observe_stage("routing"):
+        query = query_gpt(task_text, candidates)
+    record_tool_selection(candidates, query)
+    print(query)
+
+    tool_calls = query.get("choices", [{}])[0].get("message", {}).get("tool_calls", [])
+    if not tool_calls and len(candidates) < len(tools):
+        # The shortlist may have missed the right tool; retry once with every tool
+        tool_selection_stats["fallback_retries"] += 1
+        with observe_stage("routing"):
+            query = query_gpt(task_text, tools)
+        record_tool_selection(tools, query)
+        tool_calls = query.get("choices", [{}])[0].get("message", {}).get("tool_calls", [])
+    return tool_calls
+
+
+# On-demand profiling of /run via an X-Profile header or ?profile=1
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# Fraction of ordinary /run requests profiled in the background, kept only if among the slowest
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+
+
+class SamplingProfiler:
+    """
+    Samples one thread's Python stack every `interval` seconds from a helper thread and
+    aggregates the stacks into folded format ("outer;inner count"), which flamegraph.pl and
+    speedscope read directly.
+    """
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common())
+
+
+class ProfileStore:
+    """Keeps the PROFILE_KEEP slowest profiles; faster ones are dropped once it is full."""
+
+    def __init__(self, keep: int):
+        self.keep = keep
+        self._heap = []
+        self._counter = 0
+        self._lock = threading.Lock()
+
+    def add(self, profile: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self._counter += 1
+            profile["id"] = f"{int(time.time())}-{self._counter}"
+            entry = (profile["duration"], self._counter, profile)
+            if len(self._heap) < self.keep:
+                heapq.heappush(self._heap, entry)
+            elif self.keep > 0 and entry[0] > self._heap[0][0]:
+                heapq.heapreplace(self._heap, entry)
+        return profile
+
+    def list(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            profiles = [entry[2] for entry in sorted(self._heap, reverse=True)]
+        return [{key: value for key, value in p.items() if key != "folded"} for p in profiles]
+
+    def get(self, profile_id: str):
+        with self._lock:
+            for _, _, profile in self._heap:
+                if profile["id"] == profile_id:
+                    return profile
+        return None
+
+
+profile_store = ProfileStore(PROFILE_KEEP)
+
+
+def profile_call(label: str, fn, *args):
+    """
+    Runs fn in the current thread under the sampling profiler, collecting per-stage timings
+    from observe_stage. Returns (result, profile); the profile is stored even if fn fails.
+    """
+    profiler = SamplingProfiler(threading.get_ident())
+    timings = Counter()
+    token = _stage_timings.set(timings)
+    error = None
+    started = time.perf_counter()
+    profiler.start()
+    try:
+        result = fn(*args)
+    except Exception as e:
+        error = str(getattr(e, "detail", e))
+        raise
+    finally:
+        profiler.stop()
+        _stage_timings.reset(token)
+        duration = time.perf_counter() - started
+        profile = profile_store.add({
+            "label": label,
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "duration": round(duration, 4),
+            "stages": {stage: round(seconds, 4) for stage, seconds in timings.items()},
+            "samples": profiler.samples,
+            "interval": profiler.interval,
+            "error": error,
+            "folded": profiler.folded(),
+        })
+    return result, profile
+
 
 @app.post("/run")
 async def run(
+    request: Request,
     task: str = Query(None, description="Task to execute"),  # Add query parameter support
     task_request: RunTaskRequest = None,  # Make the JSON body optional
+    profile: bool = Query(False, description="Return a sampling profile with the result"),
 ):
     # Get the task either from query parameter or request body
     task_text = task or (task_request.task if task_request else None)
@@ -1249,58 +4678,1036 @@ async def run(
     if not task_text:
         raise HTTPException(status_code=400, detail="Task cannot be empty")
 
+    profile_requested = profile or request.headers.get("x-profile", "").lower() in ("1", "true")
+    if profile_requested and not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled on this server")
+    sampled = PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+
     try:
-        query = query_gpt(task_text, tools)
-        print(query)
+        # Waits for a slot, or fails fast with 429/503 and Retry-After when overloaded
+        async with admission_controller.slot():
+            if profile_requested or sampled:
+                # Profiled runs skip coalescing so the profile covers this request's own work
+                result, recorded = await run_in_threadpool(
+                    profile_call, task_text, route_and_execute, task_text
+                )
+                if profile_requested and isinstance(result, dict):
+                    result = {**result, "profile": recorded}
+                return result
 
-        tool_calls = query.get("choices", [{}])[0].get("message", {}).get("tool_calls", [])
+            # Identical concurrent tasks share one routing call and one execution
+            return await task_single_flight.do_async(
+                normalize_task(task_text), route_and_execute, task_text
+            )
+
+    except HTTPException as e:
+        raise
+    except Exception as e:
+        print(f"An unexpected error occurred: {e}")
+        raise HTTPException(status_code=500, detail="An unexpected error occurred.")
+
+
+# /run/stream: seconds between heartbeat events, and the minimum gap between two progress
+# events of the same stage (start/done transitions are always sent)
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "5"))
+SSE_PROGRESS_INTERVAL = float(os.getenv("SSE_PROGRESS_INTERVAL", "0.5"))
+
+
+def _sse_event(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+def start_task_stream(task_text: str, on_done=None):
+    """
+    Starts the task in the thread pool and returns an async iterator of server-sent events:
+    progress events reported by the task, a heartbeat every SSE_HEARTBEAT_INTERVAL seconds, then
+    one result or error event. The event loop only waits on a queue, so a slow task holds no
+    more than its pool thread. `on_done` runs when the task finishes, even if the client left.
+    """
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    last_sent = {}
+    started = time.perf_counter()
+
+    def emit(event, data):
+        loop.call_soon_threadsafe(events.put_nowait, (event, data))
+
+    def on_progress(stage, fields):
+        now = time.perf_counter()
+        if "state" not in fields and now - last_sent.get(stage, 0.0) < SSE_PROGRESS_INTERVAL:
+            return
+        last_sent[stage] = now
+        emit("progress", {"stage": stage, **fields, "elapsed": round(now - started, 3)})
+
+    def work():
+        _progress_callback.set(on_progress)
+        try:
+            emit("result", {"result": route_and_execute(task_text)})
+        except HTTPException as e:
+            emit("error", {"status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            print(f"An unexpected error occurred: {e}")
+            emit("error", {"status_code": 500, "detail": "An unexpected error occurred."})
+        finally:
+            if on_done is not None:
+                on_done()
+
+    loop.run_in_executor(None, contextvars.copy_context().run, work)
+
+    async def stream():
+        yield _sse_event("start", {"task": task_text})
+        last_progress = {}
+        while True:
+            try:
+                event, data = await asyncio.wait_for(events.get(), SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield _sse_event("heartbeat", {
+                    "elapsed": round(time.perf_counter() - started, 3), "last_progress": last_progress,
+                })
+                continue
+            if event == "progress":
+                last_progress = data
+                yield _sse_event(event, data)
+                continue
+            data["elapsed"] = round(time.perf_counter() - started, 3)
+            yield _sse_event(event, data)
+            return
+
+    return stream()
+
+
+@app.api_route("/run/stream", methods=["GET", "POST"])
+async def run_stream(
+    task: str = Query(None, description="Task to execute"),
+    task_request: RunTaskRequest = None,
+):
+    """Like /run, but streams progress as server-sent events (usable from a browser EventSource)."""
+    task_text = (task or (task_request.task if task_request else None) or "").strip()
+    if not task_text:
+        raise HTTPException(
+            status_code=400,
+            detail="Task must be provided either in query parameter or request body",
+        )
+    # Admission is decided before the stream starts so rejections keep their 429/503 status
+    await admission_controller.acquire()
+    admitted_at = time.monotonic()
+    return StreamingResponse(
+        start_task_stream(
+            task_text, on_done=lambda: admission_controller.release(time.monotonic() - admitted_at)
+        ),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Tasks routed per completion by /run/batch
+BATCH_PACK_SIZE = int(os.getenv("BATCH_PACK_SIZE", "10"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", str(min(32, (os.cpu_count() or 1) + 4))))
+BATCH_MAX_TASKS = int(os.getenv("BATCH_MAX_TASKS", "500"))
+
+BATCH_INSTRUCTION = """
+    The input lists several numbered tasks. Make exactly one tool call for every task and set
+    the call's task_id argument to that task's number. Treat each task independently.
+"""
+
+_batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS, thread_name_prefix="batch")
+
+
+class RunBatchRequest(BaseModel):
+    tasks: List[str]
+    pack_size: int = BATCH_PACK_SIZE
+
+
+def _with_task_id(tool: Dict[str, Any]) -> Dict[str, Any]:
+    """Copies a tool schema with a required task_id argument so one completion can route many tasks."""
+    parameters = dict(tool["function"].get("parameters") or {"type": "object", "properties": {}})
+    parameters["properties"] = {
+        "task_id": {"type": "integer", "description": "Number of the task this call handles"},
+        **parameters.get("properties", {}),
+    }
+    parameters["required"] = ["task_id"] + [
+        name for name in parameters.get("required", []) if name != "task_id"
+    ]
+    return {**tool, "function": {**tool["function"], "parameters": parameters}}
+
+
+batch_tools = [_with_task_id(tool) for tool in tools]
 
-        if tool_calls:
-            for tool_call in tool_calls:
-                function_name = tool_call["function"]["name"]
-                arguments_json = tool_call["function"].get("arguments", "{}")
 
+def plan_task_group(group: List[tuple]) -> Dict[int, tuple]:
+    """
+    Routes a group of (task_id, task) pairs with one completion. Returns {task_id: (name, arguments)}
+    for the tasks the model answered; tasks it skipped are left out and routed one by one.
+    """
+    user_input = "\n".join(f"Task {task_id}: {task}" for task_id, task in group)
+    # Send the union of every task's shortlist
+    selected = set()
+    for _, task in group:
+        selected.update(tool["function"]["name"] for tool in select_tools(task))
+    candidates = [tool for tool in batch_tools if tool["function"]["name"] in selected]
+    with observe_stage("routing"):
+        query = query_gpt(user_input, candidates, extra_instruction=BATCH_INSTRUCTION)
+    tool_calls = query.get("choices", [{}])[0].get("message", {}).get("tool_calls") or []
+
+    expected = {task_id for task_id, _ in group}
+    plan = {}
+    for tool_call in tool_calls:
+        try:
+            arguments = json.loads(tool_call["function"].get("arguments", "{}"))
+            task_id = int(arguments.pop("task_id"))
+        except (KeyError, TypeError, ValueError) as e:
+            print(f"Ignoring batched tool call without a usable task_id: {e}")
+            continue
+        if task_id in expected and task_id not in plan:
+            plan[task_id] = (tool_call["function"]["name"], arguments)
+    return plan
+
+
+def _batch_task_result(task_id: int, task: str, fn, *args) -> Dict[str, Any]:
+    started = time.perf_counter()
+    record = {"task_id": task_id, "task": task}
+    try:
+        record["status"] = "success"
+        record["result"] = fn(*args)
+    except HTTPException as e:
+        record.update(status="error", status_code=e.status_code, detail=e.detail)
+    except Exception as e:
+        record.update(status="error", status_code=500, detail=str(e))
+    record["elapsed"] = round(time.perf_counter() - started, 4)
+    return record
+
+
+def _route_single(task: str):
+    return task_single_flight.do(normalize_task(task), route_and_execute, task)
+
+
+async def run_batch_events(tasks: List[str], pack_size: int):
+    """
+    Plans the tasks in packed groups and executes each tool call as soon as its group is planned,
+    yielding one NDJSON line per task in completion order. Every planning call and every task
+    takes an admission slot like a /run request; tasks shed by admission control get an error
+    line with the 429/503 status and retry_after.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    numbered = list(enumerate(tasks))
+    pending = {}
+
+    def run_admitted(admitted_at, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            admission_controller.release(time.monotonic() - admitted_at)
+
+    async def submit(kind, fn, *args):
+        await admission_controller.acquire()
+        future = loop.run_in_executor(
+            _batch_executor, context.copy().run, run_admitted, time.monotonic(), fn, *args
+        )
+        pending[future] = kind
+
+    def shed(group, error):
+        return "".join(
+            json.dumps({
+                "task_id": task_id, "task": task, "status": "error", "status_code": error.status_code,
+                "detail": error.detail, "retry_after": int(error.headers["Retry-After"]), "elapsed": 0.0,
+            }) + "\n"
+            for task_id, task in group
+        )
+
+    for start in range(0, len(numbered), pack_size):
+        group = numbered[start:start + pack_size]
+        try:
+            await submit(("plan", group), plan_task_group, group)
+        except Overloaded as e:
+            yield shed(group, e)
+
+    while pending:
+        done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for future in done:
+            kind = pending.pop(future)
+            if kind[0] == "task":
+                yield json.dumps(future.result(), default=str) + "\n"
+                continue
+
+            group = kind[1]
+            try:
+                plan = future.result()
+            except Exception as e:
+                # A failed packed completion falls back to routing each task on its own
+                print(f"Batch planning failed, routing {len(group)} tasks individually: {e}")
+                plan = {}
+            for task_id, task in group:
                 try:
-                    arguments = json.loads(arguments_json)
-                except json.JSONDecodeError as e:
-                    raise HTTPException(status_code=400, detail=f"Invalid JSON arguments: {e}")
-
-                if function_name in FUNCTIONS:
-                    func = FUNCTIONS[function_name]
-                    try:
-                        output = func(**arguments)
-                        return output
-                    except Exception as e:
-                        raise HTTPException(status_code=500, detail=f"Error calling function: {e}")
-                else:
-                    raise HTTPException(
-                        status_code=400, detail=f"Function not found: {function_name}"
-                    )
+                    if task_id in plan:
+                        function_name, arguments = plan[task_id]
+                        await submit(("task",), _batch_task_result, task_id, task,
+                                     execute_tool_call, function_name, arguments)
+                    else:
+                        await submit(("task",), _batch_task_result, task_id, task, _route_single, task)
+                except Overloaded as e:
+                    yield shed([(task_id, task)], e)
+
+
+@app.post("/run/batch")
+async def run_batch(batch_request: RunBatchRequest):
+    tasks = [task.strip() for task in batch_request.tasks]
+    if not tasks:
+        raise HTTPException(status_code=400, detail="At least one task must be provided")
+    if len(tasks) > BATCH_MAX_TASKS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_TASKS} tasks per batch")
+    if not all(tasks):
+        raise HTTPException(status_code=400, detail="Tasks cannot be empty")
+    if not AIPROXY_Token:
+        raise HTTPException(status_code=500, detail="AIPROXY_TOKEN environment variable is missing")
+
+    pack_size = max(1, batch_request.pack_size)
+    return StreamingResponse(
+        run_batch_events(tasks, pack_size), media_type="application/x-ndjson"
+    )
+
+
+# /pipeline: chains tool calls and hands intermediate results over in memory
+PIPELINE_MEMORY_BUDGET = int(os.getenv("PIPELINE_MEMORY_BUDGET", str(256 * 1024 * 1024)))
+PIPELINE_SPILL_DIR = os.getenv("PIPELINE_SPILL_DIR", ".cache/pipeline")
+PIPELINE_MAX_STEPS = int(os.getenv("PIPELINE_MAX_STEPS", "20"))
+MEMORY_SCHEME = "mem://"
+MEMORY_NAME_PATTERN = re.compile(r"^\w[\w.-]*$")
+
+PIPELINE_INSTRUCTION = """
+    The task may need several tools in sequence. Make one tool call per step, in execution order.
+    Pass intermediate results from one step to the next through locations of the form
+    mem://<name> (for example mem://raw.csv, mem://rows) instead of files; use real paths only
+    for the outputs the task asks for.
+"""
+
+
+class PipelineStep(BaseModel):
+    tool: str
+    arguments: Dict[str, Any] = {}
+
+
+class PipelineRequest(BaseModel):
+    task: str = None
+    steps: List[PipelineStep] = None
+    memory_budget: int = PIPELINE_MEMORY_BUDGET
+
+
+def _memory_name(value):
+    """The name in a mem:// location, or None for anything else."""
+    if not isinstance(value, str) or not value.startswith(MEMORY_SCHEME):
+        return None
+    name = value[len(MEMORY_SCHEME):]
+    if not MEMORY_NAME_PATTERN.match(name):
+        raise HTTPException(status_code=400, detail=f"Invalid in-memory location: {value}")
+    return name
+
+
+class PipelineMemory:
+    """
+    Intermediate results of one pipeline run, by name: byte buffers or Arrow tables. Values stay
+    in memory until their total passes the budget, then the largest are spilled to the run's
+    directory (spilled tables are memory-mapped when read back). Steps that need a file get one
+    written on demand. Every file gets a fresh name, and goes away when its value is replaced.
+    """
+
+    def __init__(self, budget: int, directory: str):
+        self.budget = budget
+        self.directory = directory
+        self.entries = {}
+        self.in_memory_bytes = 0
+        self.peak_bytes = 0
+        self.spills = []
+        self.files_written = 0
+
+    def _new_path(self, name: str, extension: str) -> str:
+        # Names can differ only by extension (x and x.csv), so files are named by a hash of the
+        # name plus a counter, keeping the extension tools pick the format from
+        self.files_written += 1
+        digest = hashlib.sha1(name.encode("utf-8")).hexdigest()[:12]
+        return os.path.join(self.directory, f"{digest}-v{self.files_written}{extension}")
+
+    def put(self, name: str, value):
+        kind = "table" if hasattr(value, "num_rows") else "bytes"
+        size = value.nbytes if kind == "table" else len(value)
+        self.discard(name)
+        self.entries[name] = {"kind": kind, "value": value, "path": None, "rendered": None, "bytes": size}
+        self.in_memory_bytes += size
+        self.peak_bytes = max(self.peak_bytes, self.in_memory_bytes)
+        while self.in_memory_bytes > self.budget:
+            resident = [
+                (entry["bytes"], key) for key, entry in self.entries.items() if entry["value"] is not None
+            ]
+            if not resident:
+                break
+            self._spill(max(resident)[1], "memory_budget")
+
+    def put_file(self, name: str, path: str):
+        """Registers a file a tool wrote (at an output_path) as the value of `name`, without loading it."""
+        self.discard(name, keep=path)
+        self.entries[name] = {
+            "kind": "bytes", "value": None, "path": path, "rendered": None, "bytes": os.path.getsize(path)
+        }
+
+    def discard(self, name: str, keep: str = None):
+        entry = self.entries.pop(name, None)
+        if entry is None:
+            return
+        if entry["value"] is not None:
+            self.in_memory_bytes -= entry["bytes"]
+        for path in (entry["path"], entry["rendered"]):
+            if path and path != keep and os.path.exists(path):
+                os.remove(path)
+
+    def _entry(self, name: str):
+        if name not in self.entries:
+            raise HTTPException(
+                status_code=400, detail=f"{MEMORY_SCHEME}{name} is not produced by an earlier step"
+            )
+        return self.entries[name]
+
+    def _spill(self, name: str, reason: str):
+        import pyarrow as pa
+
+        entry = self.entries[name]
+        if entry["kind"] == "table":
+            path = self._new_path(name, ".arrow")
+            with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, entry["value"].schema) as writer:
+                writer.write_table(entry["value"])
         else:
-            return {"message": "No tool calls found."}
+            path = self._new_path(name, os.path.splitext(name)[1])
+            with open(path, "wb") as file:
+                file.write(entry["value"])
+        self.in_memory_bytes -= entry["bytes"]
+        entry.update(value=None, path=path)
+        self.spills.append({"name": name, "reason": reason, "bytes": entry["bytes"]})
+
+    def get(self, name: str):
+        """Returns (kind, value) with value being bytes or a pyarrow Table."""
+        import pyarrow as pa
+
+        entry = self._entry(name)
+        if entry["value"] is not None:
+            return entry["kind"], entry["value"]
+        if entry["kind"] == "table":
+            return "table", pa.ipc.open_file(pa.memory_map(entry["path"])).read_all()
+        with open(entry["path"], "rb") as file:
+            return "bytes", file.read()
+
+    def as_file(self, name: str) -> str:
+        """Path of a file holding the value, for tools that only read files. Tables become CSV."""
+        entry = self._entry(name)
+        if entry["kind"] == "bytes":
+            if entry["path"] is None:
+                self._spill(name, "file_requested")
+            return entry["path"]
+        if entry["rendered"] is None:
+            import pyarrow.csv
+
+            path = self._new_path(name, ".csv")
+            pyarrow.csv.write_csv(self.get(name)[1], path)
+            entry["rendered"] = path
+            self.spills.append({"name": name, "reason": "file_requested", "bytes": os.path.getsize(path)})
+        return entry["rendered"]
+
+    def output_path(self, name: str) -> str:
+        """A fresh path for a tool to write the value of `name` to."""
+        return self._new_path(name, os.path.splitext(name)[1])
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "budget_bytes": self.budget,
+            "peak_bytes": self.peak_bytes,
+            "spills": self.spills,
+            "values": {
+                name: {"kind": entry["kind"], "bytes": entry["bytes"], "in_memory": entry["value"] is not None}
+                for name, entry in self.entries.items()
+            },
+        }
 
-    except HTTPException as e:
+
+def _pipeline_fetch_supported(arguments: Dict[str, Any]) -> bool:
+    # Batch downloads and raw bodies go through the tool itself
+    return (
+        _memory_name(arguments.get("output_location")) is not None
+        and not arguments.get("urls") and arguments.get("decompress", True)
+    )
+
+
+def _pipeline_fetch(memory: PipelineMemory, arguments: Dict[str, Any]):
+    target = _memory_name(arguments.get("output_location"))
+    url = arguments.get("input_location")
+    try:
+        response, cache_status = cached_http_get(
+            url, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+        )
+        record_cache_event("http", cache_status)
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching API data: {str(e)}")
+    memory.put(target, response.content)
+    return {
+        "status": "success",
+        "message": f"API data successfully fetched into {arguments['output_location']}",
+        "cache_status": cache_status,
+        "bytes": len(response.content),
+    }
+
+
+def _pipeline_filter_csv(memory: PipelineMemory, arguments: Dict[str, Any]):
+    import pyarrow as pa
+
+    input_location = arguments["input_location"]
+    output_location = arguments["output_location"]
+    source = _memory_name(input_location)
+    try:
+        if source is not None:
+            kind, value = memory.get(source)
+            df = pd.read_csv(BytesIO(value)) if kind == "bytes" else value.to_pandas()
+        elif not os.path.exists(input_location):
+            raise HTTPException(status_code=404, detail=f"Input file {input_location} does not exist.")
+        else:
+            df = pd.read_csv(input_location)
+
+        target = _memory_name(output_location)
+        if target is not None:
+            memory.put(target, pa.Table.from_pandas(df, preserve_index=False))
+        else:
+            with open(output_location, 'w', encoding='utf-8') as file:
+                write_json_records(file, df.to_dict(orient='records'), default=str)
+    except HTTPException:
         raise
     except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        raise HTTPException(status_code=500, detail="An unexpected error occurred.")
+        raise HTTPException(status_code=500, detail=f"Error processing CSV file: {e}")
+    return {
+        "status": "success",
+        "message": f"CSV data converted to JSON and saved to {output_location}.",
+        "record_count": len(df),
+    }
+
+
+def _bytes_to_table(name: str, value: bytes):
+    """Parses an in-memory file into an Arrow table by its extension; CSV when it has none."""
+    import pyarrow as pa
+
+    extension = os.path.splitext(name)[1].lower()
+    if extension in (".json", ".ndjson", ".jsonl"):
+        df = pd.read_json(BytesIO(value), lines=extension != ".json")
+        return pa.Table.from_pandas(df, preserve_index=False)
+    if extension == ".parquet":
+        import pyarrow.parquet
+
+        return pyarrow.parquet.read_table(pa.BufferReader(value))
+    if extension in (".arrow", ".feather", ".ipc"):
+        return pa.ipc.open_file(pa.BufferReader(value)).read_all()
+    import pyarrow.csv
+
+    return pyarrow.csv.read_csv(pa.BufferReader(value))
+
+
+def _pipeline_sql(memory: PipelineMemory, arguments: Dict[str, Any]):
+    input_location = arguments.get("input_location")
+    query = arguments.get("query")
+    if not input_location or not query:
+        raise HTTPException(status_code=400, detail="Invalid input parameters: input_location and query are required.")
+    source = _memory_name(input_location)
+    target = _memory_name(arguments.get("output_location"))
+    output_location = arguments.get("output_location") if target else _sql_output_location(arguments.get("output_location"))
+
+    try:
+        if source is not None:
+            # The value is queryable under its name without extension, and as "input"
+            kind, value = memory.get(source)
+            table = value if kind == "table" else _bytes_to_table(source, value)
+            conn = duckdb.connect()
+            conn.register(os.path.splitext(source)[0], table)
+            conn.register("input", table)
+            is_duckdb = True
+        else:
+            is_duckdb = input_location.endswith(".duckdb")
+            conn = duckdb.connect(input_location) if is_duckdb else sqlite3.connect(input_location)
+
+        try:
+            if target is not None:
+                schema, batches = _iter_arrow_batches(conn, query, is_duckdb)
+                result_table = _arrow_batches_to_table(schema, batches)
+                memory.put(target, result_table)
+                output_format, row_count = "arrow", result_table.num_rows
+            else:
+                output_format = SQL_OUTPUT_FORMATS.get(os.path.splitext(output_location)[1].lower(), "txt")
+                row_count = _write_query_result(conn, query, is_duckdb, output_location, output_format)
+        finally:
+            conn.close()
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error executing query: {e}")
+    return {
+        "status": "success",
+        "message": f"Query results saved to {output_location}",
+        "format": output_format,
+        "row_count": row_count,
+    }
 
 
-@app.get("/read", response_class=PlainTextResponse)
-async def read_file(path: str = Query(..., description="Path to the file to read")):
+# In-memory forms of tools, as (supports, adapter), used when a step reads or writes a mem://
+# location. Steps an adapter does not support go to the tool itself, with files standing in for
+# the values.
+PIPELINE_ADAPTERS = {
+    "fetch_and_save_api": (_pipeline_fetch_supported, _pipeline_fetch),
+    "filter_csv_to_json": (lambda arguments: True, _pipeline_filter_csv),
+    "run_sql_query": (lambda arguments: True, _pipeline_sql),
+}
+
+
+def run_pipeline_step(memory: PipelineMemory, tool: str, arguments: Dict[str, Any]):
+    """Runs one step and returns (result, handoff), handoff being "memory" or "files"."""
+    memory_arguments = {
+        key: name for key, name in ((key, _memory_name(value)) for key, value in arguments.items())
+        if name is not None
+    }
+    if not memory_arguments:
+        return execute_tool_call(tool, arguments), "files"
+
+    supports, adapter = PIPELINE_ADAPTERS.get(tool, (None, None))
+    if adapter is not None and supports(arguments):
+        # Same limiter, output locks and metrics as execute_tool_call. Not single-flight: the
+        # result lands in this run's memory, so another run could not share it.
+        return _timed_tool_call(tool, arguments, lambda: adapter(memory, arguments)), "memory"
+
+    resolved = dict(arguments)
+    outputs = {}
+    for key, name in memory_arguments.items():
+        if "output" in key:
+            resolved[key] = outputs[name] = memory.output_path(name)
+        else:
+            resolved[key] = memory.as_file(name)
+    result = execute_tool_call(tool, resolved)
+    for name, path in outputs.items():
+        if os.path.isfile(path):
+            memory.put_file(name, path)
+    return result, "files"
+
+
+def plan_pipeline(task_text: str) -> List[Dict[str, Any]]:
+    """Asks the model for the task's tool calls, in order, as pipeline steps."""
+    with observe_stage("routing"):
+        query = query_gpt(task_text, tools, extra_instruction=PIPELINE_INSTRUCTION)
+    tool_calls = query.get("choices", [{}])[0].get("message", {}).get("tool_calls") or []
+    steps = []
+    for tool_call in tool_calls:
+        try:
+            arguments = json.loads(tool_call["function"].get("arguments", "{}"))
+        except json.JSONDecodeError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON arguments: {e}")
+        steps.append({"tool": tool_call["function"]["name"], "arguments": arguments})
+    return steps
+
+
+def run_pipeline(task_text: str, steps: List[Dict[str, Any]], memory_budget: int) -> Dict[str, Any]:
+    started = time.perf_counter()
+    if not steps:
+        steps = plan_pipeline(task_text)
+        if not steps:
+            return {"message": "No tool calls found."}
+    if len(steps) > PIPELINE_MAX_STEPS:
+        raise HTTPException(status_code=400, detail=f"At most {PIPELINE_MAX_STEPS} steps per pipeline")
+    for step in steps:
+        if step["tool"] not in FUNCTIONS:
+            raise HTTPException(status_code=400, detail=f"Function not found: {step['tool']}")
+
+    os.makedirs(PIPELINE_SPILL_DIR, exist_ok=True)
+    memory = PipelineMemory(memory_budget, tempfile.mkdtemp(dir=PIPELINE_SPILL_DIR))
+    records = []
     try:
-        if not os.path.exists(path):
+        for number, step in enumerate(steps, 1):
+            report_progress("pipeline", step=number, steps=len(steps), tool=step["tool"])
+            step_started = time.perf_counter()
+            try:
+                result, handoff = run_pipeline_step(memory, step["tool"], step["arguments"])
+            except HTTPException as e:
+                raise HTTPException(
+                    status_code=e.status_code,
+                    detail=f"Pipeline step {number} ({step['tool']}) failed: {e.detail}",
+                    headers=e.headers,
+                )
+            records.append({
+                "step": number,
+                "tool": step["tool"],
+                "arguments": step["arguments"],
+                "handoff": handoff,
+                "seconds": round(time.perf_counter() - step_started, 4),
+                "result": result,
+            })
+        return {
+            "status": "success",
+            "steps": records,
+            "memory": memory.summary(),
+            "elapsed": round(time.perf_counter() - started, 4),
+        }
+    finally:
+        shutil.rmtree(memory.directory, ignore_errors=True)
+
+
+@app.post("/pipeline")
+async def pipeline(pipeline_request: PipelineRequest):
+    task_text = (pipeline_request.task or "").strip()
+    steps = [{"tool": step.tool, "arguments": step.arguments} for step in pipeline_request.steps or []]
+    if not task_text and not steps:
+        raise HTTPException(status_code=400, detail="Either a task or a list of steps must be provided")
+    loop = asyncio.get_running_loop()
+    async with admission_controller.slot():
+        return await loop.run_in_executor(
+            None, contextvars.copy_context().run,
+            run_pipeline, task_text, steps, max(0, pipeline_request.memory_budget),
+        )
+
+
+@app.get("/stats")
+async def stats():
+    return {
+        "tool_selection": tool_selection_summary(),
+        "single_flight": {
+            flight.name: {"coalesced": flight.coalesced, "in_flight": len(flight._calls)}
+            for flight in (task_single_flight, execution_single_flight)
+        },
+        "outbound": outbound_summary(),
+        "shared_cache": shared_cache.stats(),
+        "admission": {**admission_controller.summary(), "tools": tool_limiter.summary()},
+        "worker_pid": os.getpid(),
+    }
+
+
+REGISTRY.register(StatsCollector())
+
+
+@app.get("/metrics")
+async def metrics():
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # Multi-worker mode: aggregate the per-process metric files of every worker
+        from prometheus_client import CollectorRegistry, multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # Breaker, admission and tool-limiter state is per process: this worker's view
+        registry.register(StatsCollector())
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def _require_profiling():
+    # Profiles hold task text and stacks, so they are only served where profiling is enabled
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+
+
+@app.get("/profiles")
+async def list_profiles():
+    """Slowest recorded /run profiles, without their stacks."""
+    _require_profiling()
+    return {"profiles": profile_store.list()}
+
+
+@app.get("/profiles/{profile_id}")
+async def get_profile(profile_id: str, format: str = Query("json", enum=["json", "folded"])):
+    _require_profiling()
+    recorded = profile_store.get(profile_id)
+    if recorded is None:
+        raise HTTPException(status_code=404, detail=f"Profile {profile_id} not found")
+    if format == "folded":
+        return Response(recorded["folded"], media_type="text/plain")
+    return recorded
+
+
+# Responses smaller than this are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+# /read files at least this large are compressed once into a cached sidecar file
+PRECOMPRESS_MIN_SIZE = int(os.getenv("PRECOMPRESS_MIN_SIZE", str(1024 * 1024)))
+PRECOMPRESS_CACHE_DIR = os.getenv("PRECOMPRESS_CACHE_DIR", ".cache/precompressed")
+
+COMPRESSIBLE_MEDIA_TYPES = (
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/xml",
+    "application/javascript",
+    "image/svg+xml",
+)
+
+
+@lru_cache(maxsize=1)
+def _available_encodings() -> List[str]:
+    """Content encodings this server can produce, in order of preference."""
+    encodings = []
+    try:
+        import zstandard  # noqa: F401
+
+        encodings.append("zstd")
+    except ImportError:
+        pass
+    try:
+        import brotli  # noqa: F401
+
+        encodings.append("br")
+    except ImportError:
+        pass
+    encodings.append("gzip")
+    return encodings
+
+
+def _negotiate_encoding(accept_encoding: str):
+    """Picks the best available encoding from an Accept-Encoding header, or None for identity."""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        match = re.search(r"q\s*=\s*([0-9.]+)", params)
+        if match:
+            try:
+                quality = float(match.group(1))
+            except ValueError:
+                quality = 0.0
+        weights[name.strip().lower()] = quality
+
+    candidates = [
+        (weights.get(encoding, weights.get("*", 0.0)), -rank, encoding)
+        for rank, encoding in enumerate(_available_encodings())
+    ]
+    quality, _, encoding = max(candidates)
+    return encoding if quality > 0 else None
+
+
+def _is_compressible(media_type: str) -> bool:
+    return media_type.startswith(COMPRESSIBLE_MEDIA_TYPES)
+
+
+def _compress_bytes(data: bytes, encoding: str) -> bytes:
+    if encoding == "zstd":
+        import zstandard
+
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if encoding == "br":
+        import brotli
+
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _read_compressed(path: str, encoding: str) -> bytes:
+    """Reads and compresses a file below PRECOMPRESS_MIN_SIZE. Blocking; called off the event loop."""
+    with open(path, 'rb') as file:
+        return _compress_bytes(file.read(), encoding)
+
+
+def _compress_file(source: str, destination: str, encoding: str):
+    """Compresses a file in chunks so large outputs never have to fit in memory."""
+    chunk_size = 1024 * 1024
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        if encoding == "zstd":
+            import zstandard
+
+            zstandard.ZstdCompressor(level=3).copy_stream(src, dst, read_size=chunk_size)
+        elif encoding == "br":
+            import brotli
+
+            compressor = brotli.Compressor(quality=5)
+            while chunk := src.read(chunk_size):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+        else:
+            with gzip.GzipFile(filename="", mode='wb', fileobj=dst, compresslevel=6, mtime=0) as out:
+                shutil.copyfileobj(src, out, chunk_size)
+
+
+def _precompressed_sidecar(path: str, stat_result: os.stat_result, encoding: str) -> str:
+    """
+    Returns the path of a compressed copy of the file, creating it on first use. Sidecars are
+    named after the source's mtime and size, so a changed file gets a fresh one and stale
+    copies of the same file are removed.
+    """
+    os.makedirs(PRECOMPRESS_CACHE_DIR, exist_ok=True)
+    prefix = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()
+    name = f"{prefix}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}.{encoding}"
+    sidecar = os.path.join(PRECOMPRESS_CACHE_DIR, name)
+    if os.path.exists(sidecar):
+        return sidecar
+
+    signature = f"{prefix}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}."
+    for stale in Path(PRECOMPRESS_CACHE_DIR).glob(f"{prefix}-*"):
+        if not stale.name.startswith(signature):
+            stale.unlink(missing_ok=True)
+
+    temp_path = f"{sidecar}.{os.getpid()}.{threading.get_ident()}.tmp"
+    print(f"Precompressing {path} with {encoding}")
+    try:
+        with observe_stage("file_io"):
+            _compress_file(path, temp_path, encoding)
+        os.replace(temp_path, sidecar)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return sidecar
+
+
+class CompressionMiddleware:
+    """
+    Compresses JSON responses with the best encoding the client accepts. Other content types,
+    including /read and streamed responses, pass through untouched.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        encoding = _negotiate_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        body = []
+
+        async def send_wrapper(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    headers.get("content-type", "").startswith("application/json")
+                    and "content-encoding" not in headers
+                ):
+                    start_message = message
+                    return
+            elif message["type"] == "http.response.body" and start_message is not None:
+                body.append(message.get("body", b""))
+                if message.get("more_body", False):
+                    return
+                data = b"".join(body)
+                headers = MutableHeaders(raw=start_message["headers"])
+                if len(data) >= COMPRESSION_MIN_SIZE:
+                    data = _compress_bytes(data, encoding)
+                    headers["Content-Encoding"] = encoding
+                    headers.add_vary_header("Accept-Encoding")
+                headers["Content-Length"] = str(len(data))
+                await send(start_message)
+                await send({"type": "http.response.body", "body": data})
+                return
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+
+app.add_middleware(CompressionMiddleware)
+app.add_middleware(DeadlineMiddleware)
+
+
+def _file_etag(stat_result: os.stat_result, encoding: str = None) -> str:
+    if encoding:
+        return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}-{encoding}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _guess_media_type(path: str) -> str:
+    """Guesses the content type from the extension, sniffing the first bytes when unknown."""
+    media_type = mimetypes.guess_type(path)[0]
+    if media_type is None:
+        with open(path, 'rb') as file:
+            head = file.read(8192)
+        try:
+            head.decode('utf-8')
+            is_text = b"\x00" not in head
+        except UnicodeDecodeError as e:
+            # A multi-byte character may be cut at the end of the sample
+            is_text = e.start >= len(head) - 3 and b"\x00" not in head
+        media_type = "text/plain" if is_text else "application/octet-stream"
+    if media_type.startswith("text/") or media_type in ("application/json", "application/xml"):
+        media_type += "; charset=utf-8"
+    return media_type
+
+
+def _not_modified(request: Request, etags, stat_result: os.stat_result) -> bool:
+    """Evaluates If-None-Match, falling back to If-Modified-Since as RFC 9110 requires."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return any(etag in candidates for etag in etags)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            since = parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+        return int(stat_result.st_mtime) <= since
+    return False
+
+
+@app.api_route("/read", methods=["GET", "HEAD"])
+async def read_file(request: Request, path: str = Query(..., description="Path to the file to read")):
+    """
+    Streams a file from disk. FileResponse handles Range requests and hands the file to the
+    server's zero-copy path send when it supports one; unchanged files get a 304. Compressible
+    files are sent with the negotiated Content-Encoding, large ones from a precompressed sidecar.
+    """
+    try:
+        if not os.path.isfile(path):
             raise HTTPException(status_code=404, detail=f"File not found: {path}")
-        
-        with open(path, 'r', encoding='utf-8') as file:
-            content = file.read()
-            
-        return content
-    
+
+        stat_result = os.stat(path)
+        media_type = _guess_media_type(path)
+        encoding = None
+        if (
+            _is_compressible(media_type)
+            and stat_result.st_size >= COMPRESSION_MIN_SIZE
+            and "range" not in request.headers
+        ):
+            encoding = _negotiate_encoding(request.headers.get("accept-encoding", ""))
+
+        etag = _file_etag(stat_result, encoding)
+        headers = {
+            "ETag": etag,
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True),
+            "Cache-Control": "no-cache",
+        }
+        if _is_compressible(media_type):
+            headers["Vary"] = "Accept-Encoding"
+
+        if _not_modified(request, [etag, _file_etag(stat_result)], stat_result):
+            return Response(status_code=304, headers=headers)
+
+        if encoding is None:
+            return FileResponse(
+                path,
+                headers=headers,
+                media_type=media_type,
+                stat_result=stat_result,
+            )
+
+        headers["Content-Encoding"] = encoding
+        if stat_result.st_size >= PRECOMPRESS_MIN_SIZE:
+            sidecar = await run_in_threadpool(_precompressed_sidecar, path, stat_result, encoding)
+            return FileResponse(sidecar, headers=headers, media_type=media_type)
+
+        content = await run_in_threadpool(_read_compressed, path, encoding)
+        return Response(content=content, headers=headers, media_type=media_type)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading file: {str(e)}")
 
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, port=5000)
+
+    if WORKERS > 1:
+        # Workers are separate processes, so uvicorn needs the import string
+        uvicorn.run("app:app", port=5000, workers=WORKERS)
+    else:
+        uvicorn.run(app, port=5000)
@@ -0,0 +1,6 @@
+"""
+Offline benchmarks for the task functions in app.py.
+
+    python -m benchmarks.runner                      # default scales, results to .cache/benchmarks
+    python -m benchmarks.runner --compare baseline.json
+"""
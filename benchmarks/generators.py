@@ -0,0 +1,141 @@
+"""
+Deterministic synthetic inputs for the benchmarks. Every generator takes a target directory,
+a record count and a seed, writes the same bytes for the same arguments, and returns the path
+the task function should read.
+"""
+import csv
+import json
+import os
+import random
+import sqlite3
+from datetime import date, datetime, timedelta
+
+FIRST_NAMES = ["Ada", "Grace", "Alan", "Linus", "Barbara", "Ken", "Margaret", "Dennis", "Frances", "Edsger"]
+LAST_NAMES = ["Lovelace", "Hopper", "Turing", "Torvalds", "Liskov", "Thompson", "Hamilton", "Ritchie", "Allen", "Dijkstra"]
+WORDS = (
+    "data pipeline latency cache request server query index file stream batch worker "
+    "token model vector report ticket sales gold silver bronze metric trace log user"
+).split()
+CITIES = ["Paris", "Delhi", "Lagos", "Lima", "Osaka", "Oslo", "Quito", "Perth"]
+TICKET_TYPES = ["Gold", "Silver", "Bronze"]
+
+DATE_FORMATS = ["%Y-%m-%d", "%d-%b-%Y", "%Y/%m/%d %H:%M:%S", "%b %d, %Y", "%Y/%m/%d"]
+
+# Directory-based inputs are spread over at most this many files
+MAX_FILES = 2000
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate_dates(directory: str, records: int, seed: int = 0) -> str:
+    """One date per line, mixing every format count_days understands."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "dates.txt")
+    start = datetime(2000, 1, 1)
+    with open(path, "w", encoding="utf-8") as file:
+        for _ in range(records):
+            moment = start + timedelta(seconds=rng.randrange(25 * 365 * 86400))
+            file.write(moment.strftime(rng.choice(DATE_FORMATS)) + "\n")
+    return path
+
+
+def generate_contacts(directory: str, records: int, seed: int = 0) -> str:
+    """A JSON array of contacts with first_name, last_name and email."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "contacts.json")
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("[")
+        for i in range(records):
+            first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+            contact = {"first_name": first, "last_name": last, "email": f"{first}.{last}{i}@example.com".lower()}
+            file.write(("," if i else "") + json.dumps(contact))
+        file.write("]")
+    return path
+
+
+def generate_logs(directory: str, records: int, seed: int = 0) -> str:
+    """A directory of .log files holding `records` lines in total, with distinct mtimes."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "logs")
+    os.makedirs(path, exist_ok=True)
+    files = max(1, min(MAX_FILES, records // 100))
+    per_file = max(1, records // files)
+    base = 1_600_000_000
+    for i in range(files):
+        log_path = os.path.join(path, f"log-{i:05d}.log")
+        with open(log_path, "w", encoding="utf-8") as file:
+            for line in range(per_file):
+                level = rng.choice(["INFO", "WARN", "ERROR", "DEBUG"])
+                file.write(f"{i}:{line} {level} {_sentence(rng, 8)}\n")
+        os.utime(log_path, (base + i, base + i))
+    return path
+
+
+def generate_markdown_docs(directory: str, records: int, seed: int = 0) -> str:
+    """Markdown files under data/docs holding `records` lines in total, each with an H1 title."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "data", "docs")
+    files = max(1, min(MAX_FILES, records // 100))
+    per_file = max(1, records // files)
+    for i in range(files):
+        subdir = os.path.join(path, f"section-{i % 20:02d}")
+        os.makedirs(subdir, exist_ok=True)
+        with open(os.path.join(subdir, f"doc-{i:05d}.md"), "w", encoding="utf-8") as file:
+            # Some files put text before the title so the scan has to read past it
+            for _ in range(rng.randrange(3)):
+                file.write(_sentence(rng, 10) + "\n")
+            file.write(f"# {_sentence(rng, 4).title()}\n")
+            for _ in range(per_file):
+                file.write(_sentence(rng, 12) + "\n")
+    return path
+
+
+def generate_csv(directory: str, records: int, seed: int = 0) -> str:
+    """A CSV with numeric, text and date columns."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "records.csv")
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["id", "name", "city", "amount", "created"])
+        start = date(2020, 1, 1)
+        for i in range(records):
+            writer.writerow([
+                i,
+                f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+                rng.choice(CITIES),
+                round(rng.uniform(1, 1000), 2),
+                (start + timedelta(days=rng.randrange(1500))).isoformat(),
+            ])
+    return path
+
+
+def generate_ticket_db(directory: str, records: int, seed: int = 0) -> str:
+    """A SQLite database with a tickets(type, units, price) table like ticket-sales.db."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "ticket-sales.db")
+    if os.path.exists(path):
+        os.remove(path)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE tickets (type TEXT, units INTEGER, price REAL)")
+    batch = []
+    for _ in range(records):
+        batch.append((rng.choice(TICKET_TYPES), rng.randrange(1, 20), round(rng.uniform(10, 500), 2)))
+        if len(batch) == 50_000:
+            conn.executemany("INSERT INTO tickets VALUES (?, ?, ?)", batch)
+            batch = []
+    conn.executemany("INSERT INTO tickets VALUES (?, ?, ?)", batch)
+    conn.commit()
+    conn.close()
+    return path
+
+
+def generate_comments(directory: str, records: int, seed: int = 0) -> str:
+    """One short comment per line."""
+    rng = random.Random(seed)
+    path = os.path.join(directory, "comments.txt")
+    with open(path, "w", encoding="utf-8") as file:
+        for _ in range(records):
+            file.write(_sentence(rng, rng.randrange(5, 15)) + "\n")
+    return path
@@ -0,0 +1,81 @@
+"""
+Measures how long `import app` takes in a fresh interpreter and fails when it exceeds a budget
+or when a library that should load lazily is imported at start-up.
+
+    python -m benchmarks.import_time                  # budget 0.75 s, best of 5
+    python -m benchmarks.import_time --budget 0.5 --runs 10 --top 15
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Heavy libraries app.py loads on first use or in the background warm-up, never at import
+LAZY_MODULES = ("pandas", "numpy", "duckdb", "bs4", "requests", "pyarrow", "httpx", "lxml", "PIL")
+
+PROBE = """
+import json, sys, time
+started = time.perf_counter()
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({"seconds": elapsed, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+
+def measure_once() -> dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", PROBE % (LAZY_MODULES,)],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def slowest_imports(top: int) -> list:
+    """Returns (cumulative microseconds, module) for the slowest imports under -X importtime."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=REPO_ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, module = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), module.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=0.75, help="seconds allowed for `import app`")
+    parser.add_argument("--runs", type=int, default=5, help="fresh interpreters to time; the best counts")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    args = parser.parse_args(argv)
+
+    samples = [measure_once() for _ in range(args.runs)]
+    seconds = [sample["seconds"] for sample in samples]
+    loaded = sorted({module for sample in samples for module in sample["loaded"]})
+    best = min(seconds)
+
+    print(f"import app: best {best:.3f}s, median {statistics.median(seconds):.3f}s over {args.runs} runs")
+    print(f"budget: {args.budget:.3f}s")
+    print("slowest imports (cumulative):")
+    for microseconds, module in slowest_imports(args.top):
+        print(f"  {microseconds / 1e6:8.3f}s  {module}")
+
+    failed = False
+    if best > args.budget:
+        print(f"FAIL: start-up import took {best:.3f}s, over the {args.budget:.3f}s budget")
+        failed = True
+    if loaded:
+        print(f"FAIL: imported eagerly but expected to load lazily: {', '.join(loaded)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Open-loop load generator for /run: requests are sent on a fixed schedule at the target rate
+whether or not earlier ones have finished, so server slowdowns show up as latency instead of
+being hidden by a slower client.
+
+    python -m benchmarks.mock_aiproxy --latency-ms 200 --jitter-ms 50 &
+    AIPROXY_BASE_URL=http://127.0.0.1:8001/openai/v1 AIPROXY_TOKEN=test uvicorn app:app --port 8000 &
+    python -m benchmarks.loadtest --rps 50 --duration 30 \\
+        --task "Count the number of Wednesdays in /data/dates.txt and write it to /data/dates-wednesdays.txt"
+
+Reports p50/p95/p99 latency, achieved throughput and error rates by status.
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import Counter
+
+import httpx
+
+DEFAULT_TASK = "Count the number of Wednesdays in /data/dates.txt and write it to /data/dates-wednesdays.txt"
+
+
+def percentile(sorted_values: list, fraction: float):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+async def _send(client, url, task, results, started_at):
+    sent = time.perf_counter()
+    try:
+        response = await client.post(url, json={"task": task})
+        status = str(response.status_code)
+    except httpx.TimeoutException:
+        status = "timeout"
+    except httpx.HTTPError as e:
+        status = type(e).__name__
+    results.append({"status": status, "latency": time.perf_counter() - sent, "at": sent - started_at})
+
+
+async def run_load(args) -> dict:
+    tasks = list(args.task or [DEFAULT_TASK])
+    if args.tasks_file:
+        with open(args.tasks_file, encoding="utf-8") as file:
+            tasks += [line.strip() for line in file if line.strip()]
+    rng = random.Random(args.seed)
+    url = args.url.rstrip("/") + "/run"
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    results = []
+    in_flight = set()
+
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        started_at = time.perf_counter()
+        next_at = 0.0
+        count = 0
+        while next_at < args.duration:
+            delay = started_at + next_at - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = tasks[count % len(tasks)]
+            if args.unique:
+                # Distinct text per request so /run cannot coalesce identical tasks
+                task = f"{task} (request {count})"
+            request = asyncio.create_task(_send(client, url, task, results, started_at))
+            in_flight.add(request)
+            request.add_done_callback(in_flight.discard)
+            count += 1
+            interval = 1.0 / args.rps
+            next_at += rng.expovariate(args.rps) if args.poisson else interval
+        await asyncio.gather(*in_flight)
+        elapsed = time.perf_counter() - started_at
+
+    latencies = sorted(r["latency"] for r in results)
+    statuses = Counter(r["status"] for r in results)
+    errors = sum(n for status, n in statuses.items() if not status.startswith("2"))
+    return {
+        "target_rps": args.rps,
+        "duration": args.duration,
+        "sent": count,
+        "completed": len(results),
+        "achieved_rps": round(len(results) / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            name: round(value * 1000, 1) if value is not None else None
+            for name, value in (
+                ("p50", percentile(latencies, 0.50)),
+                ("p95", percentile(latencies, 0.95)),
+                ("p99", percentile(latencies, 0.99)),
+                ("max", latencies[-1] if latencies else None),
+            )
+        },
+        "error_rate": round(errors / len(results), 4) if results else None,
+        "statuses": dict(statuses),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=10, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds of load")
+    parser.add_argument("--task", action="append", help="task text; repeat to rotate several")
+    parser.add_argument("--tasks-file", help="file with one task per line")
+    parser.add_argument("--unique", action="store_true", help="make every task text distinct")
+    parser.add_argument("--poisson", action="store_true", help="exponential inter-arrival times")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max-connections", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="also write the report to this JSON file")
+    parser.add_argument("--max-error-rate", type=float, help="exit 1 when the error rate is higher")
+    parser.add_argument("--max-p99-ms", type=float, help="exit 1 when p99 latency is higher")
+    args = parser.parse_args(argv)
+
+    report = asyncio.run(run_load(args))
+    print(json.dumps(report, indent=4))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=4)
+
+    if args.max_error_rate is not None and (report["error_rate"] or 0) > args.max_error_rate:
+        return 1
+    p99 = report["latency_ms"]["p99"]
+    if args.max_p99_ms is not None and p99 is not None and p99 > args.max_p99_ms:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Local stand-in for the AI proxy's chat-completions and embeddings endpoints, for load tests
+and CI without network access or a token.
+
+    python -m benchmarks.mock_aiproxy --port 8001 --latency-ms 300 --jitter-ms 100 --error-rate 0.02
+    AIPROXY_BASE_URL=http://127.0.0.1:8001/openai/v1 AIPROXY_TOKEN=test uvicorn app:app
+
+Tool calls are chosen deterministically from the tools in the request: the tool whose name
+words best match the task, with arguments filled from the /data paths and weekday names in the
+task text. Batched requests ("Task N: ...") get one call per task. Embeddings are hashed
+bag-of-words vectors, so equal texts always get equal vectors.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.runner import fake_embeddings
+
+MOCK_LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", "0"))
+MOCK_JITTER_MS = float(os.getenv("MOCK_JITTER_MS", "0"))
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", "0"))
+MOCK_ERROR_STATUS = int(os.getenv("MOCK_ERROR_STATUS", "503"))
+MOCK_SEED = int(os.getenv("MOCK_SEED", "0"))
+
+PATH_PATTERN = re.compile(r"/data/[\w./-]*\w")
+TASK_LINE_PATTERN = re.compile(r"^Task (\d+): (.*)$", re.MULTILINE)
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+
+app = FastAPI()
+rng = random.Random(MOCK_SEED)
+stats = {"chat": 0, "embeddings": 0, "errors": 0}
+
+
+async def _simulate_network():
+    """Sleeps for the configured latency and returns an error response when one is injected."""
+    delay = MOCK_LATENCY_MS + rng.uniform(-MOCK_JITTER_MS, MOCK_JITTER_MS)
+    if delay > 0:
+        await asyncio.sleep(delay / 1000)
+    if MOCK_ERROR_RATE and rng.random() < MOCK_ERROR_RATE:
+        stats["errors"] += 1
+        headers = {"Retry-After": "1"} if MOCK_ERROR_STATUS == 429 else {}
+        return JSONResponse(
+            {"error": {"message": "injected failure"}}, status_code=MOCK_ERROR_STATUS, headers=headers
+        )
+    return None
+
+
+def _pick_tool(text: str, tools: list) -> dict:
+    words = set(re.findall(r"[a-z]+", text.lower()))
+
+    def score(tool):
+        name_words = tool["function"]["name"].split("_")
+        return sum(1 for word in name_words if word in words or word.rstrip("s") in words)
+
+    return max(tools, key=score)
+
+
+def _fill_arguments(text: str, tool: dict, task_id: int = None) -> dict:
+    parameters = tool["function"].get("parameters", {})
+    required = set(parameters.get("required", []))
+    paths = PATH_PATTERN.findall(text)
+    weekday = next((day for day in WEEKDAYS if day in text.lower()), "wednesday")
+    arguments = {}
+    for name, spec in parameters.get("properties", {}).items():
+        kind = spec.get("type")
+        if name == "task_id":
+            arguments[name] = task_id
+        elif "enum" in spec:
+            arguments[name] = weekday if weekday in spec["enum"] else spec["enum"][0]
+        elif kind == "string" and ("input" in name or name == "path"):
+            arguments[name] = paths[0] if paths else "/data/input.txt"
+        elif kind == "string" and "output" in name:
+            arguments[name] = paths[1] if len(paths) > 1 else "/data/output.txt"
+        elif kind == "string" and "email" in name:
+            arguments[name] = "user@example.com"
+        elif kind == "string" and name == "url":
+            arguments[name] = "http://127.0.0.1/"
+        elif kind == "string" and name == "query":
+            arguments[name] = "SELECT 1"
+        elif name in required:
+            arguments[name] = {"integer": 1, "number": 1, "boolean": False, "array": []}.get(kind, "x")
+    return arguments
+
+
+def _tool_call(index: int, tool: dict, arguments: dict) -> dict:
+    return {
+        "id": f"call_{index}",
+        "type": "function",
+        "function": {"name": tool["function"]["name"], "arguments": json.dumps(arguments)},
+    }
+
+
+def _message_for(body: dict) -> dict:
+    messages = body.get("messages", [])
+    user = next((m["content"] for m in reversed(messages) if m.get("role") == "user"), "")
+    text = user if isinstance(user, str) else " ".join(
+        part.get("text", "") for part in user if isinstance(part, dict)
+    )
+    tools = body.get("tools") or []
+
+    if tools:
+        tasks = TASK_LINE_PATTERN.findall(text)
+        if tasks:
+            calls = [
+                _tool_call(i, tool, _fill_arguments(task, tool, int(task_id)))
+                for i, (task_id, task) in enumerate(tasks)
+                for tool in [_pick_tool(task, tools)]
+            ]
+        else:
+            tool = _pick_tool(text, tools)
+            calls = [_tool_call(0, tool, _fill_arguments(text, tool))]
+        return {"role": "assistant", "content": None, "tool_calls": calls}
+
+    if body.get("response_format", {}).get("type") == "json_schema":
+        return {"role": "assistant", "content": json.dumps({"IDnumber": "4111111111111111"})}
+    address = re.search(r"[\w.+-]+@[\w-]+(?:\.[\w-]+)+", text)
+    return {"role": "assistant", "content": address.group(0) if address else "<p>mock</p>"}
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    raw = await request.body()
+    stats["chat"] += 1
+    error = await _simulate_network()
+    if error is not None:
+        return error
+    body = json.loads(raw)
+    return {
+        "id": f"chatcmpl-mock-{stats['chat']}",
+        "object": "chat.completion",
+        "model": body.get("model", "gpt-4o-mini"),
+        "choices": [{"index": 0, "message": _message_for(body), "finish_reason": "tool_calls"}],
+        # Roughly four bytes per token, like the tokenizer on JSON-heavy prompts
+        "usage": {"prompt_tokens": len(raw) // 4, "completion_tokens": 20, "total_tokens": len(raw) // 4 + 20},
+    }
+
+
+@app.post("/openai/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    stats["embeddings"] += 1
+    error = await _simulate_network()
+    if error is not None:
+        return error
+    texts = body["input"] if isinstance(body["input"], list) else [body["input"]]
+    vectors = fake_embeddings(texts, dimensions=body.get("dimensions", 256))
+    return {
+        "object": "list",
+        "data": [{"object": "embedding", "index": i, "embedding": v} for i, v in enumerate(vectors)],
+        "model": body.get("model"),
+        "usage": {"prompt_tokens": sum(len(t) // 4 for t in texts), "total_tokens": sum(len(t) // 4 for t in texts)},
+    }
+
+
+@app.get("/stats")
+async def get_stats():
+    return stats
+
+
+def main(argv=None):
+    global MOCK_LATENCY_MS, MOCK_JITTER_MS, MOCK_ERROR_RATE, MOCK_ERROR_STATUS, rng
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=MOCK_LATENCY_MS)
+    parser.add_argument("--jitter-ms", type=float, default=MOCK_JITTER_MS)
+    parser.add_argument("--error-rate", type=float, default=MOCK_ERROR_RATE)
+    parser.add_argument("--error-status", type=int, default=MOCK_ERROR_STATUS)
+    parser.add_argument("--seed", type=int, default=MOCK_SEED)
+    args = parser.parse_args(argv)
+
+    MOCK_LATENCY_MS, MOCK_JITTER_MS = args.latency_ms, args.jitter_ms
+    MOCK_ERROR_RATE, MOCK_ERROR_STATUS = args.error_rate, args.error_status
+    rng = random.Random(args.seed)
+
+    import uvicorn
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+"""
+Runs each task function against generated inputs, one subprocess per case and scale so peak
+RSS is measured in isolation, and writes wall time, peak RSS and throughput to JSON.
+
+    python -m benchmarks.runner --scales 1e3,1e4,1e5 --cases count_days,sort_contacts
+    python -m benchmarks.runner --output baseline.json
+    python -m benchmarks.runner --compare baseline.json --threshold 0.15
+
+Inputs are cached under --data-dir, so repeated runs only pay for generation once. Embeddings
+for find_similar_comments are computed locally, so nothing needs network access.
+"""
+import argparse
+import hashlib
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from benchmarks import generators
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCALES = "1e3,1e4,1e5"
+DEFAULT_DATA_DIR = os.path.join(REPO_ROOT, ".cache", "benchmarks", "data")
+
+# Each case: input generator, the app function, its arguments given (input, output dir), and
+# the largest record count that fits in memory for the function.
+CASES = {
+    "count_days": {
+        "generate": generators.generate_dates,
+        "call": lambda src, out: ("count_days", {
+            "input_location": src,
+            "output_location": os.path.join(out, "dates-wednesday.txt"),
+            "day_name": "wednesday",
+        }),
+    },
+    "sort_contacts": {
+        "generate": generators.generate_contacts,
+        "call": lambda src, out: ("sort_contacts", {
+            "input_location": src, "output_location": os.path.join(out, "contacts-sorted.json"),
+        }),
+    },
+    "write_recent_log_lines": {
+        "generate": generators.generate_logs,
+        "call": lambda src, out: ("write_recent_log_lines", {
+            "input_location": src, "output_location": os.path.join(out, "logs-recent.txt"),
+        }),
+    },
+    "generate_markdown_index": {
+        "generate": generators.generate_markdown_docs,
+        "call": lambda src, out: ("generate_markdown_index", {
+            "input_location": src, "output_location": os.path.join(out, "index.json"),
+        }),
+    },
+    "filter_csv_to_json": {
+        "generate": generators.generate_csv,
+        "call": lambda src, out: ("filter_csv_to_json", {
+            "input_location": src, "output_location": os.path.join(out, "records.json"),
+        }),
+    },
+    "run_sql_query": {
+        "generate": generators.generate_ticket_db,
+        "call": lambda src, out: ("run_sql_query", {
+            "input_location": src,
+            # run_sql_query maps absolute paths under the working directory
+            "output_location": os.path.relpath(os.path.join(out, "gold.csv")),
+            "query": "SELECT * FROM tickets WHERE type = 'Gold'",
+        }),
+    },
+    "find_similar_comments": {
+        "generate": generators.generate_comments,
+        "call": lambda src, out: ("find_similar_comments", {
+            "input_path": src, "output_path": os.path.join(out, "comments-similar.txt"),
+        }),
+        # The similarity matrix is records x records floats
+        "max_records": 5000,
+    },
+}
+
+
+def fake_embeddings(texts, model=None, dimensions=256):
+    """Hashed bag-of-words vectors standing in for the embeddings API."""
+    import numpy as np
+
+    vectors = np.zeros((len(texts), dimensions))
+    for row, text in enumerate(texts):
+        for word in text.split():
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            vectors[row, int.from_bytes(digest[:4], "little") % dimensions] += 1.0
+    vectors[:, 0] += 1e-6  # no zero rows
+    return vectors.tolist()
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def prepare_inputs(case_name: str, records: int, data_dir: str, seed: int) -> tuple[str, str]:
+    """Generates the case's inputs once per (case, records, seed) and returns (work directory, source)."""
+    workdir = os.path.join(data_dir, f"{case_name}-{records}-{seed}")
+    marker = os.path.join(workdir, ".complete")
+    if not os.path.exists(marker):
+        os.makedirs(workdir, exist_ok=True)
+        started = time.perf_counter()
+        source = CASES[case_name]["generate"](workdir, records, seed)
+        with open(marker, "w", encoding="utf-8") as file:
+            json.dump({"source": source, "generated_in": time.perf_counter() - started}, file)
+    with open(marker, encoding="utf-8") as file:
+        return workdir, json.load(file)["source"]
+
+
+def run_worker(case_name: str, records: int, workdir: str, source: str, repeat: int):
+    """Body of the benchmark subprocess: times the function and prints one JSON result."""
+    os.environ.setdefault("DATA_WORKSPACE_ENABLED", "0")
+    # Time the functions themselves, not results served from the shared or build cache
+    os.environ.setdefault("SHARED_CACHE_ENABLED", "0")
+    os.environ.setdefault("BUILD_CACHE_ENABLED", "0")
+    os.chdir(workdir)  # generate_markdown_index reads data/ relative to the working directory
+    sys.path.insert(0, REPO_ROOT)
+    import app
+
+    app.get_openai_embeddings = fake_embeddings
+    # Load the lazily imported libraries up front so the first timed run does not pay for them
+    app.warm_up_imports()
+    output_dir = os.path.join(workdir, "out")
+    os.makedirs(output_dir, exist_ok=True)
+    function_name, arguments = CASES[case_name]["call"](source, output_dir)
+    function = getattr(app, function_name)
+
+    rss_after_import = _peak_rss_mb()
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(**arguments)
+        timings.append(time.perf_counter() - started)
+
+    best = min(timings)
+    print(json.dumps({
+        "case": case_name,
+        "records": records,
+        "wall_seconds": round(best, 6),
+        "wall_seconds_all": [round(t, 6) for t in timings],
+        "records_per_second": round(records / best, 1) if best else None,
+        "peak_rss_mb": _peak_rss_mb(),
+        "rss_after_import_mb": rss_after_import,
+    }))
+
+
+def run_case(case_name: str, records: int, args) -> dict:
+    workdir, source = prepare_inputs(case_name, records, args.data_dir, args.seed)
+    command = [
+        sys.executable, "-m", "benchmarks.runner", "--worker",
+        case_name, str(records), workdir, source, "--repeat", str(args.repeat),
+    ]
+    completed = subprocess.run(
+        command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=args.timeout
+    )
+    if completed.returncode != 0:
+        return {
+            "case": case_name,
+            "records": records,
+            "error": completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "failed",
+        }
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def _git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT,
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, baseline_path: str, threshold: float, min_delta: float) -> list:
+    """Returns the results that got slower or larger than the baseline by more than threshold."""
+    with open(baseline_path, encoding="utf-8") as file:
+        baseline = {
+            (r["case"], r["records"]): r for r in json.load(file)["results"] if "error" not in r
+        }
+    regressions = []
+    for result in results:
+        before = baseline.get((result["case"], result["records"]))
+        if before is None or "error" in result:
+            continue
+        for metric, floor in (("wall_seconds", min_delta), ("peak_rss_mb", 5.0)):
+            old, new = before.get(metric), result.get(metric)
+            if old and new and new > old * (1 + threshold) and new - old > floor:
+                regressions.append({
+                    "case": result["case"],
+                    "records": result["records"],
+                    "metric": metric,
+                    "baseline": old,
+                    "current": new,
+                    "change": f"{(new / old - 1) * 100:+.1f}%",
+                })
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cases", default=",".join(CASES), help="comma-separated case names")
+    parser.add_argument("--scales", default=DEFAULT_SCALES, help="comma-separated record counts, e.g. 1e3,1e7")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the fastest is reported")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR)
+    parser.add_argument("--output", help="results file (default .cache/benchmarks/results-<time>.json)")
+    parser.add_argument("--compare", metavar="BASELINE", help="flag regressions against this results file")
+    parser.add_argument("--threshold", type=float, default=0.10, help="allowed slowdown before flagging")
+    parser.add_argument("--min-delta", type=float, default=0.005, help="ignore wall-time changes below this many seconds")
+    parser.add_argument("--timeout", type=float, default=3600, help="seconds allowed per case")
+    parser.add_argument("--worker", nargs=4, metavar=("CASE", "RECORDS", "WORKDIR", "SOURCE"), help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        case_name, records, workdir, source = args.worker
+        run_worker(case_name, int(records), workdir, source, args.repeat)
+        return 0
+
+    cases = [name.strip() for name in args.cases.split(",") if name.strip()]
+    unknown = [name for name in cases if name not in CASES]
+    if unknown:
+        parser.error(f"unknown cases: {', '.join(unknown)}")
+    scales = [int(float(scale)) for scale in args.scales.split(",") if scale.strip()]
+
+    results = []
+    for case_name in cases:
+        for records in scales:
+            if records > CASES[case_name].get("max_records", records):
+                print(f"{case_name:<24} {records:>10}  skipped (above max_records)")
+                continue
+            result = run_case(case_name, records, args)
+            results.append(result)
+            if "error" in result:
+                print(f"{case_name:<24} {records:>10}  ERROR {result['error']}")
+            else:
+                print(
+                    f"{case_name:<24} {records:>10}  {result['wall_seconds']:>9.4f}s "
+                    f"{result['records_per_second']:>14,.0f} rec/s  {result['peak_rss_mb']} MB"
+                )
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        REPO_ROOT, ".cache", "benchmarks", f"results-{datetime.now():%Y%m%d-%H%M%S}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=4)
+    print(f"Results written to {output}")
+
+    failed = any("error" in result for result in results)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold, args.min_delta)
+        for regression in regressions:
+            print(
+                f"REGRESSION {regression['case']} {regression['records']} {regression['metric']}: "
+                f"{regression['baseline']} -> {regression['current']} ({regression['change']})"
+            )
+        if regressions:
+            return 1
+        print(f"No regressions against {args.compare}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import time
+
+import pytest
+
+# Settings are read when app is imported, so caches go to a scratch directory from the start
+_scratch = tempfile.mkdtemp(prefix="app-tests-")
+for _name in ("SHARED_CACHE_DIR", "HTTP_CACHE_DIR", "PIPELINE_SPILL_DIR", "PRECOMPRESS_CACHE_DIR"):
+    os.environ.setdefault(_name, os.path.join(_scratch, _name.lower()))
+os.environ.setdefault("WARMUP_IMPORTS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+class FakeClock:
+    """Stands in for app's time module: monotonic() and sleep() follow a clock tests move by hand."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+    def advance(self, seconds):
+        self.now += seconds
+
+    def __getattr__(self, name):
+        return getattr(time, name)
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(app_module, "time", fake)
+    return fake
+
+
+@pytest.fixture
+def client():
+    from fastapi.testclient import TestClient
+
+    return TestClient(app_module.app)
@@ -0,0 +1,179 @@
+import asyncio
+import threading
+
+import pytest
+
+
+def make_controller(app, limit=1, queue_size=1, queue_timeout=0.05, latency_target=5.0):
+    return app.AdmissionController(
+        max_limit=limit,
+        min_limit=1,
+        queue_size=queue_size,
+        queue_timeout=queue_timeout,
+        latency_target=latency_target,
+        decrease_factor=0.5,
+    )
+
+
+def test_rejects_with_429_when_queue_is_full(app):
+    controller = make_controller(app, queue_size=0)
+
+    async def scenario():
+        await controller.acquire()
+        with pytest.raises(app.Overloaded) as rejected:
+            await controller.acquire()
+        return rejected.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) >= 1
+    assert controller.rejected["queue_full"] == 1
+    assert controller.in_flight == 1
+
+
+def test_rejects_with_503_after_queue_timeout(app):
+    controller = make_controller(app, queue_size=1, queue_timeout=0.02)
+
+    async def scenario():
+        await controller.acquire()
+        with pytest.raises(app.Overloaded) as rejected:
+            await controller.acquire()
+        return rejected.value
+
+    assert asyncio.run(scenario()).status_code == 503
+    assert controller.rejected["queue_timeout"] == 1
+    assert controller.summary()["queue_depth"] == 0
+
+
+def test_release_hands_the_slot_to_waiters_in_order(app):
+    controller = make_controller(app, queue_size=2, queue_timeout=1)
+    admitted = []
+
+    async def waiter(name):
+        await controller.acquire()
+        admitted.append(name)
+
+    async def scenario():
+        await controller.acquire()
+        tasks = [asyncio.create_task(waiter("first")), asyncio.create_task(waiter("second"))]
+        await asyncio.sleep(0)
+        assert controller.summary()["queue_depth"] == 2
+        controller.release()
+        await asyncio.wait(tasks, timeout=0.1)
+        assert admitted == ["first"]
+        controller.release()
+        await asyncio.gather(*tasks)
+
+    asyncio.run(scenario())
+    assert admitted == ["first", "second"]
+    assert controller.in_flight == 1
+    assert controller.admitted == 3
+
+
+def test_cancelled_waiter_leaves_the_queue(app):
+    controller = make_controller(app, queue_size=1, queue_timeout=1)
+
+    async def scenario():
+        await controller.acquire()
+        task = asyncio.create_task(controller.acquire())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        controller.release()
+
+    asyncio.run(scenario())
+    assert controller.in_flight == 0
+    assert controller.summary()["queue_depth"] == 0
+
+
+def test_limit_shrinks_once_per_window_and_grows_additively(app, clock):
+    controller = make_controller(app, limit=16, latency_target=5.0)
+    controller.record_latency(9.0, ok=True)  # too slow
+    assert controller.limit == 8
+    controller.record_latency(0.1, ok=False)  # same window: no second cut
+    assert controller.limit == 8
+    clock.advance(5)
+    controller.record_latency(0.1, ok=False)
+    assert controller.limit == 4
+    assert controller.decreases == 2
+
+    for _ in range(4):
+        controller.record_latency(0.1, ok=True)
+    assert 4.9 < controller.limit < 5
+
+    for _ in range(10):
+        clock.advance(5)
+        controller.record_latency(9.0, ok=True)
+    assert controller.limit == controller.min_limit
+
+
+def test_zero_latency_target_keeps_the_limit_fixed(app, clock):
+    controller = make_controller(app, limit=8, latency_target=0)
+    controller.record_latency(60.0, ok=False)
+    assert controller.limit == 8
+
+
+def test_tool_limiter_caps_concurrent_calls(app):
+    limiter = app.ToolLimiter({"slow_tool": 1}, timeout=0.02)
+    holding, done = threading.Event(), threading.Event()
+
+    def hold():
+        with limiter.slot("slow_tool"):
+            holding.set()
+            done.wait(1)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    holding.wait(1)
+    with pytest.raises(app.Overloaded) as rejected:
+        with limiter.slot("slow_tool"):
+            pass
+    assert rejected.value.status_code == 503
+    assert limiter.summary()["slow_tool"] == {"limit": 1, "waiting": 0, "rejected": 1}
+
+    with limiter.slot("other_tool"):  # tools without a limit are never held up
+        pass
+    done.set()
+    thread.join()
+    with limiter.slot("slow_tool"):
+        pass
+
+
+@pytest.fixture
+def busy_server(app, monkeypatch):
+    """An admission controller whose only slot is taken, and a router that must not be reached."""
+    def install(queue_size):
+        controller = make_controller(app, queue_size=queue_size, queue_timeout=0.02)
+        controller.in_flight = 1
+        monkeypatch.setattr(app, "admission_controller", controller)
+        return controller
+
+    def route(task_text):
+        raise AssertionError("a shed request must not be routed")
+
+    monkeypatch.setattr(app, "route_and_execute", route)
+    return install
+
+
+def test_run_sheds_with_429_when_queue_is_full(busy_server, client):
+    busy_server(queue_size=0)
+    response = client.post("/run", params={"task": "count the wednesdays"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+
+
+def test_run_sheds_with_503_after_queue_timeout(busy_server, client):
+    busy_server(queue_size=1)
+    response = client.post("/run", params={"task": "count the wednesdays"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+
+
+def test_run_releases_its_slot(app, client, monkeypatch):
+    controller = make_controller(app, limit=1, queue_size=0)
+    monkeypatch.setattr(app, "admission_controller", controller)
+    monkeypatch.setattr(app, "route_and_execute", lambda task_text: {"status": "success"})
+    for _ in range(2):
+        assert client.post("/run", params={"task": "count the wednesdays"}).json() == {"status": "success"}
+    assert controller.in_flight == 0
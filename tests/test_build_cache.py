@@ -0,0 +1,91 @@
+import functools
+import os
+
+import pytest
+from fastapi import HTTPException
+
+
+@pytest.fixture
+def dates(app, tmp_path, monkeypatch):
+    """A dates file in a fresh working directory, and a count of real count_days runs."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs("data")
+    with open("data/dates.txt", "w", encoding="utf-8") as file:
+        file.write("2024-01-03\n2024-01-10\n2024-01-11\n")
+    runs = []
+    count_days = app.FUNCTIONS["count_days"]
+
+    @functools.wraps(count_days)
+    def counted(**arguments):
+        runs.append(arguments["day_name"])
+        return count_days(**arguments)
+
+    monkeypatch.setitem(app.FUNCTIONS, "count_days", counted)
+    return runs
+
+
+def count(app, day_name="Wednesday"):
+    arguments = {"input_location": "data/dates.txt", "output_location": "data/out.txt", "day_name": day_name}
+    return app.run_with_build_cache("count_days", arguments)
+
+
+def test_unchanged_inputs_and_outputs_hit(app, dates):
+    assert count(app)["cache_status"] == "miss"
+    result = count(app)
+    assert result["cache_status"] == "hit"
+    assert result["count"] == 2
+    assert dates == ["Wednesday"]
+
+
+def test_arguments_are_part_of_the_key(app, dates):
+    count(app)
+    assert count(app, "Thursday")["cache_status"] == "miss"
+    assert dates == ["Wednesday", "Thursday"]
+
+
+def test_changed_input_misses(app, dates):
+    count(app)
+    with open("data/dates.txt", "a", encoding="utf-8") as file:
+        file.write("2024-01-17\n")
+    result = count(app)
+    assert result["cache_status"] == "miss"
+    assert result["count"] == 3
+
+
+def test_same_size_edit_within_mtime_granularity_misses(app, dates):
+    count(app)
+    stat = os.stat("data/dates.txt")
+    with open("data/dates.txt", "w", encoding="utf-8") as file:
+        file.write("2024-01-04\n2024-01-10\n2024-01-11\n")
+    os.utime("data/dates.txt", ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    result = count(app)
+    assert result["cache_status"] == "miss"
+    assert result["count"] == 1
+
+
+@pytest.mark.parametrize("damage", ["edit", "delete"])
+def test_changed_output_misses(app, dates, damage):
+    count(app)
+    if damage == "delete":
+        os.remove("data/dates-wednesday.txt")
+    else:
+        with open("data/dates-wednesday.txt", "w", encoding="utf-8") as file:
+            file.write("99")
+    assert count(app)["cache_status"] == "miss"
+    with open("data/dates-wednesday.txt", encoding="utf-8") as file:
+        assert file.read() == "2"
+
+
+def test_disabled_cache_always_runs(app, dates, monkeypatch):
+    monkeypatch.setattr(app, "BUILD_CACHE_ENABLED", False)
+    count(app)
+    assert "cache_status" not in count(app)
+    assert dates == ["Wednesday", "Wednesday"]
+
+
+def test_missing_arguments_skip_the_cache_and_are_rejected(app, dates):
+    assert app.BUILD_RULES["count_days"]({"input_location": "data/dates.txt", "output_location": "x"}) is None
+    with pytest.raises(HTTPException) as rejected:
+        app.execute_tool_call("count_days", {"input_location": "data/dates.txt", "output_location": "x"})
+    assert rejected.value.status_code == 400
+    assert dates == []
@@ -0,0 +1,160 @@
+import pytest
+import requests
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+
+
+@pytest.fixture
+def proxy(app, clock, monkeypatch):
+    """Fresh breaker and retry budget, and a fake transport answering from a list of outcomes."""
+    breaker = app.CircuitBreaker(threshold=2, reset_timeout=30)
+    monkeypatch.setattr(app, "aiproxy_breaker", breaker)
+    monkeypatch.setattr(app, "aiproxy_retry_budget", app.RetryBudget(0.1, max_tokens=10))
+    monkeypatch.setattr(app, "OUTBOUND_MAX_RETRIES", 3)
+    outcomes, sent = [], []
+
+    def send(url, body, headers, timeout):
+        sent.append(url)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    monkeypatch.setattr(app, "_send_hedged", send)
+    return breaker, outcomes, sent
+
+
+def test_breaker_opens_after_threshold_and_rejects(app, clock):
+    breaker = app.CircuitBreaker(threshold=3, reset_timeout=30)
+    for _ in range(2):
+        assert breaker.allow()
+        breaker.record(False)
+    assert breaker.state == "closed"
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.trips == 1
+    assert not breaker.allow()
+    assert breaker.rejected == 1
+
+
+def test_breaker_success_resets_failure_count(app, clock):
+    breaker = app.CircuitBreaker(threshold=2, reset_timeout=30)
+    breaker.record(False)
+    breaker.record(True)
+    breaker.record(False)
+    assert breaker.state == "closed"
+
+
+def test_breaker_half_open_allows_a_single_trial(app, clock):
+    breaker = app.CircuitBreaker(threshold=1, reset_timeout=30)
+    breaker.record(False)
+    clock.advance(29.9)
+    assert not breaker.allow()
+    clock.advance(0.1)
+    assert breaker.allow()
+    assert breaker.state == "half_open"
+    assert not breaker.allow()  # the trial is still in flight
+
+    breaker.record(True)
+    assert breaker.state == "closed"
+    assert breaker.allow() and breaker.allow()
+
+
+def test_breaker_failed_trial_reopens_for_a_full_timeout(app, clock):
+    breaker = app.CircuitBreaker(threshold=1, reset_timeout=30)
+    breaker.record(False)
+    clock.advance(30)
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == "open"
+    assert breaker.trips == 2
+    clock.advance(29)
+    assert not breaker.allow()
+    clock.advance(1)
+    assert breaker.allow()
+
+
+def test_retry_budget_runs_out_and_refills(app):
+    budget = app.RetryBudget(0.5, max_tokens=2)
+    assert budget.withdraw() and budget.withdraw()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert not budget.withdraw()
+    budget.deposit()
+    assert budget.withdraw()
+    for _ in range(10):
+        budget.deposit()
+    assert budget.tokens == 2
+
+
+def test_aiproxy_post_retries_retryable_status(app, proxy, clock):
+    breaker, outcomes, sent = proxy
+    outcomes.extend([FakeResponse(503), FakeResponse(200)])
+    assert app.aiproxy_post("/chat", {}).status_code == 200
+    assert len(sent) == 2
+    assert len(clock.slept) == 1
+    assert breaker.state == "closed"
+
+
+def test_aiproxy_post_honours_capped_retry_after(app, proxy, clock, monkeypatch):
+    monkeypatch.setattr(app, "OUTBOUND_BACKOFF_MAX", 8.0)
+    _, outcomes, _ = proxy
+    outcomes.extend([FakeResponse(429, {"Retry-After": "3600"}), FakeResponse(200)])
+    app.aiproxy_post("/chat", {})
+    assert clock.slept == [8.0]
+
+
+def test_aiproxy_post_gives_up_when_retry_budget_is_spent(app, proxy, monkeypatch):
+    _, outcomes, sent = proxy
+    monkeypatch.setattr(app, "aiproxy_retry_budget", app.RetryBudget(0.1, max_tokens=0))
+    outcomes.extend([FakeResponse(502), FakeResponse(200)])
+    assert app.aiproxy_post("/chat", {}).status_code == 502
+    assert len(sent) == 1
+
+
+def test_aiproxy_post_raises_last_connection_error(app, proxy):
+    breaker, outcomes, sent = proxy
+    breaker.threshold = 10
+    outcomes.extend([requests.exceptions.ConnectionError("down")] * 4)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        app.aiproxy_post("/chat", {})
+    assert len(sent) == 4  # the first attempt and OUTBOUND_MAX_RETRIES retries
+
+
+def test_aiproxy_post_stops_retrying_once_the_breaker_opens(app, proxy):
+    breaker, outcomes, sent = proxy
+    outcomes.extend([requests.exceptions.ConnectionError("down")] * 4)
+    with pytest.raises(app.OutboundUnavailable):
+        app.aiproxy_post("/chat", {})
+    assert len(sent) == 2
+    assert breaker.state == "open"
+
+
+def test_aiproxy_post_fails_fast_while_open(app, proxy):
+    breaker, outcomes, sent = proxy
+    breaker.record(False)
+    breaker.record(False)
+    with pytest.raises(app.OutboundUnavailable):
+        app.aiproxy_post("/chat", {})
+    assert sent == []
+
+
+@pytest.mark.parametrize("error", [requests.exceptions.TooManyRedirects("loop"), ValueError("bad body")])
+def test_aiproxy_post_releases_half_open_trial_on_any_error(app, proxy, clock, error):
+    breaker, outcomes, _ = proxy
+    breaker.record(False)
+    breaker.record(False)
+    clock.advance(30)
+    outcomes.append(error)
+    with pytest.raises(type(error)):
+        app.aiproxy_post("/chat", {})
+    assert breaker.state == "open"
+    assert not breaker._trial_in_flight
+    clock.advance(30)
+    outcomes.append(FakeResponse(200))
+    assert app.aiproxy_post("/chat", {}).status_code == 200
+    assert breaker.state == "closed"
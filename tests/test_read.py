@@ -0,0 +1,117 @@
+import gzip
+import os
+
+import pytest
+
+BINARY = bytes(range(256)) * 16
+
+
+@pytest.fixture
+def binary_file(tmp_path):
+    path = tmp_path / "blob.bin"
+    path.write_bytes(BINARY)
+    return str(path)
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("a line of notes\n" * 500, encoding="utf-8")
+    return str(path)
+
+
+def test_missing_file_is_404(client, tmp_path):
+    response = client.get("/read", params={"path": str(tmp_path / "missing.txt")})
+    assert response.status_code == 404
+
+
+def test_full_read_carries_validators(client, binary_file):
+    response = client.get("/read", params={"path": binary_file})
+    assert response.status_code == 200
+    assert response.content == BINARY
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+    assert "Content-Encoding" not in response.headers
+
+
+def test_range_request_returns_206(client, binary_file):
+    response = client.get("/read", params={"path": binary_file}, headers={"Range": "bytes=10-19"})
+    assert response.status_code == 206
+    assert response.content == BINARY[10:20]
+    assert response.headers["Content-Range"] == f"bytes 10-19/{len(BINARY)}"
+
+
+def test_unsatisfiable_range_is_416(client, binary_file):
+    response = client.get(
+        "/read", params={"path": binary_file}, headers={"Range": f"bytes={len(BINARY) + 10}-"}
+    )
+    assert response.status_code == 416
+
+
+def test_matching_etag_is_304(client, binary_file):
+    etag = client.get("/read", params={"path": binary_file}).headers["ETag"]
+    response = client.get("/read", params={"path": binary_file}, headers={"If-None-Match": etag})
+    assert response.status_code == 304
+    assert response.content == b""
+
+
+def test_changed_file_gets_a_new_etag(client, binary_file):
+    etag = client.get("/read", params={"path": binary_file}).headers["ETag"]
+    with open(binary_file, "ab") as file:
+        file.write(b"more")
+    response = client.get("/read", params={"path": binary_file}, headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != etag
+
+
+def test_if_modified_since_is_304(client, binary_file):
+    last_modified = client.get("/read", params={"path": binary_file}).headers["Last-Modified"]
+    response = client.get(
+        "/read", params={"path": binary_file}, headers={"If-Modified-Since": last_modified}
+    )
+    assert response.status_code == 304
+
+
+def test_text_is_compressed_when_accepted(client, text_file):
+    response = client.get(
+        "/read", params={"path": text_file}, headers={"Accept-Encoding": "gzip"}
+    )
+    assert response.status_code == 200
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["Vary"] == "Accept-Encoding"
+    with open(text_file, "rb") as file:
+        assert response.content == file.read()  # the client decodes gzip
+
+
+def test_etag_is_per_representation(client, text_file):
+    compressed = client.get("/read", params={"path": text_file}, headers={"Accept-Encoding": "gzip"})
+    for accept, status in (("gzip", 304), ("identity", 200)):
+        response = client.get(
+            "/read",
+            params={"path": text_file},
+            headers={"Accept-Encoding": accept, "If-None-Match": compressed.headers["ETag"]},
+        )
+        assert response.status_code == status
+
+
+def test_range_request_is_never_compressed(client, text_file):
+    response = client.get(
+        "/read",
+        params={"path": text_file},
+        headers={"Accept-Encoding": "gzip", "Range": "bytes=0-9"},
+    )
+    assert response.status_code == 206
+    assert "Content-Encoding" not in response.headers
+    assert response.content == b"a line of "
+
+
+def test_large_file_is_served_from_a_sidecar(app, client, text_file, monkeypatch):
+    monkeypatch.setattr(app, "PRECOMPRESS_MIN_SIZE", 1024)
+    response = client.get("/read", params={"path": text_file}, headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    with open(text_file, "rb") as file:
+        assert response.content == file.read()
+    sidecars = [name for name in os.listdir(app.PRECOMPRESS_CACHE_DIR) if name.endswith(".gzip")]
+    assert sidecars
+    with open(os.path.join(app.PRECOMPRESS_CACHE_DIR, sidecars[0]), "rb") as file:
+        assert gzip.decompress(file.read()).startswith(b"a line of notes")
@@ -0,0 +1,94 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+
+def test_concurrent_calls_share_one_execution(app):
+    flight = app.SingleFlight("test")
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        release.wait(1)
+        return {"value": len(calls)}
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        leader = executor.submit(flight.do, "key", work)
+        started.wait(1)
+        follower = executor.submit(flight.do, "key", work)
+        for _ in range(1000):
+            if flight.coalesced:
+                break
+            time.sleep(0.001)
+        release.set()
+        assert leader.result() is follower.result()
+    assert calls == [1]
+
+
+def test_key_is_released_after_the_call(app):
+    flight = app.SingleFlight("test")
+    calls = []
+    flight.do("key", calls.append, "first")
+    flight.do("key", calls.append, "second")
+    assert calls == ["first", "second"]
+    assert flight._calls == {}
+
+
+def test_exception_reaches_every_caller_and_releases_the_key(app):
+    flight = app.SingleFlight("test")
+
+    def fail():
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        flight.do("key", fail)
+    assert flight._calls == {}
+    assert flight.do("key", lambda: "recovered") == "recovered"
+
+
+def test_async_callers_share_one_execution(app):
+    flight = app.SingleFlight("test")
+    release = threading.Event()
+    calls = []
+
+    def work(value):
+        calls.append(value)
+        release.wait(1)
+        return value * 2
+
+    async def scenario():
+        first = asyncio.create_task(flight.do_async("key", work, 21))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(flight.do_async("key", work, 21))
+        await asyncio.sleep(0.01)
+        release.set()
+        return await asyncio.gather(first, second)
+
+    assert asyncio.run(scenario()) == [42, 42]
+    assert calls == [21]
+    assert flight._calls == {}
+
+
+def test_cancelled_leader_does_not_cancel_the_call(app):
+    flight = app.SingleFlight("test")
+    release = threading.Event()
+
+    def work():
+        release.wait(1)
+        return "done"
+
+    async def scenario():
+        leader = asyncio.create_task(flight.do_async("key", work))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(flight.do_async("key", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        release.set()
+        return await follower
+
+    assert asyncio.run(scenario()) == "done"